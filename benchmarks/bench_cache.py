@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Frame cache benchmark
+
+Compares load time and disk footprint of the cache entry formats:
+plain npy (the format used before the cache had options), memory
+mapped npy and compressed npz.
+
+    python benchmarks/bench_cache.py --frames 50 --size 1000
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from cbersgif.cache import FrameCache
+
+def synthetic_frame(size, seed):
+    '''
+    Smooth image plus noise, roughly as compressible as a CBERS band
+    '''
+    rng = np.random.RandomState(seed)
+    rows, cols = np.mgrid[0:size, 0:size]
+    base = 80 + 40 * np.sin(rows / 37.0 + seed) * np.cos(cols / 53.0)
+    return (base + rng.normal(0, 4, (size, size))).clip(1, 255).\
+        astype(np.uint8)
+
+def bench(name, cache, frames):
+    '''
+    Time put and get (including a full pass over the data, as done
+    by the enhancement step) for all frames
+    '''
+    start = time.perf_counter()
+    for index, frame in enumerate(frames):
+        cache.put(str(index), frame)
+    put_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    total = 0
+    for index in range(len(frames)):
+        total += int(cache.get(str(index)).sum(dtype=np.uint64))
+    get_time = time.perf_counter() - start
+
+    print('{:<12} put {:8.3f}s  get {:8.3f}s  disk {:10.1f} MB'.format(
+        name, put_time, get_time, cache.stats()['bytes'] / 1024 ** 2))
+    return total
+
+def main():
+    """main"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=30)
+    parser.add_argument('--size', type=int, default=1000)
+    args = parser.parse_args()
+
+    frames = [synthetic_frame(args.size, seed) for seed in range(args.frames)]
+    print('{} frames of {}x{}'.format(args.frames, args.size, args.size))
+
+    results = set()
+    for name, kwargs in (('npy', {'fmt': 'npy', 'mmap': False}),
+                         ('npy mmap', {'fmt': 'npy', 'mmap': True}),
+                         ('npz', {'fmt': 'npz'})):
+        with tempfile.TemporaryDirectory() as directory:
+            results.add(bench(name, FrameCache(directory, 10 ** 12, **kwargs),
+                              frames))
+    assert len(results) == 1, 'Formats returned distinct data'
+
+if __name__ == '__main__':
+    main()
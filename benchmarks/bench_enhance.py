@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Enhancement microbenchmark
+
+Compares the original per band np.percentile + linear_rescale path
+with the cbersgif.enhance stack functions.
+
+    python benchmarks/bench_enhance.py --size 2000 --dtype uint16
+"""
+
+import argparse
+import timeit
+
+import numpy as np
+
+from cbersgif import enhance
+from cbersgif.utils import linear_rescale
+
+def original(stack, percents):
+    '''
+    Stretch as done by the cli before cbersgif.enhance
+    '''
+    out = np.zeros(stack.shape, dtype=np.uint8)
+    for band_no, matrix in enumerate(stack):
+        p_min_value, p_max_value = np.percentile(matrix[matrix > 0], percents)
+        matrix = np.where(matrix > 0,
+                          linear_rescale(matrix,
+                                         in_range=[int(p_min_value),
+                                                   int(p_max_value)],
+                                         out_range=[1, 255]),
+                          0)
+        out[band_no] = 1.0 * matrix
+    return np.dstack(out)
+
+def vectorized(stack, percents):
+    '''
+    Stretch using cbersgif.enhance
+    '''
+    rgb = np.empty(stack.shape[1:] + (stack.shape[0],), dtype=np.uint8)
+    p_min_value, p_max_value = enhance.compute_stretch(stack, percents)
+    enhance.stretch_stack(stack, p_min_value, p_max_value,
+                          out=np.moveaxis(rgb, 2, 0))
+    return rgb
+
+def main():
+    """main"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=1000)
+    parser.add_argument('--dtype', choices=['uint8', 'uint16'],
+                        default='uint8')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    max_value = 256 if args.dtype == 'uint8' else 1024
+    stack = rng.randint(0, max_value, (3, args.size, args.size)).\
+        astype(args.dtype)
+    stack[:, :args.size // 10] = 0
+
+    assert np.array_equal(original(stack, (2, 98)),
+                          vectorized(stack, (2, 98)))
+
+    print('3x{0}x{0} {1}'.format(args.size, args.dtype))
+    for name, func in (('original', original), ('vectorized', vectorized)):
+        best = min(timeit.repeat(lambda func=func: func(stack, (2, 98)),
+                                 number=1, repeat=args.repeat))
+        print('{:<12} {:8.4f}s'.format(name, best))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+GIF encoding benchmark
+
+Compares encoding time and output size of the per frame imageio
+quantization (the writer used before cbersgif.gif), the global palette
+and the global palette with inter frame deltas. Frames are synthetic
+RGB composites of a slowly changing scene, annotated as in the
+animations.
+
+    python benchmarks/bench_gif.py --frames 30 --size 1000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from cbersgif import gif
+from cbersgif.utils import AnimatedGifWriter, annotate_frame
+
+def synthetic_frames(count, size, changed):
+    '''
+    Smooth RGB scene plus noise, a changed fraction of the rows differs
+    from frame to frame (clouds, new clearings)
+    '''
+    rng = np.random.RandomState(0)
+    rows, cols = np.mgrid[0:size, 0:size]
+    base = np.dstack([80 + 40 * np.sin(rows / 37.0 + band) *
+                      np.cos(cols / 53.0) for band in range(3)])
+    base = (base + rng.normal(0, 4, base.shape)).clip(1, 255)
+    images = list()
+    for index in range(count):
+        frame = base.copy()
+        start = rng.randint(0, size)
+        stop = min(size, start + int(size * changed))
+        frame[start:stop] += rng.normal(30, 20, frame[start:stop].shape)
+        image = Image.fromarray(frame.clip(1, 255).astype(np.uint8), 'RGB')
+        images.append(annotate_frame(image, '{} 2018-09-11'.format(index)))
+    return images
+
+def bench(name, writer, images):
+    '''
+    Time the encoding of all images
+    '''
+    start = time.perf_counter()
+    with writer:
+        for image in images:
+            writer.append(image)
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(writer.filename)
+    print('{:<16} {:8.3f}s  {:10.1f} KB'.format(name, elapsed, size / 1024))
+
+def main():
+    """main"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=30)
+    parser.add_argument('--size', type=int, default=1000)
+    parser.add_argument('--changed', type=float, default=0.2,
+                        help='Fraction of the rows changed in each frame')
+    args = parser.parse_args()
+
+    images = synthetic_frames(args.frames, args.size, args.changed)
+    print('{} frames of {}x{}'.format(args.frames, args.size, args.size))
+
+    with tempfile.TemporaryDirectory() as directory:
+        def output(name):
+            return os.path.join(directory, '{}.gif'.format(name))
+        bench('imageio', AnimatedGifWriter(output('frame'), 0.5, 'frame'),
+              images)
+        bench('global', gif.GifEncoder(output('global'), 0.5, delta=False),
+              images)
+        bench('global delta', gif.GifEncoder(output('delta'), 0.5), images)
+
+if __name__ == '__main__':
+    main()
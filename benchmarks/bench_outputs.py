@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+Output format benchmark
+
+Compares encoding time and output size of the animation formats
+selected by the output extension, see cbersgif.sinks: the default GIF
+writer, lossy and lossless animated WebP and, when ffmpeg is available,
+MP4 and WebM. Frames are the synthetic ones of bench_gif.py.
+
+    python benchmarks/bench_outputs.py --frames 30 --size 1000
+"""
+
+import argparse
+import os
+import tempfile
+
+from bench_gif import bench, synthetic_frames
+
+from cbersgif import sinks
+
+def main():
+    """main"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=30)
+    parser.add_argument('--size', type=int, default=1000)
+    parser.add_argument('--changed', type=float, default=0.2,
+                        help='Fraction of the rows changed in each frame')
+    args = parser.parse_args()
+
+    images = synthetic_frames(args.frames, args.size, args.changed)
+    print('{} frames of {}x{}'.format(args.frames, args.size, args.size))
+
+    with tempfile.TemporaryDirectory() as directory:
+        def output(name):
+            return os.path.join(directory, name)
+        bench('gif', sinks.get_writer(output('out.gif'), 0.5), images)
+        bench('webp', sinks.WebPWriter(output('lossy.webp'), 0.5), images)
+        bench('webp lossless',
+              sinks.WebPWriter(output('lossless.webp'), 0.5, lossless=True),
+              images)
+        if sinks.ffmpeg_exe() is None:
+            print('ffmpeg not found, mp4 and webm skipped')
+            return
+        for extension in sorted(sinks.VIDEO_CODECS):
+            bench(extension[1:], sinks.get_writer(output('out' + extension),
+                                                  0.5), images)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+"""
+Offline end to end benchmark
+
+Generates a synthetic archive of CBERS named MUX scenes (tiled, deflate
+compressed GeoTIFFs with internal overviews, the layout read by
+get_scene_stack), serves it with HTTP range requests and a fake STAC
+/search from a local server, and times GIF generation with the stage
+timers of cbersgif.profiling for every combination of scene count, AOI
+size and workers. Each case is run with a cold and a warm frame cache.
+
+Results may be saved and compared with a previous run, the script exits
+with status 1 if a case is slower than the baseline by more than
+--threshold.
+
+    python benchmarks/bench_pipeline.py --scenes 5,20 \\
+        --buffer_size 2000,10000 --workers 1,4 --output new.json \\
+        --baseline old.json
+"""
+
+import argparse
+import contextlib
+import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import rasterio as rio
+import rasterio.shutil
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+
+from cbersgif import profiling, utils
+from cbersgif.cache import FrameCache
+from cbersgif.geometry import get_transformer
+from cbersgif.render import GifJob, render_gif
+
+# Copacabana
+LON = -43.182365
+LAT = -22.970722
+
+BANDS = (5, 6, 7)
+REVISIT_DAYS = 26
+FIRST_DATE = datetime.date(2018, 1, 5)
+
+def scene_ids(count):
+    '''
+    MUX scene ids, one per CBERS-4 revisit
+    '''
+    return ['CBERS_4_MUX_{}_151_126_L4'.format(
+        (FIRST_DATE + datetime.timedelta(days=REVISIT_DAYS * index)).
+        strftime('%Y%m%d')) for index in range(count)]
+
+def synthetic_band(size, band, scene_no):
+    '''
+    Smooth terrain, noise and a bright blob moving from scene to scene
+    '''
+    rng = np.random.RandomState(scene_no * 10 + band)
+    rows, cols = np.mgrid[0:size, 0:size].astype(np.float32)
+    data = 60 + band * 8 + 30 * np.sin(rows / 97.0) * np.cos(cols / 131.0)
+    data += rng.normal(0, 5, (size, size))
+    center = (scene_no * 173) % size
+    data[np.hypot(rows - center, cols - size / 2.0) < size / 10.0] = 230
+    return data.clip(1, 255).astype(np.uint8)
+
+def write_band(filename, data, transform):
+    '''
+    Tiled GeoTIFF with the overviews stored before the full resolution
+    data, as in a COG
+    '''
+    with tempfile.NamedTemporaryFile(suffix='.tif') as tmp:
+        with rio.open(tmp.name, 'w', driver='GTiff', width=data.shape[1],
+                      height=data.shape[0], count=1, dtype='uint8',
+                      crs='EPSG:32723', transform=transform,
+                      nodata=0) as dst:
+            dst.write(data, 1)
+            dst.build_overviews([2, 4, 8, 16], Resampling.average)
+        rasterio.shutil.copy(tmp.name, filename, driver='GTiff', tiled=True,
+                             blockxsize=512, blockysize=512,
+                             compress='deflate', copy_src_overviews=True)
+
+def build_archive(directory, count, size, res):
+    '''
+    Synthetic archive of count scenes, size x size pixels at res meters
+    centered on LON, LAT
+
+    :return: scene ids
+    '''
+    x_center, y_center = get_transformer('epsg:4326',
+                                         'epsg:32723').transform(LON, LAT)
+    transform = from_origin(x_center - size * res / 2.0,
+                            y_center + size * res / 2.0, res, res)
+    ids = scene_ids(count)
+    for scene_no, stac_id in enumerate(ids):
+        scene = utils.stac_to_aws_sat_api(stac_id)
+        scene_dir = os.path.join(directory, scene['key'])
+        os.makedirs(scene_dir)
+        for band in BANDS:
+            write_band(os.path.join(scene_dir, '{}_BAND{}.tif'.format(
+                stac_id, band)), synthetic_band(size, band, scene_no),
+                       transform)
+    return ids
+
+class ArchiveServer:
+    """
+    Local HTTP server for the archive files, with range requests, and
+    a STAC /search endpoint paginated through 'next' links. Files are
+    served under any first path component, /<run>/CBERS4/..., so each
+    run may use new URLs and start with an empty GDAL HTTP cache.
+    Served requests and bytes are counted.
+    """
+
+    def __init__(self, directory, ids):
+        self.directory = directory
+        self.items = [{'type': 'Feature', 'id': stac_id,
+                       'properties': {'datetime': '{}-{}-{}T13:00:00Z'.
+                                      format(stac_id[12:16], stac_id[16:18],
+                                             stac_id[18:20])}}
+                      for stac_id in ids]
+        self.stats = {'requests': 0, 'bytes': 0}
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Request handler"""
+            def do_HEAD(self): # pylint: disable=invalid-name
+                """File size"""
+                server.send_file(self, head=True)
+
+            def do_GET(self): # pylint: disable=invalid-name
+                """File, or a byte range of it"""
+                server.send_file(self, head=False)
+
+            def do_POST(self): # pylint: disable=invalid-name
+                """Search"""
+                length = int(self.headers['Content-Length'])
+                body = json.loads(self.rfile.read(length))
+                data = json.dumps(server.search(body)).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/geo+json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args): # pylint: disable=arguments-differ
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self.search_url = self.url + '/search'
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+
+    def send_file(self, handler, head):
+        '''
+        Answer a HEAD or GET request for an archive file
+        '''
+        path = os.path.join(self.directory,
+                            *handler.path.split('?')[0].split('/')[2:])
+        if not os.path.isfile(path):
+            handler.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        ranged = handler.headers.get('Range', '').startswith('bytes=')
+        if ranged:
+            first, last = handler.headers['Range'][6:].split('-')
+            start = int(first)
+            end = min(size - 1, int(last)) if last else size - 1
+        handler.send_response(206 if ranged else 200)
+        handler.send_header('Accept-Ranges', 'bytes')
+        handler.send_header('Content-Length', str(end - start + 1))
+        if ranged:
+            handler.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, end, size))
+        handler.end_headers()
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['bytes'] += 0 if head else end - start + 1
+        if not head:
+            with open(path, 'rb') as data:
+                data.seek(start)
+                handler.wfile.write(data.read(end - start + 1))
+
+    def search(self, body):
+        '''
+        Search response for request body, items are sorted by date
+        '''
+        start, end = body['datetime'].split('/')
+        matches = [item for item in self.items
+                   if start[:10] <= item['properties']['datetime'][:10] <=
+                   end[:10]]
+        limit = body.get('limit', 10)
+        page = body.get('page', 1)
+        result = {
+            'type': 'FeatureCollection',
+            'features': matches[(page - 1) * limit:page * limit],
+            'links': [],
+        }
+        if page * limit < len(matches):
+            result['links'].append({'rel': 'next', 'href': self.search_url,
+                                    'method': 'POST', 'merge': True,
+                                    'body': {'page': page + 1}})
+        return result
+
+    def close(self):
+        '''
+        Stop the server
+        '''
+        self.server.shutdown()
+        self.server.server_close()
+
+def run_case(server, run, case, cache_dir, output, verbose): # pylint: disable=too-many-arguments
+    '''
+    Render one GIF and collect timings
+
+    :return: case with seconds, stages, counters, http and gif_bytes
+    '''
+    utils.DATA_URL = '{}/{}'.format(server.url, run)
+    job = GifJob(LAT, LON, start_date=FIRST_DATE.isoformat(),
+                 end_date='2030-12-31', buffer_size=case['buffer_size'],
+                 res=case['res'], max_images=case['scenes'],
+                 enhancement=True, workers=case['workers'],
+                 stac_endpoint=server.search_url)
+    http_before = dict(server.stats)
+    profiling.enable()
+    start = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(
+                open(os.devnull, 'w')))
+        summary = render_gif(job, output,
+                             frame_cache=FrameCache(cache_dir, 10 ** 12))
+    seconds = time.perf_counter() - start
+    profiling.disable()
+    report = profiling.report()
+    assert summary['frames'] == case['scenes'], summary
+    result = dict(case)
+    result.update({
+        'seconds': round(seconds, 4),
+        'stages': {name: round(timer['seconds'], 4)
+                   for name, timer in report['timers'].items()},
+        'counters': report['counters'],
+        'http_requests': server.stats['requests'] -
+                         http_before['requests'],
+        'http_bytes': server.stats['bytes'] - http_before['bytes'],
+        'gif_bytes': os.path.getsize(output),
+    })
+    return result
+
+def case_key(case):
+    '''
+    Identity of a case in a results file
+    '''
+    return tuple(case[name] for name in ('scenes', 'buffer_size', 'res',
+                                         'workers', 'cache'))
+
+def compare(results, baseline, threshold):
+    '''
+    Print the time ratio of each case to the baseline
+
+    :return: number of cases slower than the baseline by more than
+             threshold
+    '''
+    previous = {case_key(case): case for case in baseline['cases']}
+    regressions = 0
+    print('\nBaseline {} ({})'.format(baseline.get('commit'),
+                                      baseline.get('date')))
+    for case in results['cases']:
+        old = previous.get(case_key(case))
+        if old is None:
+            continue
+        ratio = case['seconds'] / old['seconds'] if old['seconds'] else 1.0
+        slower = ratio > 1.0 + threshold
+        regressions += slower
+        print('{:<32} {:8.3f}s -> {:8.3f}s  x{:5.2f}{}'.format(
+            describe(case), old['seconds'], case['seconds'], ratio,
+            '  REGRESSION' if slower else ''))
+    return regressions
+
+def describe(case):
+    '''
+    Short case description
+    '''
+    return '{scenes} scenes {buffer_size}m {workers}w {cache}'.format(**case)
+
+def git_commit():
+    '''
+    Current commit of the working tree, None outside a git checkout
+    '''
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def int_list(value):
+    '''
+    Comma separated integers
+    '''
+    return [int(item) for item in value.split(',')]
+
+def main(): # pylint: disable=too-many-locals
+    """main"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--scenes', type=int_list, default=[5, 20])
+    parser.add_argument('--buffer_size', type=int_list,
+                        default=[2000, 10000])
+    parser.add_argument('--workers', type=int_list, default=[1, 4])
+    parser.add_argument('--res', type=int, default=20)
+    parser.add_argument('--size', type=int, default=2048,
+                        help='Width and height of the synthetic bands')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Save results to this JSON file')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='Compare with a results file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative slowdown reported as a regression')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    assert max(args.buffer_size) * 2 < args.size * args.res, \
+        'AOI larger than the synthetic scenes'
+
+    results = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'size': args.size,
+        'cases': [],
+    }
+    with tempfile.TemporaryDirectory(prefix='cbersgifbench') as directory:
+        archive = os.path.join(directory, 'archive')
+        start = time.perf_counter()
+        ids = build_archive(archive, max(args.scenes), args.size, args.res)
+        print('{} scenes of {}x{} built in {:.1f}s'.format(
+            len(ids), args.size, args.size, time.perf_counter() - start))
+        server = ArchiveServer(archive, ids)
+        try:
+            for run, (scenes, buffer_size, workers) in enumerate(
+                    itertools.product(args.scenes, args.buffer_size,
+                                      args.workers)):
+                cache_dir = os.path.join(directory, 'cache{}'.format(run))
+                output = os.path.join(directory, 'out{}.gif'.format(run))
+                for cache in ('cold', 'warm'):
+                    case = run_case(server, 'run{}'.format(run), {
+                        'scenes': scenes, 'buffer_size': buffer_size,
+                        'res': args.res, 'workers': workers,
+                        'cache': cache}, cache_dir, output, args.verbose)
+                    results['cases'].append(case)
+                    stages = sorted(case['stages'].items(),
+                                    key=lambda item: -item[1])[:4]
+                    print('{:<32} {:8.3f}s  {:5d} requests {:9.1f} KB  {}'.
+                          format(describe(case), case['seconds'],
+                                 case['http_requests'],
+                                 case['http_bytes'] / 1024,
+                                 ', '.join('{} {:.3f}s'.format(*stage)
+                                           for stage in stages)))
+        finally:
+            server.close()
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file),
+                                  args.threshold)
+        if regressions:
+            print('{} regressions'.format(regressions))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
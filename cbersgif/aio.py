@@ -0,0 +1,284 @@
+"""
+cbersgif asyncio module, non blocking search, reads and rendering
+"""
+# -*- coding: utf-8 -*-
+
+import asyncio
+from collections import deque
+import functools
+import os
+import weakref
+
+from cbersgif import enhance, profiling, render, screen, sinks, utils
+
+DEFAULT_MAX_SEARCHES = 4
+DEFAULT_MAX_READS = 8
+
+class AsyncEngine:
+    """
+    Runs the blocking search and GDAL reads in an executor with bounded
+    concurrency, so a single event loop may serve many GIF requests.
+
+    At most max_searches STAC searches and max_reads scene reads run at
+    the same time for each event loop, whatever the number of requests.
+    Cancelling a coroutine releases its slots at once, reads already
+    running in the executor complete in the background and their
+    results are dropped.
+    """
+
+    def __init__(self, max_searches=DEFAULT_MAX_SEARCHES, # pylint: disable=too-many-arguments
+                 max_reads=DEFAULT_MAX_READS, executor=None,
+                 frame_cache=True, search_cache=None, block_cache=None,
+                 render_cache=None):
+        '''
+        Constructor
+
+        :param max_searches int: concurrent STAC searches
+        :param max_reads int: concurrent scene reads
+        :param executor: executor for blocking calls, the loop default
+                         executor if None
+        :param frame_cache: True for the default cache, False to disable
+                            it or a FrameCache instance
+        :param search_cache SearchCache: optional search results cache
+        :param block_cache BlockCache: optional native block cache
+        :param render_cache RenderedCache: optional rendered frame cache
+        '''
+        self.max_searches = max_searches
+        self.max_reads = max_reads
+        self.executor = executor
+        self.frame_cache = frame_cache
+        self.search_cache = search_cache
+        self.block_cache = block_cache
+        self.render_cache = render_cache
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self, name):
+        '''
+        Semaphore of the running loop, semaphores are bound to a loop
+        '''
+        loop = asyncio.get_running_loop()
+        limits = self._semaphores.get(loop)
+        if limits is None:
+            limits = {'search': asyncio.Semaphore(self.max_searches),
+                      'read': asyncio.Semaphore(self.max_reads)}
+            self._semaphores[loop] = limits
+        return limits[name]
+
+    async def run(self, func, *args, **kwargs):
+        '''
+        Run a blocking callable in the executor
+        '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
+
+    async def search(self, **kwargs):
+        '''
+        utils.search, the engine search cache is used by default
+        '''
+        kwargs.setdefault('search_cache', self.search_cache)
+        async with self._semaphore('search'):
+            return await self.run(utils.search, **kwargs)
+
+    async def get_scene_stack(self, scene, bands, aoi_bounds, width, height, # pylint: disable=too-many-arguments
+                              s3_key=None, overviews=True, legacy_aoi=None):
+        '''
+        utils.get_scene_stack using the engine caches
+        '''
+        async with self._semaphore('read'):
+            return await self.run(utils.get_scene_stack, scene, bands,
+                                  aoi_bounds, width, height,
+                                  cache=self.frame_cache, s3_key=s3_key,
+                                  overviews=overviews,
+                                  block_cache=self.block_cache,
+                                  legacy_aoi=legacy_aoi)
+
+    async def get_frame_matrix(self, s3_key, band, scene, aoi_bounds, # pylint: disable=too-many-arguments
+                               width, height):
+        '''
+        utils.get_frame_matrix using the engine caches
+        '''
+        stack = await self.get_scene_stack(scene, [band], aoi_bounds, width,
+                                           height, s3_key=s3_key)
+        return stack[0]
+
+    async def selected(self, job):
+        '''
+        job.selected with the search and the screening reads run as
+        engine searches and reads
+
+        :param job GifJob: job parameters
+        :return: list of (scene_no, scene)
+        '''
+        if job.selection is None:
+            if job.scenes is None:
+                job.scenes = await self.search(**job.search_kwargs())
+            selection = utils.select_scenes(job.scenes, job.taboo_index,
+                                            job.max_images)
+            if job.screen:
+                with profiling.timer('screen'):
+                    scores = await asyncio.gather(
+                        *[self._scene_scores(job, scene)
+                          for _, scene in selection],
+                        return_exceptions=True)
+                selection = screen.keep_scenes(selection, scores,
+                                               job.max_nodata, job.max_cloud)
+            job.selection = selection
+        return job.selection
+
+    async def _scene_scores(self, job, scene):
+        '''
+        screen.scene_scores using the engine caches
+        '''
+        width, height = screen.screen_size(job.aoi_bounds)
+        stack = await self.get_scene_stack(scene, [job.bands[-1]],
+                                           job.aoi_bounds, width, height)
+        return screen.band_scores(stack[0], job.cloud_value)
+
+    async def _stacks(self, selected, bands, aoi_bounds, width, height, # pylint: disable=too-many-arguments
+                      overviews, legacy_aoi=None):
+        '''
+        Async generator of (scene_no, scene, stack, error) in scene
+        order, at most max_reads scenes are read ahead
+        '''
+        selected = iter(selected)
+        pending = deque()
+
+        def submit_next():
+            for scene_no, scene in selected:
+                pending.append((scene_no, scene, asyncio.ensure_future(
+                    self.get_scene_stack(scene, bands, aoi_bounds, width,
+                                         height, overviews=overviews,
+                                         legacy_aoi=legacy_aoi))))
+                return True
+            return False
+
+        try:
+            while len(pending) < self.max_reads and submit_next():
+                pass
+            while pending:
+                scene_no, scene, task = pending.popleft()
+                try:
+                    yield scene_no, scene, await task, None
+                except asyncio.CancelledError:
+                    raise
+                except Exception as err: # pylint: disable=broad-except
+                    yield scene_no, scene, None, err
+                submit_next()
+        finally:
+            for _, _, task in pending:
+                task.cancel()
+
+    async def render_gif(self, job, sink): # pylint: disable=too-many-locals,too-many-branches
+        '''
+        Render a job into an animation, same as render.render_gif.
+        If the coroutine fails or is cancelled the partial output is
+        removed. job.render_procs is ignored, frames are drawn in the
+        engine executor.
+
+        :param job GifJob: job parameters
+        :param sink: output filename, see sinks.get_writer, or an object
+                     with append(image) and close() methods
+        :return: summary with output, scenes_found, frames and failed keys
+        :rtype: dict
+        '''
+
+        selected = await self.selected(job)
+        cached = await self.run(render.cached_frames, job, selected,
+                                self.render_cache, self.block_cache)
+
+        writer = sinks.get_writer(sink, job.duration, job.palette) \
+            if isinstance(sink, str) else sink
+        output = getattr(writer, 'filename', None)
+        drawn = 0
+        failed = 0
+        stretch = None
+        stacks = self._stacks([(scene_no, scene)
+                               for scene_no, scene in selected
+                               if scene_no not in cached],
+                              job.bands, job.aoi_bounds, job.width,
+                              job.height, job.overviews, job.legacy_aoi)
+        frames = stacks
+        try:
+            if job.enhancement and job.globalenhancement:
+                # All stacks are needed before the first frame
+                kept = [item async for item in frames]
+                stretch = await self.run(render.global_stretch, job, kept)
+                frames = _iterate(kept)
+
+            for scene_no, scene in selected:
+                img = cached.get(scene_no)
+                if img is None:
+                    _, _, stack, error = await frames.__anext__()
+                    if error is not None:
+                        print('Failed to read scene {}: {}'.format(scene_no,
+                                                                   error))
+                        failed += 1
+                        profiling.count('failed_scenes')
+                        continue
+                    if job.stretch_each(drawn):
+                        stretch = await self.run(enhance.compute_stretch,
+                                                 stack, job.percents)
+                    img = await self.run(render.draw_cached, job, scene_no,
+                                         scene, stack, stretch,
+                                         self.render_cache, self.block_cache)
+                await self.run(writer.append, img)
+                drawn += 1
+                profiling.count('frames')
+            await self.run(writer.close)
+        except BaseException:
+            try:
+                writer.close()
+            except Exception: # pylint: disable=broad-except
+                # The original error is raised
+                pass
+            if output and os.path.exists(output):
+                os.remove(output)
+            raise
+        finally:
+            # Cancels the reads still pending
+            await stacks.aclose()
+
+        return {
+            'output': output,
+            'scenes_found': len(job.scenes),
+            'frames': drawn,
+            'failed': failed,
+        }
+
+async def _iterate(items):
+    '''
+    Async generator over a list
+    '''
+    for item in items:
+        yield item
+
+_DEFAULT_ENGINE = None
+
+def default_engine():
+    '''
+    Engine used by the module level coroutines
+    '''
+    global _DEFAULT_ENGINE # pylint: disable=global-statement
+    if _DEFAULT_ENGINE is None:
+        _DEFAULT_ENGINE = AsyncEngine()
+    return _DEFAULT_ENGINE
+
+async def search(**kwargs):
+    '''
+    Async utils.search, see AsyncEngine.search
+    '''
+    return await default_engine().search(**kwargs)
+
+async def get_frame_matrix(s3_key, band, scene, aoi_bounds, width, height): # pylint: disable=too-many-arguments
+    '''
+    Async utils.get_frame_matrix, see AsyncEngine.get_frame_matrix
+    '''
+    return await default_engine().get_frame_matrix(s3_key, band, scene,
+                                                   aoi_bounds, width, height)
+
+async def render_gif(job, sink):
+    '''
+    Async GIF rendering, see AsyncEngine.render_gif
+    '''
+    return await default_engine().render_gif(job, sink)
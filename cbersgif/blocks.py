@@ -0,0 +1,253 @@
+"""
+cbersgif blocks module, cache of native raster blocks
+"""
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+
+import numpy as np
+
+import rasterio as rio
+from rasterio.crs import CRS
+from rasterio.transform import Affine, array_bounds
+from rasterio.warp import reproject, transform_bounds
+from rasterio.windows import Window, from_bounds as window_from_bounds
+
+from cbersgif import keys, profiling
+from cbersgif.cache import FrameCache, cache_directory, store_max_bytes
+
+class BlockCache:
+    """
+    Cache of the native blocks of band files, one entry for each
+    (band file, overview level, block row, block column). Any output
+    grid over previously read areas is warped from cached blocks, only
+    missing blocks are read from the band file.
+
+    Blocks are stored in a FrameCache in the 'blocks' subdirectory of
+    the cache directory, with their share of the cache size limit and
+    the same format and eviction.
+    Dataset headers (CRS, transform, size, block shape and overviews)
+    are stored as entry metadata so warm reads do not open the band
+    file at all.
+    """
+
+    SUBDIR = 'blocks'
+
+    def __init__(self, directory=None, max_bytes=None, fmt=None):
+        '''
+        Constructor
+
+        :param directory str: cache directory, blocks are stored in
+                              its 'blocks' subdirectory
+        :param max_bytes int: size limit of the whole cache, blocks use
+                              their STORE_SHARES share
+        :param fmt str: format for new entries, 'npy' or 'npz'
+        '''
+        self.store = FrameCache(os.path.join(cache_directory(directory),
+                                             self.SUBDIR),
+                                store_max_bytes('blocks', max_bytes), fmt)
+        self._headers = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(*args):
+        return keys.digest(keys.block_meta(*args))
+
+    def header(self, address, level, src=None):
+        '''
+        Dataset header of a band file at an overview level
+
+        :param address str: band file address
+        :param level int: overview level, None for full resolution
+        :param src: open dataset for address and level, used on misses
+        :return: dict, None if not cached and src is None
+        '''
+        key = self._key('header', address, level)
+        with self._lock:
+            header = self._headers.get(key)
+        if header is None:
+            header = self.store.meta(key)
+        if header is None and src is not None:
+            header = {
+                'crs': src.crs.to_wkt(),
+                'transform': list(src.transform)[:6],
+                'width': src.width,
+                'height': src.height,
+                'dtype': src.dtypes[0],
+                'nodata': src.nodata,
+                'block_shape': list(src.block_shapes[0]),
+                'overviews': src.overviews(1) if level is None else [],
+            }
+            header.update(keys.block_meta('header', address, level))
+            self.store.put(key, np.zeros(0, dtype=np.uint8), header)
+        if header is not None:
+            with self._lock:
+                self._headers[key] = header
+        return header
+
+    def block(self, address, level, row, col):
+        '''
+        Cached block, None on misses
+        '''
+        return self.store.get(self._key('block', address, level, row, col))
+
+    def put_block(self, address, level, row, col, array): # pylint: disable=too-many-arguments
+        '''
+        Store a block
+        '''
+        self.store.put(self._key('block', address, level, row, col), array,
+                       keys.block_meta('block', address, level, row, col))
+
+    def migrate(self, drop=False):
+        '''
+        Move blocks cached with older key versions to their current
+        keys, see FrameCache.rekey
+        '''
+        return self.store.rekey(keys.migrate_block, drop)
+
+    def clear(self):
+        '''
+        Remove all blocks and headers
+        '''
+        self.store.clear()
+        with self._lock:
+            self._headers.clear()
+
+    def prune(self, max_bytes=None):
+        '''
+        Evict least recently used blocks, see FrameCache.prune
+
+        :param max_bytes int: size limit of the whole cache, defaults to
+                              the one of the constructor
+        '''
+        return self.store.prune(None if max_bytes is None
+                                else store_max_bytes('blocks', max_bytes))
+
+    def stats(self):
+        '''
+        Block cache statistics, see FrameCache.stats
+        '''
+        return self.store.stats()
+
+def _overview_level(header, plan):
+    '''
+    Coarsest overview level finer than the plan grid, same choice as
+    utils.overview_level from a cached header
+    '''
+    left, bottom, right, top = transform_bounds(
+        plan['crs'], CRS.from_wkt(header['crs']),
+        *array_bounds(plan['height'], plan['width'], plan['transform']))
+    transform = Affine(*header['transform'])
+    factor = min((right - left) / transform.a / plan['width'],
+                 (top - bottom) / -transform.e / plan['height'])
+    level = None
+    for index, overview in enumerate(header['overviews']):
+        if overview <= factor:
+            level = index
+    return level
+
+def _block_range(header, plan):
+    '''
+    Block rows and columns intersecting the plan grid, with a one pixel
+    margin for the resampling kernel
+
+    :return: (row_start, row_end, col_start, col_end), end exclusive,
+             None if the grid does not intersect the dataset
+    '''
+    window = window_from_bounds(
+        *transform_bounds(plan['crs'], CRS.from_wkt(header['crs']),
+                          *array_bounds(plan['height'], plan['width'],
+                                        plan['transform'])),
+        Affine(*header['transform']))
+    block_h, block_w = header['block_shape']
+    row_off = max(int(np.floor(window.row_off)) - 1, 0)
+    col_off = max(int(np.floor(window.col_off)) - 1, 0)
+    row_end = min(int(np.ceil(window.row_off + window.height)) + 1,
+                  header['height'])
+    col_end = min(int(np.ceil(window.col_off + window.width)) + 1,
+                  header['width'])
+    if row_end <= row_off or col_end <= col_off:
+        return None
+    return (row_off // block_h, (row_end - 1) // block_h + 1,
+            col_off // block_w, (col_end - 1) // block_w + 1)
+
+def read_band(address, plan, block_cache, overviews=True, io_stats=None):
+    '''
+    Warp a band file into the grid defined by plan, assembling the
+    source window from cached blocks. Missing blocks are read from the
+    band file and cached.
+
+    :param address str: band file address
+    :param plan dict: as returned by utils.warp_plan
+    :param block_cache BlockCache: block cache
+    :param overviews bool: read from the coarsest overview matching
+                           the output grid
+    :param io_stats: optional callable receiving (level, blocks read,
+                     cached blocks, bytes read)
+    :return: band matrix
+    '''
+
+    datasets = dict()
+
+    def dataset(level):
+        if level not in datasets:
+            if level is None:
+                datasets[level] = rio.open(address)
+            else:
+                datasets[level] = rio.open(address, overview_level=level)
+        return datasets[level]
+
+    try:
+        header = block_cache.header(address, None) or \
+                 block_cache.header(address, None, dataset(None))
+        level = _overview_level(header, plan) if overviews else None
+        if level is not None:
+            header = block_cache.header(address, level) or \
+                     block_cache.header(address, level, dataset(level))
+
+        out = np.zeros((plan['height'], plan['width']),
+                       dtype=header['dtype'])
+        block_range = _block_range(header, plan)
+        if block_range is None:
+            return out
+        row_start, row_end, col_start, col_end = block_range
+        block_h, block_w = header['block_shape']
+
+        source = np.zeros(((row_end - row_start) * block_h,
+                           (col_end - col_start) * block_w),
+                          dtype=header['dtype'])
+        fetched = 0
+        for row in range(row_start, row_end):
+            for col in range(col_start, col_end):
+                block = block_cache.block(address, level, row, col)
+                if block is None:
+                    window = Window(col * block_w, row * block_h,
+                                    min(block_w,
+                                        header['width'] - col * block_w),
+                                    min(block_h,
+                                        header['height'] - row * block_h))
+                    block = dataset(level).read(1, window=window)
+                    block_cache.put_block(address, level, row, col, block)
+                    fetched += 1
+                top = (row - row_start) * block_h
+                left = (col - col_start) * block_w
+                source[top:top + block.shape[0],
+                       left:left + block.shape[1]] = block
+        if io_stats is not None:
+            blocks = (row_end - row_start) * (col_end - col_start)
+            io_stats(level, fetched, blocks - fetched,
+                     fetched * block_h * block_w * source.itemsize)
+    finally:
+        for src in datasets.values():
+            src.close()
+
+    transform = Affine(*header['transform']) * \
+                Affine.translation(col_start * block_w, row_start * block_h)
+    with profiling.timer('warp'):
+        reproject(source, out, src_transform=transform,
+                  src_crs=CRS.from_wkt(header['crs']),
+                  src_nodata=header['nodata'],
+                  dst_transform=plan['transform'], dst_crs=plan['crs'],
+                  dst_nodata=0, resampling=plan['resampling'])
+    return out
@@ -0,0 +1,659 @@
+"""
+cbersgif frame cache
+"""
+# -*- coding: utf-8 -*-
+
+import glob
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+from cbersgif import keys
+
+DEFAULT_DIR = '/tmp/cbersgifcache/'
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+# npy entries can be memory mapped, npz entries are deflate compressed
+FORMATS = ('npy', 'npz')
+
+DEFAULT_SEARCH_TTL = 3600
+
+# Shares of the cache size limit, the frame, block and rendered frame
+# stores are evicted separately and together stay within the limit
+STORE_SHARES = {'frames': 0.5, 'blocks': 0.25, 'rendered': 0.25}
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3,
+              'T': 1024 ** 4}
+
+def parse_size(value):
+    '''
+    Parse a size in bytes with an optional K, M, G or T suffix
+
+    :param value str: size, for instance '500M' or '2G'
+    :return: size in bytes
+    :rtype: int
+    '''
+    match = re.match(r'^\s*(?P<number>\d+(\.\d+)?)\s*(?P<unit>[KMGT]?)B?\s*$',
+                     str(value).upper())
+    assert match, "Invalid size: {}".format(value)
+    return int(float(match.group('number')) * SIZE_UNITS[match.group('unit')])
+
+def default_max_bytes():
+    '''
+    Cache size limit, the CBERSGIF_CACHE_MAX_BYTES env var or
+    DEFAULT_MAX_BYTES
+
+    :rtype: int
+    '''
+    return parse_size(os.environ.get('CBERSGIF_CACHE_MAX_BYTES',
+                                     DEFAULT_MAX_BYTES))
+
+def store_max_bytes(store, max_bytes=None):
+    '''
+    Size limit of a store of the cache directory, see STORE_SHARES
+
+    :param store str: 'frames', 'blocks' or 'rendered'
+    :param max_bytes int: size limit of the whole cache, defaults to
+                          default_max_bytes
+    :rtype: int
+    '''
+    if max_bytes is None:
+        max_bytes = default_max_bytes()
+    return int(max_bytes * STORE_SHARES[store])
+
+def cache_directory(directory=None):
+    '''
+    Cache directory, defaults to the CBERSGIF_CACHE_DIR env var or
+    DEFAULT_DIR
+
+    :param directory str: explicit directory
+    :rtype: str
+    '''
+    if directory is None:
+        directory = os.environ.get('CBERSGIF_CACHE_DIR', DEFAULT_DIR)
+    return directory
+
+class FrameCache:
+    """
+    Bounded on disk cache of numpy arrays
+
+    Entries are tracked in a sqlite index stored in the cache directory
+    with their size and last access time, the least recently used
+    entries are evicted when the total size exceeds max_bytes. Arrays
+    are written to a temporary file and renamed, so concurrent runs
+    never read partially written entries.
+
+    Entries are written in the cache format, 'npy' entries are read
+    memory mapped so cache hits do not copy the array into memory,
+    'npz' entries are compressed and use less disk. Entries in both
+    formats may coexist in the same cache.
+    """
+
+    INDEX = 'index.sqlite'
+
+    def __init__(self, directory=None, max_bytes=None, fmt=None,
+                 mmap=True):
+        '''
+        Constructor
+
+        :param directory str: cache directory, defaults to the
+                              CBERSGIF_CACHE_DIR env var or DEFAULT_DIR
+        :param max_bytes int: maximum cache size, defaults to the
+                              CBERSGIF_CACHE_MAX_BYTES env var or
+                              DEFAULT_MAX_BYTES
+        :param fmt str: format for new entries, 'npy' or 'npz', defaults
+                        to the CBERSGIF_CACHE_FORMAT env var or 'npy'
+        :param mmap bool: if True npy entries are read memory mapped,
+                          returned arrays are read only
+        '''
+        directory = cache_directory(directory)
+        if max_bytes is None:
+            max_bytes = default_max_bytes()
+        if fmt is None:
+            fmt = os.environ.get('CBERSGIF_CACHE_FORMAT', 'npy')
+        assert fmt in FORMATS, "Invalid cache format: {}".format(fmt)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fmt = fmt
+        self.mmap = mmap
+
+        # Counters for this instance only, totals are kept in the index
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connect(self):
+        '''
+        Open the index, creating it if required
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        index_file = os.path.join(self.directory, self.INDEX)
+        created = not os.path.isfile(index_file)
+        conn = sqlite3.connect(index_file, timeout=60)
+        conn.execute('CREATE TABLE IF NOT EXISTS entries '
+                     '(key TEXT PRIMARY KEY, filename TEXT, size INTEGER, '
+                     'last_access REAL, meta TEXT)')
+        conn.execute('CREATE TABLE IF NOT EXISTS counters '
+                     '(name TEXT PRIMARY KEY, value INTEGER)')
+        if created:
+            self._adopt(conn)
+        return conn
+
+    def _adopt(self, conn):
+        '''
+        Index .npy files written by versions without an index
+        '''
+        with conn:
+            for filename in glob.glob(os.path.join(self.directory, '*.npy')):
+                stat = os.stat(filename)
+                key = os.path.splitext(os.path.basename(filename))[0]
+                conn.execute('INSERT OR IGNORE INTO entries '
+                             'VALUES (?, ?, ?, ?, NULL)',
+                             (key, os.path.basename(filename),
+                              stat.st_size, stat.st_mtime))
+
+    @staticmethod
+    def _count(conn, name, value=1):
+        conn.execute('INSERT OR IGNORE INTO counters VALUES (?, 0)', (name,))
+        conn.execute('UPDATE counters SET value = value + ? WHERE name = ?',
+                     (value, name))
+
+    def get(self, key, meta=None, aliases=()):
+        '''
+        Cached array for key
+
+        :param key str: entry key
+        :param meta dict: entry metadata, recorded if missing in index
+        :param aliases: keys the entry may have been stored under by
+                        older versions, the first one found is moved
+                        to key
+        :return: array, None on cache miss
+        '''
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT filename, meta FROM entries '
+                               'WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                row = self._adopt_alias(conn, key, meta, aliases)
+            array = None
+            if row:
+                try:
+                    array = self._load(os.path.join(self.directory, row[0]))
+                except (OSError, ValueError, KeyError):
+                    # Evicted or removed by another process
+                    with conn:
+                        conn.execute('DELETE FROM entries WHERE key = ?',
+                                     (key,))
+            with conn:
+                if array is None:
+                    self.misses += 1
+                    self._count(conn, 'misses')
+                else:
+                    self.hits += 1
+                    self._count(conn, 'hits')
+                    conn.execute('UPDATE entries SET last_access = ?, '
+                                 'meta = COALESCE(meta, ?) WHERE key = ?',
+                                 (time.time(),
+                                  None if meta is None else json.dumps(meta),
+                                  key))
+            return array
+        finally:
+            conn.close()
+
+    def _adopt_alias(self, conn, key, meta, aliases):
+        '''
+        Move the first cached alias entry to key
+
+        :return: (filename, meta) row for key, None if no alias is cached
+        '''
+        for alias in aliases:
+            row = conn.execute('SELECT filename FROM entries WHERE key = ?',
+                               (alias,)).fetchone()
+            if row is None:
+                continue
+            with conn:
+                filename = self._move(conn, alias, row[0], key,
+                                      None if meta is None
+                                      else json.dumps(meta))
+            if filename is not None:
+                return filename, meta
+        return None
+
+    def meta(self, key):
+        '''
+        Metadata stored with an entry, hit/miss counters are not updated
+
+        :param key str: entry key
+        :return: dict, None if the entry or its metadata is missing
+        '''
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT meta FROM entries WHERE key = ?',
+                               (key,)).fetchone()
+        finally:
+            conn.close()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def _load(self, filename):
+        '''
+        Read an entry file in any of the supported formats
+        '''
+        if filename.endswith('.npz'):
+            with np.load(filename) as data:
+                return data['array']
+        return np.load(filename, mmap_mode='r' if self.mmap else None)
+
+    def put(self, key, array, meta=None):
+        '''
+        Store array under key, evicting entries if required
+
+        :param key str: entry key
+        :param array: numpy array
+        :param meta dict: entry metadata, must be JSON serializable
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        filename = '{}.{}'.format(key, self.fmt)
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp',
+                                         delete=False) as tmp_file:
+            if self.fmt == 'npz':
+                np.savez_compressed(tmp_file, array=array)
+            else:
+                np.save(tmp_file, array)
+        os.replace(tmp_file.name, os.path.join(self.directory, filename))
+
+        conn = self._connect()
+        try:
+            with conn:
+                # Entry may exist in another format
+                row = conn.execute('SELECT filename FROM entries '
+                                   'WHERE key = ?', (key,)).fetchone()
+                if row and row[0] != filename:
+                    self._remove(row[0])
+                conn.execute('INSERT OR REPLACE INTO entries '
+                             'VALUES (?, ?, ?, ?, ?)',
+                             (key, filename,
+                              os.path.getsize(os.path.join(self.directory,
+                                                           filename)),
+                              time.time(),
+                              None if meta is None else json.dumps(meta)))
+            self._evict(conn, self.max_bytes)
+        finally:
+            conn.close()
+
+    def _remove(self, filename):
+        '''
+        Remove an entry file, ignoring files already removed
+        '''
+        try:
+            os.remove(os.path.join(self.directory, filename))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, conn, max_bytes):
+        '''
+        Remove least recently used entries until size <= max_bytes
+
+        :return: number of evicted entries
+        '''
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) '
+                             'FROM entries').fetchone()[0]
+        evicted = 0
+        if total <= max_bytes:
+            return evicted
+        rows = conn.execute('SELECT key, filename, size FROM entries '
+                            'ORDER BY last_access').fetchall()
+        with conn:
+            for key, filename, size in rows:
+                if total <= max_bytes:
+                    break
+                self._remove(filename)
+                conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                total -= size
+                evicted += 1
+            self._count(conn, 'evictions', evicted)
+        self.evictions += evicted
+        return evicted
+
+    def prune(self, max_bytes=None):
+        '''
+        Evict least recently used entries until the cache fits max_bytes
+
+        :param max_bytes int: target size, defaults to self.max_bytes
+        :return: number of evicted entries
+        :rtype: int
+        '''
+        conn = self._connect()
+        try:
+            return self._evict(conn, self.max_bytes if max_bytes is None
+                               else max_bytes)
+        finally:
+            conn.close()
+
+    def _move(self, conn, key, filename, new_key, meta):
+        '''
+        Rename an entry file and its index row to new_key
+
+        :param meta str: JSON metadata for the moved entry
+        :return: new filename, None if the file was removed meanwhile
+        '''
+        new_filename = new_key + os.path.splitext(filename)[1]
+        try:
+            os.replace(os.path.join(self.directory, filename),
+                       os.path.join(self.directory, new_filename))
+        except FileNotFoundError:
+            # Evicted by another process
+            conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            return None
+        conn.execute('UPDATE OR REPLACE entries SET key = ?, filename = ?, '
+                     'meta = ? WHERE key = ?',
+                     (new_key, new_filename, meta, key))
+        return new_filename
+
+    def rekey(self, func, drop=False):
+        '''
+        Move entries to new keys, files are renamed so the arrays are
+        kept. Entries whose new key is already cached are removed.
+
+        :param func: callable(key, meta) returning (new key, new meta),
+                     (key, None) for legacy entries kept under their key
+                     or None for entries that cannot be re-keyed
+        :param drop bool: remove entries that cannot be re-keyed
+        :return: number of migrated, current, legacy, orphaned and
+                 dropped entries
+        :rtype: dict
+        '''
+        result = {'migrated': 0, 'current': 0, 'legacy': 0, 'orphaned': 0,
+                  'dropped': 0}
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT key, filename, meta '
+                                'FROM entries').fetchall()
+            with conn:
+                for key, filename, meta in rows:
+                    rekeyed = func(key, None if meta is None
+                                   else json.loads(meta))
+                    if rekeyed is None:
+                        if drop:
+                            self._remove(filename)
+                            conn.execute('DELETE FROM entries WHERE key = ?',
+                                         (key,))
+                            result['dropped'] += 1
+                        else:
+                            result['orphaned'] += 1
+                        continue
+                    new_key, new_meta = rekeyed
+                    if new_key == key and new_meta is None:
+                        result['legacy'] += 1
+                        continue
+                    new_meta = json.dumps(new_meta)
+                    if new_key == key:
+                        conn.execute('UPDATE entries SET meta = ? '
+                                     'WHERE key = ?', (new_meta, key))
+                        result['current'] += 1
+                        continue
+                    if conn.execute('SELECT 1 FROM entries WHERE key = ?',
+                                    (new_key,)).fetchone():
+                        self._remove(filename)
+                        conn.execute('DELETE FROM entries WHERE key = ?',
+                                     (key,))
+                        result['migrated'] += 1
+                    elif self._move(conn, key, filename, new_key, new_meta):
+                        result['migrated'] += 1
+        finally:
+            conn.close()
+        return result
+
+    def clear(self):
+        '''
+        Remove all entries and reset counters
+        '''
+        conn = self._connect()
+        try:
+            with conn:
+                for (filename,) in conn.execute('SELECT filename '
+                                                'FROM entries').fetchall():
+                    self._remove(filename)
+                conn.execute('DELETE FROM entries')
+                conn.execute('DELETE FROM counters')
+        finally:
+            conn.close()
+        # Leftovers from interrupted writes
+        for filename in glob.glob(os.path.join(self.directory, '*.tmp')):
+            os.remove(filename)
+
+    def stats(self):
+        '''
+        Cache statistics, counters are totals for all runs since the
+        last clear
+
+        :rtype: dict
+        '''
+        conn = self._connect()
+        try:
+            entries, size = conn.execute('SELECT COUNT(*), '
+                                         'COALESCE(SUM(size), 0) '
+                                         'FROM entries').fetchone()
+            counters = dict(conn.execute('SELECT name, value '
+                                         'FROM counters').fetchall())
+        finally:
+            conn.close()
+        return {
+            'directory': self.directory,
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'format': self.fmt,
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+            'evictions': counters.get('evictions', 0),
+        }
+
+class RenderedCache:
+    """
+    Cache of finished RGB frames, after stretch, enhancement and label
+
+    Frames are stored in a FrameCache in the 'rendered' subdirectory of
+    the cache directory. The key is built from a dict with everything
+    the frame depends on, see GifJob.frame_meta, which is also stored as
+    entry metadata.
+    """
+
+    SUBDIR = 'rendered'
+
+    def __init__(self, directory=None, max_bytes=None, fmt=None):
+        '''
+        Constructor
+
+        :param directory str: cache directory, frames are stored in its
+                              'rendered' subdirectory
+        :param max_bytes int: size limit of the whole cache, rendered
+                              frames use their STORE_SHARES share
+        :param fmt str: format for new entries, 'npy' or 'npz'
+        '''
+        self.store = FrameCache(os.path.join(cache_directory(directory),
+                                             self.SUBDIR),
+                                store_max_bytes('rendered', max_bytes), fmt)
+
+    @staticmethod
+    def _key(meta):
+        return keys.digest(meta)
+
+    def get(self, meta):
+        '''
+        Cached frame
+
+        :param meta dict: frame key
+        :return: (H, W, 3) uint8 array, None on cache miss
+        '''
+        return self.store.get(self._key(meta), meta)
+
+    def put(self, meta, rgb):
+        '''
+        Store a frame
+
+        :param meta dict: frame key, must be JSON serializable
+        :param rgb: (H, W, 3) uint8 array
+        '''
+        self.store.put(self._key(meta), rgb, meta)
+
+    def migrate(self, drop=False):
+        '''
+        Move frames cached with older key versions to their current
+        keys, see FrameCache.rekey
+        '''
+        return self.store.rekey(keys.migrate_rendered, drop)
+
+    def prune(self, max_bytes=None):
+        '''
+        Evict least recently used frames, see FrameCache.prune
+
+        :param max_bytes int: size limit of the whole cache, defaults to
+                              the one of the constructor
+        '''
+        return self.store.prune(None if max_bytes is None
+                                else store_max_bytes('rendered', max_bytes))
+
+    def clear(self):
+        '''
+        Remove all frames
+        '''
+        self.store.clear()
+
+    def stats(self):
+        '''
+        Rendered frame cache statistics, see FrameCache.stats
+        '''
+        return self.store.stats()
+
+class SearchCache:
+    """
+    Search results cache with time to live
+
+    Results are kept per search key, that is, the search parameters
+    other than the date range, together with the date range they
+    cover. A search for a range starting inside a cached range only
+    queries the dates after the cached range and extends the entry.
+    """
+
+    INDEX = 'search.sqlite'
+
+    def __init__(self, directory=None, ttl=DEFAULT_SEARCH_TTL):
+        '''
+        Constructor
+
+        :param directory str: cache directory, see cache_directory
+        :param ttl float: entries older than ttl seconds are ignored
+        '''
+        self.directory = cache_directory(directory)
+        self.ttl = ttl
+
+    def _connect(self):
+        '''
+        Open the index, creating it if required
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(self.directory, self.INDEX),
+                               timeout=60)
+        conn.execute('CREATE TABLE IF NOT EXISTS searches '
+                     '(key TEXT PRIMARY KEY, start_date TEXT, '
+                     'end_date TEXT, fetched REAL, scenes TEXT)')
+        return conn
+
+    def search(self, key, start_date, end_date, query, complete=None): # pylint: disable=too-many-arguments
+        '''
+        Scenes for key acquired from start_date to end_date, served from
+        the cache when possible
+
+        :param key dict: search parameters other than the date range,
+                         must be JSON serializable
+        :param start_date str: start date in YYYY-MM-DD format
+        :param end_date str: end date in YYYY-MM-DD format
+        :param query: callable(start_date, end_date) returning the scenes
+                      for a date range, scenes require scene_id and
+                      acquisition_date (YYYYMMDD) keys. A query that
+                      stopped early returns (scenes, last_date), scenes
+                      being complete up to last_date only.
+        :param complete: optional callable(scenes) returning True when
+                         the cached scenes from start_date are enough,
+                         dates after the cached range are then not
+                         queried
+        :return: scenes in the date range
+        :rtype: list
+        '''
+        key = json.dumps(key, sort_keys=True)
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT start_date, end_date, fetched, scenes '
+                               'FROM searches WHERE key = ?',
+                               (key,)).fetchone()
+        finally:
+            conn.close()
+
+        if row and time.time() - row[2] <= self.ttl and \
+           row[0] <= start_date <= row[1]:
+            cached_start, cached_end, fetched, scenes = row
+            scenes = json.loads(scenes)
+            if end_date > cached_end and not \
+               (complete and complete(_in_range(scenes, start_date,
+                                                cached_end))):
+                # Dates after the cached range only, the last cached
+                # date is queried again as it may be incomplete
+                found, last_date = _query_range(query, cached_end, end_date)
+                known = set(scene['scene_id'] for scene in scenes)
+                scenes += [scene for scene in found
+                           if scene['scene_id'] not in known]
+                self._store(key, cached_start, last_date, fetched, scenes)
+        else:
+            # Ranges starting after the cached one replace it, the dates
+            # in between are not known
+            scenes, last_date = _query_range(query, start_date, end_date)
+            self._store(key, start_date, last_date, time.time(), scenes)
+
+        return _in_range(scenes, start_date, end_date)
+
+    def _store(self, key, start_date, end_date, fetched, scenes): # pylint: disable=too-many-arguments
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO searches '
+                             'VALUES (?, ?, ?, ?, ?)',
+                             (key, start_date, end_date, fetched,
+                              json.dumps(scenes)))
+        finally:
+            conn.close()
+
+    def clear(self):
+        '''
+        Remove all entries
+        '''
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM searches')
+        finally:
+            conn.close()
+
+def _query_range(query, start_date, end_date):
+    '''
+    Scenes of a SearchCache query and the last date they are complete for
+    '''
+    result = query(start_date, end_date)
+    if isinstance(result, tuple):
+        return result
+    return result, end_date
+
+def _in_range(scenes, start_date, end_date):
+    '''
+    Scenes acquired from start_date to end_date, YYYY-MM-DD dates
+    '''
+    s_date = start_date.replace('-', '')
+    e_date = end_date.replace('-', '')
+    return [scene for scene in scenes
+            if s_date <= scene['acquisition_date'] <= e_date]
@@ -5,197 +5,440 @@
 cbersgif cli
 """
 
-#import os
-
-#import numpy as np
-
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import json
+import os
+import tempfile
 import time
 import uuid
 
 import click
 
-import numpy as np
-
-from PIL import Image, ImageDraw, ImageFont, ImageEnhance
-
-from cbersgif.utils import search
+from cbersgif import geometry, keys, planner, profiling, render, screen, \
+    sinks, utils
+from cbersgif.blocks import BlockCache
+from cbersgif.cache import FrameCache, RenderedCache, SearchCache, \
+    parse_size, store_max_bytes, DEFAULT_SEARCH_TTL
 
 from cbersgif import __version__ as cbersgif_version
 
-FONT = ImageFont.load_default()
-
-#@click.group()
-#@click.version_option(version=cbersgif_version, message='%(version)s')
-#def main():
-#    """
-#    main
-#    """
-#    pass
-
-@click.command()
+class DefaultGroup(click.Group):
+    """
+    Group that runs default_command when the first argument is not
+    a subcommand, keeps 'cbersgif --lat ... --lon ...' working
+    """
+
+    def __init__(self, *args, default_command=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default_command = default_command
+
+    def parse_args(self, ctx, args):
+        if args and args[0] not in self.commands and \
+           args[0] not in ('--help', '--version'):
+            args.insert(0, self.default_command)
+        return super().parse_args(ctx, args)
+
+def cache_options(func):
+    """
+    Options selecting the frame cache
+    """
+    func = click.option('--cache_format', type=click.Choice(['npy', 'npz']),
+                        default=None,
+                        help='Format for new cache entries, npy entries are '
+                        'memory mapped, npz entries are compressed. Defaults '
+                        'to CBERSGIF_CACHE_FORMAT or npy')(func)
+    func = click.option('--cache_max_bytes', type=parse_size, default=None,
+                        help='Maximum size of the whole cache, for instance '
+                        '500M or 2G. Defaults to CBERSGIF_CACHE_MAX_BYTES or '
+                        '2G')(func)
+    func = click.option('--cache_dir', type=str, default=None,
+                        help='Cache directory. Defaults to '
+                        'CBERSGIF_CACHE_DIR or /tmp/cbersgifcache/')(func)
+    return func
+
+GIF_OPTIONS = [
+    click.option('--sensor', type=click.Choice(['MUX', 'AWFI', 'PAN5M',
+                                                'PAN10M']),
+                 default='MUX',
+                 help='Sensor'),
+    click.option('--level', type=click.Choice(['L2', 'L4', 'all']),
+                 default='L4',
+                 help='Levels to be used'),
+    click.option('--start_date', '-s', type=str, default='2013-01-01',
+                 help='Start date of the query in the format YYYY-MM-DD.'),
+    click.option('--end_date', '-e', type=str,
+                 default=time.strftime('%Y-%m-%d'),
+                 help='End date of the query in the format YYYY-MM-DD.'),
+    click.option('--res', type=int, default=20,
+                 help='Output Resolution'),
+    click.option('--bands', type=str, default='7,6,5',
+                 help='Comma separated list of RGB bands, in that order.'),
+    click.option('--buffer_size', '-b', type=int, default=10000,
+                 help='Buffer size around lat/lon point for image creation.'
+                 ' (in meters)'),
+    click.option('--saveintermediary/--nosaveintermediary', default=False,
+                 help='Save intermediary files as bmp'),
+    click.option('--max_images', type=int, default=100,
+                 help='Maximum number of images to be used'),
+    click.option('--one_per', type=click.Choice(['week', 'month', 'year']),
+                 default=None,
+                 help='Keep only the first scene of each period'),
+    click.option('--screen/--noscreen', default=False,
+                 help='Skip scenes with too much nodata or cloud, checked '
+                 'with a small read of the last band before the full read'),
+    click.option('--max_nodata', type=click.FloatRange(0, 1),
+                 default=screen.DEFAULT_MAX_NODATA,
+                 help='Maximum fraction of the AOI without data, --screen'),
+    click.option('--max_cloud', type=click.FloatRange(0, 1),
+                 default=screen.DEFAULT_MAX_CLOUD,
+                 help='Maximum fraction of the valid pixels brighter than '
+                 '--cloud_value, --screen'),
+    click.option('--cloud_value', type=int,
+                 default=screen.DEFAULT_CLOUD_VALUE,
+                 help='Pixel value counted as cloud, --screen'),
+    click.option('--singleenhancement/--nosingleenhancement', default=False,
+                 help='If True the same contrast stretch is performed for '
+                 'all scenes, this stretch is computed for the first scene'),
+    click.option('--globalenhancement/--noglobalenhancement', default=False,
+                 help='If True the same contrast stretch is performed for '
+                 'all scenes, this stretch is computed from the histograms '
+                 'of all selected scenes'),
+    click.option('--enhancement/--noenhancement', default=False,
+                 help='If True histogram stretch is computed for scenes'),
+    click.option('--percentiles', type=str, default='2,98',
+                 help='Percentiles for upper and lower histogram '
+                 'enhancement'),
+    click.option('--contrast_factor', type=float, default=1.0,
+                 help='Contrast enhancement factor'),
+    click.option('--brightness_factor', type=float, default=1.0,
+                 help='Brightness enhancement factor'),
+    click.option('--duration', type=float, default=0.5,
+                 help='Duration of each frame, in seconds'),
+    click.option('--palette', type=click.Choice(utils.PALETTES),
+                 default='global',
+                 help='global quantizes all frames with a single palette and '
+                 'stores only the pixels changed between frames, frame '
+                 'quantizes each frame on its own'),
+    click.option('--stac_endpoint', '-s', type=str,
+                 default='https://stac.amskepler.com/v100/search',
+                 help='STAC search endpoint'),
+    click.option('--workers', type=click.IntRange(min=1), default=4,
+                 help='Number of concurrent scene/band reads'),
+    click.option('--render_procs', type=click.IntRange(min=0), default=0,
+                 help='Number of processes drawing frames, 0 draws them '
+                 'in the main process'),
+    click.option('--cache/--nocache', default=True,
+                 help='Use the frame cache'),
+    click.option('--overviews/--nooverviews', default=True,
+                 help='Read bands from the internal overview matching --res '
+                 'when it is coarser than the original resolution'),
+    click.option('--search_ttl', type=float, default=DEFAULT_SEARCH_TTL,
+                 help='Search results are cached for this number of seconds, '
+                 '0 disables the search cache'),
+    click.option('--block_cache/--noblock_cache', default=False,
+                 help='Cache the native blocks of band files, new AOIs or '
+                 'resolutions over areas already read are warped locally'),
+    click.option('--profile', type=click.Path(dir_okay=False), default=None,
+                 help='Write the time spent in each stage and I/O counters '
+                 'to this JSON file, CSV if the name ends in .csv'),
+]
+
+def gif_options(func):
+    """
+    Options shared by the gif and batch commands
+    """
+    func = cache_options(func)
+    for option in reversed(GIF_OPTIONS):
+        func = option(func)
+    return func
+
+def make_caches(cache, search_ttl, block_cache, # pylint: disable=too-many-arguments
+                cache_dir, cache_max_bytes, cache_format):
+    """
+    Frame, search, block and rendered frame caches selected by the cache
+    options, finished frames are cached with --cache. The stores share
+    --cache_max_bytes, see cache.STORE_SHARES
+
+    :return: (FrameCache or None, SearchCache or None, BlockCache or None,
+              RenderedCache or None)
+    """
+    frame_cache = FrameCache(cache_dir,
+                             store_max_bytes('frames', cache_max_bytes),
+                             cache_format) if cache else None
+    search_cache = SearchCache(cache_dir, search_ttl) \
+                   if search_ttl > 0 else None
+    block_cache = BlockCache(cache_dir, cache_max_bytes, cache_format) \
+                  if block_cache else None
+    render_cache = RenderedCache(cache_dir, cache_max_bytes, cache_format) \
+                   if cache else None
+    return frame_cache, search_cache, block_cache, render_cache
+
+def echo_io_stats():
+    """
+    Print raster read totals
+    """
+    click.echo('{} band reads, {} from overviews, ~{} bytes fetched'.format(
+        utils.IO_STATS['reads'], utils.IO_STATS['overview_reads'],
+        utils.IO_STATS['bytes']))
+    if utils.IO_STATS['block_hits']:
+        click.echo('{} cached blocks'.format(utils.IO_STATS['block_hits']))
+
+def write_profile(profile):
+    """
+    Write the profiler report and turn the profiler off, see --profile
+    """
+    if profile:
+        try:
+            profiling.PROFILER.write(profile)
+            click.echo('Profile written to {}'.format(profile))
+        finally:
+            profiling.disable()
+            profiling.PROFILER.reset()
+
+@click.group(cls=DefaultGroup, default_command='gif')
+@click.version_option(version=cbersgif_version, message='%(version)s')
+def main():
+    """
+    Animated GIFs from CBERS data on AWS. 'gif' is the default command.
+    """
+
+@main.command('gif')
 @click.option('--lat', type=float, required=True,
               help='Latitude of the query, between 90 and -90.')
 @click.option('--lon', type=float, required=True,
               help='Longitude of the query, between 180 and -180.')
-@click.option('--sensor', type=click.Choice(['MUX', 'AWFI', 'PAN5M',
-                                             'PAN10M']),
-              default='MUX',
-              help='Sensor')
-@click.option('--level', type=click.Choice(['L2', 'L4', 'all']),
-              default='L4',
-              help='Levels to be used')
-@click.option('--start_date', '-s', type=str, default='2013-01-01',
-              help='Start date of the query in the format YYYY-MM-DD.')
-@click.option('--end_date', '-e', type=str, default=time.strftime('%Y-%m-%d'),
-              help='End date of the query in the format YYYY-MM-DD.')
-@click.option('--res', type=int, default=20,
-              help='Output Resolution')
-@click.option('--bands', type=str, default='7,6,5',
-              help='Comma separated list of RGB bands, in that order.')
-@click.option('--buffer_size', '-b', type=int, default=10000,
-              help='Buffer size around lat/lon point for image creation.'
-              ' (in meters)')
 @click.option('--output', '-o', type=str,
               default='./{}.gif'.format(str(uuid.uuid1())),
-              help='output filename')
-@click.option('--saveintermediary/--nosaveintermediary', default=False,
-              help='Save intermediary files as bmp')
-@click.option('--max_images', type=int, default=100,
-              help='Maximum number of images to be used')
-@click.option('--singleenhancement/--nosingleenhancement', default=False,
-              help='If True the same contrast stretch is performed for '
-              'all scenes, this stretch is computed for the first scene')
-@click.option('--enhancement/--noenhancement', default=False,
-              help='If True histogram stretch is computed for scenes')
-@click.option('--percentiles', type=str, default='2,98',
-              help='Percentiles for upper and lower histogram enhancement')
-@click.option('--contrast_factor', type=float, default=1.0,
-              help='Contrast enhancement factor')
-@click.option('--brightness_factor', type=float, default=1.0,
-              help='Brightness enhancement factor')
-@click.option('--duration', type=float, default=0.5,
-              help='Duration of each frame, in seconds')
+              help='output filename, the extension selects the format: '
+              '.gif, .webp or, with ffmpeg, .mp4 and .webm')
 @click.option('--taboo_index', type=str, default=None,
               help='List of comma separated integers with image indices that '
               'will not be included in the timelapse')
-@click.option('--stac_endpoint', '-s', type=str, # pylint: disable=too-many-locals,too-many-arguments
-              default='https://stac.amskepler.com/v100/search',
-              help='STAC search endpoint')
-def main(lat, lon,
-         sensor, level,
-         start_date, end_date, buffer_size, res, bands,
-         output, saveintermediary, max_images, singleenhancement,
-         enhancement, percentiles, contrast_factor, brightness_factor,
-         duration,
-         taboo_index, stac_endpoint):
+@gif_options
+def gif(lat, lon, output, # pylint: disable=too-many-arguments
+        cache, search_ttl, block_cache, cache_dir, cache_max_bytes,
+        cache_format, profile, **kwargs):
     """ Create animated GIF from CBERS 4 data"""
 
-    rgb = bands.split(',')
-    assert len(rgb) == 3, "Exactly 3 bands must be defined"
-
-    percents = percentiles.split(',')
-    assert len(percents) == 2, 'Two percentiles must be defined'
-    p_min = int(percents[0])
-    p_max = int(percents[1])
-
-    taboo_list = list()
-    if taboo_index:
-        for item in taboo_index.split(','):
-            taboo_list.append(int(item))
-
-    scenes = utils.search(sensor=sensor,
-                          mode='stac',
-                          lon=lon, lat=lat,
-                          level=None if level == 'all' else level,
-                          start_date=start_date,
-                          end_date=end_date,
-                          stac_endpoint=stac_endpoint)
-    click.echo('{} scenes found'.format(len(scenes)))
-
-    # Output transform
-    aoi_wgs84 = utils.lonlat_to_geojson(lon, lat, buffer_size)
-    aoi_bounds = utils.feat_to_bounds(aoi_wgs84) # (minx, miny, maxx, maxy)
-    width = int((aoi_bounds[2] - aoi_bounds[0]) / float(res))
-    height = int((aoi_bounds[3] - aoi_bounds[1]) / float(res))
-    #dst_affine = transform.from_bounds(*aoi_bounds, width, height)
-
-    s3_bucket = 'cbers-pds'
-
-    images = []
-
-    p_min_value = [None] * 3
-    p_max_value = [None] * 3
-
-    for scene_no, scene in enumerate(scenes):
-
-        if scene_no in taboo_list:
-            print('Skipping scene {}'.format(scene_no))
-            continue
-
-        if scene_no >= max_images:
-            break
-
-        print(scene)
-        s3_key = 's3://{bucket}/{dir}'.format(bucket=s3_bucket,
-                                              dir=scene['key'])
-        print(s3_key)
-
-        out = np.zeros((3, height, width), dtype=np.uint8)
-
-        for band_no, band in enumerate(rgb):
-
-            matrix = utils.get_frame_matrix(s3_key, band, scene, aoi_bounds,
-                                            width, height)
-
-            # Compute histogram stretch parameters. If singleenhancement
-            # is defined then only the first image is used.
-            if (not images or not singleenhancement) and enhancement:
-                p_min_value[band_no], \
-                    p_max_value[band_no] = np.\
-                                           percentile(matrix[matrix > 0],
-                                                      (p_min, p_max))
-                print('{}, {}-{}, {}-{}'.format(band_no,
-                                                p_min,
-                                                p_max,
-                                                p_min_value,
-                                                p_max_value))
-
-            if enhancement:
-                matrix = np.where(matrix > 0,
-                                  utils.\
-                                  linear_rescale(matrix,
-                                                 in_range=\
-                                                 [int(p_min_value[band_no]),
-                                                  int(p_max_value[band_no])],
-                                                 out_range=[1, 255]),
-                                  0)
-
-            #import pdb; pdb.set_trace()
-            #out[band_no] = 255.0 * (matrix - np.min(matrix)) / np.ptp(matrix)
-            out[band_no] = 1.0 * matrix
-
-        img = Image.fromarray(np.dstack(out))
-
-        if saveintermediary:
-            img.save('{}.bmp'.format(scene_no))
-
-        contrast = ImageEnhance.Contrast(img)
-        enh_image = contrast.enhance(contrast_factor)
-        enh_image = ImageEnhance.Contrast(enh_image).enhance(brightness_factor)
-
-        text_value = '%d, %s' % (scene_no,
-                                 scene['acquisition_date'])
-        draw = ImageDraw.Draw(enh_image)
-        xst, yst = draw.textsize(text_value, font=FONT)
-        draw.rectangle([(5, 5), (xst+15, yst+15)],
-                       fill=(255, 255, 255))
-        draw.text((10, 10), text_value,
-                  (0, 0, 0), font=FONT)
-
-        images.append(enh_image)
-
-    if images:
-        utils.save_animated_gif(output, images, duration=duration)
+    if profile:
+        profiling.enable()
+
+    try:
+        frame_cache, search_cache, block_cache, render_cache = make_caches(
+            cache, search_ttl, block_cache, cache_dir, cache_max_bytes,
+            cache_format)
+        render.render_gif(render.GifJob(lat, lon, **kwargs), output,
+                          frame_cache=frame_cache, search_cache=search_cache,
+                          block_cache=block_cache, render_cache=render_cache)
+        echo_io_stats()
+    finally:
+        write_profile(profile)
+
+@main.command('batch')
+@click.argument('points', type=click.Path(exists=True, dir_okay=False))
+@click.option('--output_dir', type=click.Path(file_okay=False), default='.',
+              help='Directory for the GIF files, named after the point id '
+              'unless an output column / property is given')
+@click.option('--output_format', default='gif',
+              type=click.Choice([extension[1:]
+                                 for extension in sinks.EXTENSIONS]),
+              help='Format of the files named after the point id')
+@click.option('--summary', type=str, default=None,
+              help='Write a JSON summary of all jobs to this file')
+@click.option('--plan/--noplan', default=True,
+              help='Read each scene once for all jobs with overlapping '
+              'AOIs, AOIs are aligned to the --res grid')
+@gif_options
+def batch(points, output_dir, output_format, summary, plan, # pylint: disable=too-many-arguments,too-many-locals
+          cache, search_ttl, block_cache, cache_dir, cache_max_bytes,
+          cache_format, profile, **kwargs):
+    """
+    Create one animated GIF for each point in a CSV (lat, lon columns)
+    or GeoJSON (Point features) file. Columns / properties named id,
+    output, start_date, end_date, buffer_size, max_images and
+    taboo_index override the options for that point.
+
+    Caches, the STAC session and the read and render pools are shared
+    by all jobs.
+    With --plan all jobs are searched first and each scene is read once
+    for each group of overlapping AOIs, jobs then draw from the cache.
+    """
+
+    if profile:
+        profiling.enable()
+    tmp_dir = None
+    try:
+        jobs = utils.read_points(points)
+        click.echo('{} jobs'.format(len(jobs)))
+        os.makedirs(output_dir, exist_ok=True)
+
+        frame_cache, search_cache, block_cache, render_cache = make_caches(
+            cache, search_ttl, block_cache, cache_dir, cache_max_bytes,
+            cache_format)
+        if plan and frame_cache is None:
+            # Planned reads are handed to the jobs through a cache
+            tmp_dir = tempfile.TemporaryDirectory(prefix='cbersgif')
+            frame_cache = FrameCache(tmp_dir.name, cache_max_bytes,
+                                     cache_format)
+
+        results = list()
+        with ThreadPoolExecutor(max_workers=kwargs['workers']) as executor, \
+             (render.make_render_pool(kwargs['render_procs'])
+              if kwargs['render_procs'] else contextlib.nullcontext()) \
+             as render_pool:
+            for job in jobs:
+                options = dict(kwargs)
+                options.update({key: value for key, value in job.items()
+                                if key not in ('id', 'lat', 'lon', 'output')})
+                output = os.path.join(output_dir,
+                                      job.get('output',
+                                              '{}.{}'.format(job['id'],
+                                                             output_format)))
+                job['result'] = {'id': job['id'], 'lat': job['lat'],
+                                 'lon': job['lon'], 'output': output}
+                start = time.time()
+                try:
+                    aoi_bounds = None
+                    if plan:
+                        aoi_bounds = planner.snap_bounds(
+                            geometry.lonlat_to_bounds(job['lon'], job['lat'],
+                                                      options['buffer_size']),
+                            options['res'])
+                    job['job'] = render.GifJob(job['lat'], job['lon'],
+                                               aoi_bounds=aoi_bounds,
+                                               **options)
+                    if plan:
+                        job['job'].search(search_cache)
+                except Exception as err: # pylint: disable=broad-except
+                    job['result']['error'] = str(err)
+                job['result']['elapsed'] = round(time.time() - start, 3)
+
+            if plan:
+                planned = [(job['job'].aoi_bounds,
+                            [scene for _, scene in job['job'].selected(
+                                frame_cache=frame_cache, executor=executor,
+                                block_cache=block_cache)])
+                           for job in jobs if 'error' not in job['result']]
+                read_count = planner.prefetch(planned,
+                                              kwargs['bands'].split(','),
+                                              kwargs['res'], frame_cache,
+                                              executor, kwargs['overviews'],
+                                              block_cache=block_cache)
+                click.echo('{} scenes read for {} jobs'.format(read_count,
+                                                               len(planned)))
+
+            for job in jobs:
+                result = job['result']
+                if 'error' in result:
+                    result['status'] = 'error'
+                    results.append(result)
+                    continue
+                start = time.time()
+                try:
+                    result.update(render.render_gif(
+                        job['job'], result['output'],
+                        frame_cache=frame_cache, search_cache=search_cache,
+                        block_cache=block_cache, render_cache=render_cache,
+                        executor=executor, render_pool=render_pool))
+                    result['status'] = 'ok'
+                except Exception as err: # pylint: disable=broad-except
+                    result['status'] = 'error'
+                    result['error'] = str(err)
+                result['elapsed'] = round(result['elapsed'] +
+                                          time.time() - start, 3)
+                results.append(result)
+
+        for result in results:
+            if result['status'] == 'ok':
+                click.echo('{id}: {output}, {frames} frames from '
+                           '{scenes_found} scenes, {failed} failed reads, '
+                           '{elapsed}s'.format(**result))
+            else:
+                click.echo('{id}: error, {error}'.format(**result))
+        echo_io_stats()
+    finally:
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+        write_profile(profile)
+
+    if summary:
+        with open(summary, 'w') as summary_file:
+            json.dump(results, summary_file, indent=2)
+
+@main.group('cache')
+@cache_options
+@click.pass_context
+def cache_group(ctx, cache_dir, cache_max_bytes, cache_format):
+    """Inspect and manage the frame cache"""
+    ctx.obj = FrameCache(cache_dir,
+                         store_max_bytes('frames', cache_max_bytes),
+                         cache_format)
+    ctx.meta['blocks'] = BlockCache(cache_dir, cache_max_bytes, cache_format)
+    ctx.meta['rendered'] = RenderedCache(cache_dir, cache_max_bytes,
+                                         cache_format)
+
+@cache_group.command('stats')
+@click.pass_context
+def cache_stats(ctx):
+    """Show cache size and hit/miss/eviction counters"""
+    frame_stats = ctx.obj.stats()
+    for key, value in frame_stats.items():
+        click.echo('{}: {}'.format(key, value))
+    total = frame_stats['bytes']
+    total_max = frame_stats['max_bytes']
+    for name, prefix in (('blocks', 'block'), ('rendered', 'rendered')):
+        stats = ctx.meta[name].stats()
+        for key in ('entries', 'bytes', 'max_bytes'):
+            click.echo('{}_{}: {}'.format(prefix, key, stats[key]))
+        total += stats['bytes']
+        total_max += stats['max_bytes']
+    click.echo('total_bytes: {}'.format(total))
+    click.echo('total_max_bytes: {}'.format(total_max))
+
+@cache_group.command('prune')
+@click.option('--max_bytes', type=parse_size, default=None,
+              help='Target size of the whole cache, split between frames, '
+              'blocks and rendered frames, defaults to the cache maximum size')
+@click.pass_context
+def cache_prune(ctx, max_bytes):
+    """Evict least recently used entries"""
+    evicted = ctx.obj.prune(None if max_bytes is None
+                            else store_max_bytes('frames', max_bytes))
+    evicted += ctx.meta['blocks'].prune(max_bytes)
+    evicted += ctx.meta['rendered'].prune(max_bytes)
+    click.echo('{} entries evicted'.format(evicted))
+
+@cache_group.command('migrate')
+@click.option('--drop', is_flag=True, default=False,
+              help='Remove entries that cannot be re-keyed')
+@click.pass_context
+def cache_migrate(ctx, drop):
+    """Move entries cached with older key versions to their current
+    keys, instead of reading them again"""
+    stores = (
+        ('frames', ctx.obj.rekey(keys.migrate_frame, drop)),
+        ('blocks', ctx.meta['blocks'].migrate(drop)),
+        ('rendered', ctx.meta['rendered'].migrate(drop)),
+    )
+    for name, result in stores:
+        click.echo('{}: {} migrated, {} current, {} legacy, {} orphaned, '
+                   '{} dropped'.format(name, result['migrated'],
+                                       result['current'], result['legacy'],
+                                       result['orphaned'], result['dropped']))
+    click.echo('Legacy frames are re-keyed when first read for the same '
+               'AOI and size')
+
+@cache_group.command('clear')
+@click.pass_context
+def cache_clear(ctx):
+    """Remove all cache entries, including search results, blocks and
+    rendered frames"""
+    ctx.obj.clear()
+    ctx.meta['blocks'].clear()
+    ctx.meta['rendered'].clear()
+    SearchCache(ctx.obj.directory).clear()
+    click.echo('Cache cleared')
 
 if __name__ == '__main__':
     main() # pylint: disable=no-value-for-parameter
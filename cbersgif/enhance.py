@@ -0,0 +1,283 @@
+"""
+cbersgif enhancement module, contrast stretch of (bands, H, W) stacks
+"""
+# -*- coding: utf-8 -*-
+
+import math
+
+import numpy as np
+
+from PIL import ImageEnhance
+
+from cbersgif import profiling
+
+def _histogram_dtype(dtype):
+    '''
+    True if values of dtype may be counted with np.bincount
+    '''
+    return np.issubdtype(dtype, np.integer) and \
+        np.iinfo(dtype).min >= 0 and np.dtype(dtype).itemsize <= 2
+
+def band_histogram(band):
+    '''
+    Histogram of the valid (> 0) pixels of an unsigned 8/16 bit band,
+    computed in O(N) without a masked copy
+
+    :param band: np array, other types are handled by
+                 masked_percentiles and accumulate_histograms
+    :return: counts indexed by value, count for 0 is always 0
+    '''
+
+    assert _histogram_dtype(band.dtype), \
+        "Histograms require unsigned 8/16 bit bands, got {}".format(band.dtype)
+    hist = np.bincount(band.ravel(), minlength=np.iinfo(band.dtype).max + 1)
+    hist[0] = 0
+    return hist
+
+def histogram_percentiles(hist, percents):
+    '''
+    Percentiles from a histogram, same result as np.percentile with
+    linear interpolation over the counted values
+
+    :param hist: counts indexed by value
+    :param percents list: percentiles in [0, 100]
+    :return: percentile values
+    :rtype: list
+    '''
+
+    cumsum = np.cumsum(hist)
+    total = int(cumsum[-1]) if cumsum.size else 0
+    if not total:
+        return [0.0] * len(percents)
+
+    result = list()
+    for percent in percents:
+        rank = percent / 100.0 * (total - 1)
+        # Value of the k-th (0 based) sorted sample
+        low = float(np.searchsorted(cumsum, math.floor(rank), side='right'))
+        high = float(np.searchsorted(cumsum, math.ceil(rank), side='right'))
+        result.append(low + (high - low) * (rank - math.floor(rank)))
+    return result
+
+def masked_percentiles(band, percents):
+    '''
+    Percentiles of the valid (> 0) pixels of a band, same result as
+    np.percentile with linear interpolation. Unsigned 8/16 bit bands
+    use a histogram, other types use np.partition instead of a full
+    sort.
+
+    :param band: np array
+    :param percents list: percentiles in [0, 100]
+    :return: percentile values
+    :rtype: list
+    '''
+
+    if _histogram_dtype(band.dtype):
+        return histogram_percentiles(band_histogram(band), percents)
+
+    values = band[band > 0]
+    if not values.size:
+        return [0.0] * len(percents)
+
+    ranks = [percent / 100.0 * (values.size - 1) for percent in percents]
+    kth = sorted(set([int(math.floor(rank)) for rank in ranks] +
+                     [int(math.ceil(rank)) for rank in ranks]))
+    values = np.partition(values, kth)
+
+    result = list()
+    for rank in ranks:
+        low = float(values[int(math.floor(rank))])
+        high = float(values[int(math.ceil(rank))])
+        result.append(low + (high - low) * (rank - math.floor(rank)))
+    return result
+
+@profiling.timed('stretch')
+def compute_stretch(stack, percents):
+    '''
+    Stretch parameters for each band of a stack
+
+    :param stack: (bands, H, W) array
+    :param percents list: lower and upper percentiles
+    :return: lists with lower and upper values for each band
+    :rtype: tuple
+    '''
+
+    p_min_value = list()
+    p_max_value = list()
+    for band in stack:
+        low, high = masked_percentiles(band, percents)
+        p_min_value.append(low)
+        p_max_value.append(high)
+    return p_min_value, p_max_value
+
+@profiling.timed('histograms')
+def accumulate_histograms(stack, histograms=None):
+    '''
+    Add the band histograms of a stack to histograms, used to compute
+    a single stretch for several scenes. Bands of types other than
+    unsigned 8/16 bit can not be counted, their valid (> 0) values are
+    kept instead.
+
+    :param stack: (bands, H, W) array
+    :param histograms list: histograms for each band, None to start
+    :return: updated histograms, for each band an array of counts
+             indexed by value or a list of valid value arrays
+    :rtype: list
+    '''
+
+    if _histogram_dtype(stack.dtype):
+        band_hists = [band_histogram(band) for band in stack]
+    else:
+        band_hists = [[band[band > 0]] for band in stack]
+    if histograms is None:
+        return band_hists
+    result = list()
+    for hist, band_hist in zip(histograms, band_hists):
+        if isinstance(hist, list) or isinstance(band_hist, list):
+            result.append(_values(hist) + _values(band_hist))
+            continue
+        if hist.size < band_hist.size:
+            hist, band_hist = band_hist, hist
+        hist = hist.copy()
+        hist[:band_hist.size] += band_hist
+        result.append(hist)
+    return result
+
+def _values(hist):
+    '''
+    Valid values of an accumulated band, see accumulate_histograms
+    '''
+    if isinstance(hist, list):
+        return hist
+    return [np.repeat(np.arange(hist.size), hist)]
+
+@profiling.timed('stretch')
+def histogram_stretch(histograms, percents):
+    '''
+    Stretch parameters from accumulated band histograms
+
+    :param histograms list: histograms for each band, see
+                            accumulate_histograms
+    :param percents list: lower and upper percentiles
+    :return: lists with lower and upper values for each band
+    :rtype: tuple
+    '''
+
+    p_min_value = list()
+    p_max_value = list()
+    for hist in histograms:
+        if isinstance(hist, list):
+            low, high = masked_percentiles(np.concatenate(hist), percents)
+        else:
+            low, high = histogram_percentiles(hist, percents)
+        p_min_value.append(low)
+        p_max_value.append(high)
+    return p_min_value, p_max_value
+
+def stretch_lut(max_value, in_range, out_range=(1, 255)):
+    '''
+    Lookup table for a linear stretch of integer values in
+    [0, max_value]. 0 is nodata and is kept as 0, the other values are
+    truncated to integers as done by utils.linear_rescale followed
+    by a cast to uint8.
+
+    :param max_value int: largest input value
+    :param in_range list: two items, begin and end input range
+    :param out_range list: two items, begin and end output range
+    :return: uint8 lookup table with max_value + 1 entries
+    '''
+
+    imin, imax = in_range
+    omin, omax = out_range
+    lut = np.arange(max_value + 1, dtype=np.float64)
+    np.clip(lut, imin, imax, out=lut)
+    # Same operation order as utils.linear_rescale
+    lut -= imin
+    lut /= float(max(imax - imin, 1))
+    lut *= omax - omin
+    lut += omin
+    lut = lut.astype(np.uint8)
+    lut[0] = 0
+    return lut
+
+def stretch_band(band, in_range, out, out_range=(1, 255)):
+    '''
+    Linear stretch of a band written into a uint8 buffer, pixels with
+    value 0 are kept as 0
+
+    :param band: np array
+    :param in_range list: two items, begin and end input range
+    :param out: uint8 output, same shape as band
+    :param out_range list: two items, begin and end output range
+    '''
+
+    if _histogram_dtype(band.dtype):
+        # Indices are always in range, 'clip' avoids buffering out
+        np.take(stretch_lut(np.iinfo(band.dtype).max, in_range, out_range),
+                band, out=out, mode='clip')
+        return
+
+    # Generic path, a single float32 temporary
+    imin, imax = in_range
+    omin, omax = out_range
+    tmp = np.empty(band.shape, dtype=np.float32)
+    np.clip(band, imin, imax, out=tmp)
+    tmp -= imin
+    tmp /= float(max(imax - imin, 1))
+    tmp *= omax - omin
+    tmp += omin
+    np.copyto(out, tmp, casting='unsafe')
+    out[band <= 0] = 0
+
+@profiling.timed('rescale')
+def stretch_stack(stack, p_min_value, p_max_value, out=None):
+    '''
+    Linear stretch of all bands of a stack into a uint8 stack, the
+    input range of each band is truncated to integers
+
+    :param stack: (bands, H, W) array
+    :param p_min_value list: lower input value for each band
+    :param p_max_value list: upper input value for each band
+    :param out: optional (bands, H, W) uint8 output
+    :return: (bands, H, W) uint8 array
+    '''
+
+    if out is None:
+        out = np.empty(stack.shape, dtype=np.uint8)
+    for band_no, band in enumerate(stack):
+        stretch_band(band,
+                     [int(p_min_value[band_no]), int(p_max_value[band_no])],
+                     out[band_no])
+    return out
+
+@profiling.timed('rescale')
+def to_uint8(stack, out=None):
+    '''
+    Stack cast to uint8 without enhancement
+
+    :param stack: (bands, H, W) array
+    :param out: optional (bands, H, W) uint8 output
+    :return: (bands, H, W) uint8 array
+    '''
+
+    if out is None:
+        out = np.empty(stack.shape, dtype=np.uint8)
+    np.copyto(out, stack, casting='unsafe')
+    return out
+
+@profiling.timed('enhance')
+def pil_enhance(img, contrast_factor=1.0, brightness_factor=1.0):
+    '''
+    PIL contrast and brightness factors applied to a frame
+
+    :param img: PIL Image
+    :param contrast_factor float: contrast enhancement factor
+    :param brightness_factor float: brightness enhancement factor
+    :return: enhanced PIL Image
+    '''
+    if contrast_factor == 1.0 and brightness_factor == 1.0:
+        return img.copy()
+    enh_image = ImageEnhance.Contrast(img).enhance(contrast_factor)
+    # @todo brightness factor has always been applied as a contrast
+    # enhancement, kept for compatibility with existing animations
+    return ImageEnhance.Contrast(enh_image).enhance(brightness_factor)
@@ -0,0 +1,71 @@
+"""
+cbersgif geometry module, AOI computation with cached transformers
+"""
+# -*- coding: utf-8 -*-
+
+from functools import lru_cache
+
+import numpy as np
+
+import pyproj
+
+@lru_cache(maxsize=None)
+def get_transformer(src_crs, dst_crs):
+    '''
+    Memoized transformer, coordinates are always (x, y) / (lon, lat)
+
+    :param src_crs str: source CRS, for instance 'epsg:4326'
+    :param dst_crs str: destination CRS
+    :rtype: pyproj.Transformer
+    '''
+    return pyproj.Transformer.from_crs(src_crs, dst_crs, always_xy=True)
+
+def lonlat_to_bounds(lon, lat, buff_size=None, crs='epsg:3857'):
+    '''
+    Bounds of a square buffer around a Lat Lon center coordinate.
+    The buffer is defined in web mercator, same as
+    utils.lonlat_to_geojson, bounds are computed without building
+    intermediary geometries.
+
+    :param float lon: Longitude (WGS84, angular)
+    :param float lat: Latitude (WGS84, angular)
+    :param float buff_size: Buffer size in meters
+    :param str crs: EPSG for bounds
+    :return: Bounds as tuple, (minx, miny, maxx, maxy)
+    '''
+    bounds = lonlat_to_bounds_batch(np.array([lon], dtype=np.float64),
+                                    np.array([lat], dtype=np.float64),
+                                    buff_size, crs)
+    return tuple(float(value) for value in bounds[0])
+
+def lonlat_to_bounds_batch(lons, lats, buff_size=None, crs='epsg:3857'):
+    '''
+    Vectorized lonlat_to_bounds
+
+    :param lons: array of longitudes (WGS84, angular)
+    :param lats: array of latitudes (WGS84, angular)
+    :param float buff_size: Buffer size in meters
+    :param str crs: EPSG for bounds
+    :return: (N, 4) array, each row is (minx, miny, maxx, maxy)
+    '''
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    buff_size = buff_size or 0.
+    x, y = get_transformer('epsg:4326', 'epsg:3857').transform(lons, lats)
+    x = np.asarray(x)
+    y = np.asarray(y)
+
+    if crs.lower() == 'epsg:3857':
+        return np.stack([x - buff_size, y - buff_size,
+                         x + buff_size, y + buff_size], axis=-1)
+
+    # Square corners, bounds of the projected corners
+    corners_x = np.stack([x - buff_size, x - buff_size,
+                          x + buff_size, x + buff_size], axis=-1)
+    corners_y = np.stack([y - buff_size, y + buff_size,
+                          y + buff_size, y - buff_size], axis=-1)
+    corners_x, corners_y = get_transformer('epsg:3857', crs).\
+        transform(corners_x, corners_y)
+    return np.stack([np.min(corners_x, axis=-1), np.min(corners_y, axis=-1),
+                     np.max(corners_x, axis=-1), np.max(corners_y, axis=-1)],
+                    axis=-1)
@@ -0,0 +1,251 @@
+"""
+cbersgif gif module, global palette quantization and GIF encoding
+"""
+# -*- coding: utf-8 -*-
+
+import struct
+
+import numpy as np
+from PIL import GifImagePlugin, Image
+
+# Palette entries used by the frames, the last of the 256 GIF entries is
+# kept for the transparent pixels of delta frames
+COLORS = 255
+TRANSPARENT = 255
+
+# The nearest palette entry is precomputed for 32 levels per channel
+LUT_BITS = 5
+
+# Pixels sampled from each frame to build the palette
+DEFAULT_SAMPLE_SIZE = 2 ** 14
+
+# Frames buffered before the palette is built and the file is written
+DEFAULT_PALETTE_FRAMES = 8
+
+def _median_cut():
+    '''
+    PIL median cut quantization method, the constant moved to
+    Image.Quantize in recent versions
+    '''
+    return getattr(Image, 'Quantize', Image).MEDIANCUT
+
+def sample_pixels(rgb, size=DEFAULT_SAMPLE_SIZE, seed=0):
+    '''
+    Random sample of the pixels of a frame
+
+    :param rgb: (height, width, 3) uint8 array
+    :param size int: maximum number of pixels
+    :param seed int: random seed, the same pixels are sampled for a
+                     given frame size
+    :return: (n, 3) uint8 array
+    '''
+    pixels = rgb.reshape(-1, 3)
+    if len(pixels) <= size:
+        return pixels
+    rng = np.random.RandomState(seed)
+    return pixels[rng.choice(len(pixels), size, replace=False)]
+
+def build_palette(frames, colors=COLORS, sample_size=DEFAULT_SAMPLE_SIZE):
+    '''
+    Palette shared by all frames, median cut over a sample of the pixels
+    of every frame
+
+    :param frames list: (height, width, 3) uint8 arrays
+    :param colors int: number of palette entries
+    :param sample_size int: pixels sampled from each frame
+    :return: (colors, 3) uint8 array, unused entries repeat the first one
+    '''
+    assert frames, 'At least one frame is needed to build the palette'
+    sample = np.concatenate([sample_pixels(frame, sample_size, seed)
+                             for seed, frame in enumerate(frames)])
+    image = Image.fromarray(np.ascontiguousarray(sample[:, np.newaxis]),
+                            'RGB')
+    quantized = image.quantize(colors=colors, method=_median_cut())
+    used = len(np.unique(np.asarray(quantized)))
+    entries = np.array(quantized.getpalette()[:3 * used],
+                       dtype=np.uint8).reshape(-1, 3)
+    palette = np.empty((colors, 3), dtype=np.uint8)
+    palette[:] = entries[0]
+    palette[:len(entries)] = entries
+    return palette
+
+def palette_lut(palette):
+    '''
+    Nearest palette entry for each cell of a 2**LUT_BITS levels per
+    channel RGB grid, distances are measured from the cell centers
+
+    :param palette: (n, 3) uint8 array, n <= 256
+    :return: uint8 array indexed by lut_index
+    '''
+    levels = 1 << LUT_BITS
+    step = 256 // levels
+    centers = np.arange(levels, dtype=np.float32) * step + step / 2.0
+    grid = np.stack(np.meshgrid(centers, centers, centers, indexing='ij'),
+                    axis=-1).reshape(-1, 3)
+    entries = palette.astype(np.float32)
+    # |g - p|**2 = |g|**2 - 2 g.p + |p|**2, |g|**2 does not change the
+    # nearest entry
+    distances = (entries ** 2).sum(axis=1) - 2 * grid.dot(entries.T)
+    return distances.argmin(axis=1).astype(np.uint8)
+
+def lut_index(rgb):
+    '''
+    Index of each pixel in the palette_lut grid
+
+    :param rgb: (height, width, 3) uint8 array
+    :return: (height, width) uint16 array
+    '''
+    shift = 8 - LUT_BITS
+    cells = (rgb >> shift).astype(np.uint16)
+    return (cells[..., 0] << (2 * LUT_BITS)) | (cells[..., 1] << LUT_BITS) | \
+        cells[..., 2]
+
+def quantize(rgb, lut):
+    '''
+    Palette indices of a frame
+
+    :param rgb: (height, width, 3) uint8 array
+    :param lut: see palette_lut
+    :return: (height, width) uint8 array
+    '''
+    return lut[lut_index(rgb)]
+
+def delta(indices, previous):
+    '''
+    Smallest rectangle holding the pixels changed since the previous
+    frame, unchanged pixels inside it are set to TRANSPARENT
+
+    :param indices: (height, width) palette indices
+    :param previous: palette indices of the previous frame
+    :return: ((left, top), indices), a single transparent pixel if
+             nothing changed
+    '''
+    changed = indices != previous
+    rows = np.flatnonzero(changed.any(axis=1))
+    if not rows.size:
+        return (0, 0), np.full((1, 1), TRANSPARENT, dtype=np.uint8)
+    cols = np.flatnonzero(changed.any(axis=0))
+    window = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+    result = np.where(changed[window], indices[window],
+                      np.uint8(TRANSPARENT))
+    return (int(cols[0]), int(rows[0])), result
+
+class GifEncoder:
+    """
+    Animated GIF encoder with a single global palette
+
+    The palette is built from the first palette_frames frames, these
+    frames are kept in memory until then, and is reused for the frames
+    that follow. Frames are quantized with a lookup table and, with
+    delta, only the rectangle changed since the previous frame is
+    stored, unchanged pixels being transparent. The file is only
+    created when the first frame is written.
+    """
+
+    def __init__(self, filename, duration, # pylint: disable=too-many-arguments
+                 palette_frames=DEFAULT_PALETTE_FRAMES,
+                 sample_size=DEFAULT_SAMPLE_SIZE, palette=None, delta=True): # pylint: disable=redefined-outer-name
+        '''
+        Constructor
+
+        :param filename str: output filename
+        :param duration float: duration for each frame in seconds
+        :param palette_frames int: frames sampled to build the palette
+        :param sample_size int: pixels sampled from each frame
+        :param palette: optional (n, 3) uint8 palette, n <= COLORS,
+                        built from the first frames if None
+        :param delta bool: store only the pixels changed between frames
+        '''
+        self.filename = filename
+        self.duration = duration
+        self.palette_frames = max(1, palette_frames)
+        self.sample_size = sample_size
+        self.palette = palette
+        self.delta = delta
+        self.frames = 0
+        self._pending = list()
+        self._lut = None
+        self._previous = None
+        self._file = None
+
+    def append(self, pil_image):
+        '''
+        Append a frame
+
+        :param pil_image: PIL Image
+        '''
+        rgb = np.asarray(pil_image.convert('RGB'))
+        self.frames += 1
+        if self._lut is None and self.palette is None:
+            self._pending.append(rgb)
+            if len(self._pending) >= self.palette_frames:
+                self._flush()
+            return
+        self._write(rgb)
+
+    def _flush(self):
+        '''
+        Build the palette and write the buffered frames
+        '''
+        if self.palette is None:
+            self.palette = build_palette(self._pending,
+                                         sample_size=self.sample_size)
+        pending, self._pending = self._pending, list()
+        for rgb in pending:
+            self._write(rgb)
+
+    def _open(self, width, height):
+        '''
+        Create the file and write the header with the global palette
+        '''
+        assert len(self.palette) <= COLORS, 'Palette too large'
+        self._lut = palette_lut(self.palette)
+        table = np.zeros((256, 3), dtype=np.uint8)
+        table[:len(self.palette)] = self.palette
+        self._file = open(self.filename, 'wb')
+        self._file.write(b'GIF89a')
+        # Global color table of 2**(7+1) entries, 8 bits per channel
+        self._file.write(struct.pack('<HHBBB', width, height, 0xf7, 0, 0))
+        self._file.write(table.tobytes())
+        # Loop forever
+        self._file.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' +
+                         struct.pack('<H', 0) + b'\x00')
+
+    def _write(self, rgb):
+        '''
+        Quantize and write a frame
+        '''
+        if self._file is None:
+            self._open(rgb.shape[1], rgb.shape[0])
+        indices = quantize(rgb, self._lut)
+        if self._previous is None or not self.delta:
+            offset, data = (0, 0), indices
+        else:
+            assert indices.shape == self._previous.shape, \
+                'All frames must have the same size'
+            offset, data = delta(indices, self._previous)
+        self._previous = indices
+        image = Image.fromarray(np.ascontiguousarray(data), 'P')
+        # Frames are not disposed so transparent pixels show the
+        # previous frame
+        for chunk in GifImagePlugin.getdata(
+                image, offset, duration=int(round(self.duration * 1000)),
+                transparency=TRANSPARENT, disposal=1):
+            self._file.write(chunk)
+
+    def close(self):
+        '''
+        Finish the output file
+        '''
+        if self._pending:
+            self._flush()
+        if self._file is not None:
+            self._file.write(b';')
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
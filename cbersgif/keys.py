@@ -0,0 +1,217 @@
+"""
+cbersgif keys module, canonical versioned cache keys
+"""
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import pickle
+
+# Version of the key scheme, part of every key. Version 1 hashed pickled
+# dicts with MD5.
+KEY_VERSION = 2
+
+# To be increased when band reads or warps change, frames cached by
+# older readers are not used
+READER_VERSION = 2
+
+# AOI bounds are rounded to the millimeter, equivalent floats share keys
+BOUNDS_DECIMALS = 3
+
+# Version 1 keys pickled with the default protocol of Python 3.7
+LEGACY_PICKLE_PROTOCOL = 3
+
+def canonical(value):
+    '''
+    Canonical JSON text of value: sorted keys, no whitespace, tuples as
+    lists and floats in their shortest round trip form
+
+    :param value: JSON serializable value
+    :rtype: str
+    '''
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+def digest(value):
+    '''
+    128 bit blake2b hash of the canonical JSON text of value. Chosen for
+    stability, a key takes about twice as long as a version 1 key,
+    which is negligible next to band reads.
+
+    :param value: JSON serializable value
+    :return: 32 hex digits
+    :rtype: str
+    '''
+    return hashlib.blake2b(canonical(value).encode(),
+                           digest_size=16).hexdigest()
+
+def legacy_digest(value):
+    '''
+    Version 1 key, MD5 of the pickled sorted items of a dict
+
+    :param value dict: picklable values
+    :return: 32 hex digits
+    :rtype: str
+    '''
+    return hashlib.md5(pickle.dumps(sorted(value.items()),
+                                    protocol=LEGACY_PICKLE_PROTOCOL)).\
+        hexdigest()
+
+def legacy_frame_key(s3_key, band, scene, aoi_bounds, width, height): # pylint: disable=too-many-arguments
+    '''
+    Version 1 key of a frame. Version 1 cli bounds and sizes differ
+    from the current ones in the last digits, see utils.legacy_aoi.
+
+    :param aoi_bounds tuple: (minx, miny, maxx, maxy) as computed by
+                             the version 1 cli
+    :rtype: str
+    '''
+    return legacy_digest({
+        's3_key': s3_key,
+        'band': band,
+        'scene': scene,
+        'aoi_bounds': tuple(aoi_bounds),
+        'width': width,
+        'height': height,
+    })
+
+def quantize_bounds(bounds, decimals=BOUNDS_DECIMALS):
+    '''
+    Bounds rounded to decimals, -0.0 is stored as 0.0
+
+    :param bounds list: (minx, miny, maxx, maxy)
+    :rtype: list
+    '''
+    return [round(float(value), decimals) + 0.0 for value in bounds]
+
+def scene_id(scene):
+    '''
+    Normalized scene id
+
+    :param scene dict: scene data as returned from CBERS search
+    :rtype: str
+    '''
+    return scene['scene_id'].strip().upper()
+
+def frame_meta(s3_key, band, scene, aoi_bounds, width, height, # pylint: disable=too-many-arguments
+               overviews=True, path='direct'):
+    '''
+    Key fields of a band matrix in the frame cache, only the inputs
+    of the read are kept
+
+    :param s3_key str: S3 prefix for scene, up to directory
+    :param band str: band number
+    :param scene dict: scene data as returned from CBERS search
+    :param aoi_bounds list: (minx, miny, maxx, maxy)
+    :param width int: matrix width in pixels
+    :param height int: matrix height in pixels
+    :param overviews bool: read from internal overviews when possible
+    :param path str: read path, 'direct' for warps of the band file or
+                     'blocks' for warps of cached blocks
+    :rtype: dict
+    '''
+    return {
+        'kind': 'frame',
+        'version': KEY_VERSION,
+        'reader': READER_VERSION,
+        'scene_id': scene_id(scene),
+        'source': s3_key.rstrip('/'),
+        'band': str(band),
+        'bounds': quantize_bounds(aoi_bounds),
+        'shape': [int(height), int(width)],
+        'overviews': bool(overviews),
+        'path': path,
+    }
+
+def migrate_frame(key, meta):
+    '''
+    Current key of a frame cache entry, see FrameCache.rekey. Entries
+    written with version 1 keys are re-keyed from their metadata.
+    Entries without metadata, written before the cache index existed,
+    are kept under their key, see FrameCache.get aliases.
+
+    :param key str: entry key
+    :param meta dict: entry metadata, None if not recorded
+    :return: (key, meta), None if the entry cannot be re-keyed
+    '''
+    if meta is None:
+        return key, None
+    if meta.get('kind') != 'frame':
+        # Version 1 frames were read with the defaults, from overviews
+        try:
+            meta = frame_meta(meta['s3_key'], meta['band'], meta['scene'],
+                              meta['aoi_bounds'], meta['width'],
+                              meta['height'])
+        except (KeyError, TypeError, AttributeError):
+            return None
+    elif meta.get('version') != KEY_VERSION or \
+         meta.get('reader') != READER_VERSION:
+        return None
+    return digest(meta), meta
+
+def block_meta(kind, address, level, row=None, col=None): # pylint: disable=too-many-arguments
+    '''
+    Key fields of a block cache entry
+
+    :param kind str: 'header' or 'block'
+    :param address str: band file address
+    :param level int: overview level, None for full resolution
+    :param row int: block row, None for headers
+    :param col int: block column, None for headers
+    :rtype: dict
+    '''
+    return {
+        'kind': kind,
+        'version': KEY_VERSION,
+        'address': address,
+        'level': level,
+        'row': row,
+        'col': col,
+    }
+
+def block_key_meta(meta):
+    '''
+    Key fields of a block cache entry metadata, header entries also
+    store the dataset header
+
+    :param meta dict: entry metadata
+    :rtype: dict
+    '''
+    return block_meta(meta['kind'], meta['address'], meta['level'],
+                      meta['row'], meta['col'])
+
+def migrate_block(key, meta): # pylint: disable=unused-argument
+    '''
+    Current key of a block cache entry, see FrameCache.rekey. Version 1
+    block entries are re-keyed, version 1 headers did not record their
+    address and cannot be.
+
+    :param key str: entry key
+    :param meta dict: entry metadata, None if not recorded
+    :return: (key, meta), None if the entry cannot be re-keyed
+    '''
+    if meta is None:
+        return None
+    if 'kind' not in meta:
+        if 'crs' in meta or 'address' not in meta:
+            return None
+        try:
+            meta = block_meta('block', meta['address'], meta['level'],
+                              meta['row'], meta['col'])
+        except KeyError:
+            return None
+    elif meta.get('version') != KEY_VERSION:
+        return None
+    return digest(block_key_meta(meta)), meta
+
+def migrate_rendered(key, meta): # pylint: disable=unused-argument
+    '''
+    Current key of a rendered frame cache entry, see FrameCache.rekey.
+    The metadata is the key, the render version is part of it.
+
+    :param key str: entry key
+    :param meta dict: entry metadata, None if not recorded
+    :return: (key, meta), None if the entry cannot be re-keyed
+    '''
+    if meta is None:
+        return None
+    return digest(meta), meta
@@ -0,0 +1,180 @@
+"""
+cbersgif planner module, scene reads shared by overlapping AOIs
+"""
+# -*- coding: utf-8 -*-
+
+import math
+
+import numpy as np
+
+from cbersgif import profiling, utils
+
+# Slack for float bounds that are exact multiples of the resolution
+_EPSILON = 1e-6
+
+def aoi_size(aoi_bounds, res):
+    '''
+    Output size in pixels of an AOI, as computed by the gif command
+
+    :param aoi_bounds list: (minx, miny, maxx, maxy)
+    :param res float: output resolution
+    :return: (width, height)
+    '''
+    return (int((aoi_bounds[2] - aoi_bounds[0]) / float(res) + _EPSILON),
+            int((aoi_bounds[3] - aoi_bounds[1]) / float(res) + _EPSILON))
+
+def snap_bounds(aoi_bounds, res):
+    '''
+    AOI aligned to a grid of res sized pixels, top left corner is moved
+    by less than one pixel and the output size is kept. Frames of
+    snapped AOIs are exact slices of frames of their union.
+
+    :param aoi_bounds list: (minx, miny, maxx, maxy)
+    :param res float: output resolution
+    :return: snapped (minx, miny, maxx, maxy)
+    '''
+    width, height = aoi_size(aoi_bounds, res)
+    minx = math.floor(aoi_bounds[0] / res) * res
+    maxy = math.ceil(aoi_bounds[3] / res) * res
+    return (minx, maxy - height * res, minx + width * res, maxy)
+
+def _union(bounds_list):
+    '''
+    Bounds enclosing all bounds in the list
+    '''
+    return (min(bounds[0] for bounds in bounds_list),
+            min(bounds[1] for bounds in bounds_list),
+            max(bounds[2] for bounds in bounds_list),
+            max(bounds[3] for bounds in bounds_list))
+
+def _area(bounds):
+    return (bounds[2] - bounds[0]) * (bounds[3] - bounds[1])
+
+def group_aois(bounds_list, max_ratio=2.0):
+    '''
+    Greedy grouping of AOIs read through a single window. An AOI joins
+    a group if the union window area stays below max_ratio times the
+    summed AOI areas, far apart AOIs are read separately.
+
+    :param bounds_list list: AOI bounds, (minx, miny, maxx, maxy)
+    :param max_ratio float: maximum union area / summed AOI area
+    :return: list of groups, each group a list of indices into bounds_list
+    '''
+
+    groups = list()
+    # Largest AOIs first, smaller ones are likely to fit in their windows
+    order = sorted(range(len(bounds_list)),
+                   key=lambda index: -_area(bounds_list[index]))
+    for index in order:
+        bounds = bounds_list[index]
+        best = None
+        for group in groups:
+            union = _union([group['union'], bounds])
+            ratio = _area(union) / (group['area'] + _area(bounds))
+            if ratio <= max_ratio and (best is None or ratio < best[0]):
+                best = (ratio, group, union)
+        if best is None:
+            groups.append({'indices': [index], 'union': bounds,
+                           'area': _area(bounds)})
+        else:
+            best[1]['indices'].append(index)
+            best[1]['union'] = best[2]
+            best[1]['area'] += _area(bounds)
+    return [sorted(group['indices']) for group in groups]
+
+def read_scene_aois(scene, bands, bounds_list, res, # pylint: disable=too-many-arguments,too-many-locals
+                    cache=True, s3_key=None, overviews=True, max_ratio=2.0,
+                    block_cache=None):
+    '''
+    Frames of several AOIs for the same scene. Cached frames are reused,
+    the remaining AOIs are grouped and each group is read once through
+    the union window, frames are sliced from it and stored in the cache
+    under their own keys.
+
+    :param scene dict: scene data as returned from CBERS search
+    :param bands list: band numbers, in output order
+    :param bounds_list list: AOI bounds aligned with snap_bounds
+    :param res float: output resolution
+    :param cache: True for the default cache, False to disable it or
+                  a FrameCache instance
+    :param s3_key str: S3 prefix for scene, defaults to scene_s3_key
+    :param overviews bool: read from internal overviews when possible
+    :param max_ratio float: see group_aois
+    :param block_cache BlockCache: optional native block cache
+    :return: list with a (len(bands), height, width) array for each AOI
+    '''
+
+    if s3_key is None:
+        s3_key = utils.scene_s3_key(scene)
+    cache = utils.get_cache(cache)
+
+    stacks = [None] * len(bounds_list)
+    pending = list()
+    for index, bounds in enumerate(bounds_list):
+        width, height = aoi_size(bounds, res)
+        matrices = utils.cache_lookup(cache, s3_key, scene, bands, bounds,
+                                      width, height, overviews, block_cache)
+        if all(matrix is not None for matrix in matrices):
+            stacks[index] = np.stack(matrices)
+        else:
+            pending.append(index)
+
+    for group in group_aois([bounds_list[index] for index in pending],
+                            max_ratio):
+        indices = [pending[index] for index in group]
+        union = _union([bounds_list[index] for index in indices])
+        width, height = aoi_size(union, res)
+        window = utils.get_scene_stack(scene, bands, union, width, height,
+                                       cache=False, s3_key=s3_key,
+                                       overviews=overviews,
+                                       block_cache=block_cache)
+        for index in indices:
+            bounds = bounds_list[index]
+            width, height = aoi_size(bounds, res)
+            col = int(round((bounds[0] - union[0]) / res))
+            row = int(round((union[3] - bounds[3]) / res))
+            stacks[index] = np.ascontiguousarray(
+                window[:, row:row + height, col:col + width])
+            if cache:
+                utils.cache_store(cache, s3_key, scene, bands, bounds,
+                                  width, height, stacks[index], overviews,
+                                  block_cache)
+    return stacks
+
+@profiling.timed('prefetch')
+def prefetch(jobs, bands, res, cache, executor, overviews=True, # pylint: disable=too-many-arguments
+             max_ratio=2.0, block_cache=None):
+    '''
+    Read the frames of several jobs into the cache, scenes shared by
+    jobs are read once per group of overlapping AOIs. Read errors are
+    ignored here, they are reported when the job reads the scene.
+
+    :param jobs list: (aoi_bounds, scenes) for each job, bounds aligned
+                      with snap_bounds and scenes as returned by search
+    :param bands list: band numbers, in output order
+    :param res float: output resolution
+    :param cache FrameCache: frame cache receiving the frames
+    :param executor: executor running one task per scene
+    :param overviews bool: read from internal overviews when possible
+    :param max_ratio float: see group_aois
+    :param block_cache BlockCache: optional native block cache
+    :return: number of scenes read
+    '''
+
+    by_scene = dict()
+    for aoi_bounds, scenes in jobs:
+        for scene in scenes:
+            entry = by_scene.setdefault(scene['scene_id'], (scene, list()))
+            if aoi_bounds not in entry[1]:
+                entry[1].append(aoi_bounds)
+
+    futures = [executor.submit(read_scene_aois, scene, bands, bounds_list,
+                               res, cache=cache, overviews=overviews,
+                               max_ratio=max_ratio, block_cache=block_cache)
+               for scene, bounds_list in by_scene.values()]
+    for future in futures:
+        try:
+            future.result()
+        except Exception as err: # pylint: disable=broad-except
+            print('Prefetch failed: {}'.format(err))
+    return len(futures)
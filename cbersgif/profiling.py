@@ -0,0 +1,195 @@
+"""
+cbersgif profiling module, per stage timers and I/O counters
+"""
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+import csv
+import functools
+import json
+import threading
+import time
+
+class _NullTimer:
+    """
+    Timer of a disabled profiler
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _Timer:
+    """
+    Adds the time spent in a with block to a profiler stage
+    """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+class Profiler:
+    """
+    Wall time of each pipeline stage and I/O counters
+
+    Stages are timed in every thread, so the total of a stage run by
+    several read workers may exceed the run time, and stages may nest
+    (read includes warp). Frames drawn by a render pool run in other
+    processes and are not timed. A disabled profiler hands out a shared
+    no-op timer and ignores counters.
+    """
+
+    def __init__(self, enabled=False):
+        '''
+        Constructor
+
+        :param enabled bool: collect timers and counters
+        '''
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.timers = dict()
+        self.counters = Counter()
+        self.started = time.perf_counter()
+
+    def reset(self):
+        '''
+        Drop all timers and counters and restart the run clock
+        '''
+        with self._lock:
+            self.timers = dict()
+            self.counters = Counter()
+            self.started = time.perf_counter()
+
+    def timer(self, name):
+        '''
+        Context manager timing a stage
+
+        :param name str: stage name
+        '''
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def add_time(self, name, seconds):
+        '''
+        Add a timed call to a stage
+        '''
+        with self._lock:
+            calls, total, longest = self.timers.get(name, (0, 0.0, 0.0))
+            self.timers[name] = (calls + 1, total + seconds,
+                                 max(longest, seconds))
+
+    def count(self, name, value=1):
+        '''
+        Increment a counter
+
+        :param name str: counter name
+        :param value int: increment
+        '''
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += value
+
+    def report(self):
+        '''
+        Timers and counters collected since the last reset
+
+        :return: dict with wall_seconds, timers (calls, seconds and
+                 max_seconds for each stage) and counters
+        :rtype: dict
+        '''
+        with self._lock:
+            return {
+                'wall_seconds': time.perf_counter() - self.started,
+                'timers': {name: {'calls': calls, 'seconds': total,
+                                  'max_seconds': longest}
+                           for name, (calls, total, longest)
+                           in sorted(self.timers.items())},
+                'counters': dict(sorted(self.counters.items())),
+            }
+
+    def write(self, filename):
+        '''
+        Write the report as JSON, or as CSV if filename ends in .csv.
+        CSV rows are kind, name, calls, seconds, max_seconds, value.
+
+        :param filename str: output filename
+        '''
+        report = self.report()
+        with open(filename, 'w', newline='') as output:
+            if not filename.lower().endswith('.csv'):
+                json.dump(report, output, indent=2)
+                return
+            writer = csv.writer(output)
+            writer.writerow(['kind', 'name', 'calls', 'seconds',
+                             'max_seconds', 'value'])
+            writer.writerow(['run', 'wall', '', report['wall_seconds'], '',
+                             ''])
+            for name, timer in report['timers'].items():
+                writer.writerow(['timer', name, timer['calls'],
+                                 timer['seconds'], timer['max_seconds'], ''])
+            for name, value in report['counters'].items():
+                writer.writerow(['counter', name, '', '', '', value])
+
+PROFILER = Profiler()
+
+def timer(name):
+    '''
+    PROFILER.timer
+    '''
+    return PROFILER.timer(name)
+
+def count(name, value=1):
+    '''
+    PROFILER.count
+    '''
+    PROFILER.count(name, value)
+
+def timed(name):
+    '''
+    Decorator timing all calls of a function as stage name
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            with _Timer(PROFILER, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def enable(reset=True):
+    '''
+    Enable the module profiler
+
+    :param reset bool: drop what was collected before
+    '''
+    if reset:
+        PROFILER.reset()
+    PROFILER.enabled = True
+
+def disable():
+    '''
+    Disable the module profiler, the collected data is kept
+    '''
+    PROFILER.enabled = False
+
+def report():
+    '''
+    PROFILER.report
+    '''
+    return PROFILER.report()
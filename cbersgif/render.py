@@ -0,0 +1,592 @@
+"""
+cbersgif render module, animated GIF pipeline usable without the cli
+"""
+# -*- coding: utf-8 -*-
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from PIL import Image
+
+from cbersgif import enhance, geometry, planner, profiling, screen, sinks, \
+    utils
+
+# Part of the rendered frame keys, to be increased when draw_frame
+# output changes
+RENDER_VERSION = 1
+
+class GifJob:
+    """
+    Parameters of an animated GIF, same names and defaults as the gif
+    command options. Jobs only hold configuration, caches and
+    executors are passed to render_frames / render_gif so long lived
+    workers share them across jobs.
+    """
+
+    def __init__(self, lat, lon, sensor='MUX', level='L4', # pylint: disable=too-many-arguments,too-many-locals
+                 start_date='2013-01-01', end_date=None, buffer_size=10000,
+                 res=20, bands='7,6,5', saveintermediary=False,
+                 max_images=100, singleenhancement=False,
+                 globalenhancement=False, enhancement=False,
+                 percentiles='2,98', contrast_factor=1.0,
+                 brightness_factor=1.0, duration=0.5, taboo_index=None,
+                 stac_endpoint='https://stac.amskepler.com/v100/search',
+                 workers=4, overviews=True, one_per=None,
+                 screen=False, max_nodata=screen.DEFAULT_MAX_NODATA,
+                 max_cloud=screen.DEFAULT_MAX_CLOUD,
+                 cloud_value=screen.DEFAULT_CLOUD_VALUE, render_procs=0,
+                 palette='global', scenes=None, aoi_bounds=None):
+        '''
+        Constructor, see the gif command help for the parameters
+
+        :param scenes list: search results, searched on first use if None
+        :param aoi_bounds list: AOI in EPSG:3857, defaults to the buffer
+                                around lat, lon
+        '''
+        self.lat = lat
+        self.lon = lon
+        self.sensor = sensor
+        self.level = level
+        self.start_date = start_date
+        self.end_date = end_date
+        self.buffer_size = buffer_size
+        self.res = res
+        self.bands = bands.split(',')
+        assert len(self.bands) == 3, "Exactly 3 bands must be defined"
+        self.saveintermediary = saveintermediary
+        self.max_images = max_images
+        self.singleenhancement = singleenhancement
+        self.globalenhancement = globalenhancement
+        self.enhancement = enhancement
+        self.percents = [int(item) for item in percentiles.split(',')]
+        assert len(self.percents) == 2, 'Two percentiles must be defined'
+        self.contrast_factor = contrast_factor
+        self.brightness_factor = brightness_factor
+        self.duration = duration
+        self.taboo_index = taboo_index
+        self.stac_endpoint = stac_endpoint
+        self.workers = workers
+        self.overviews = overviews
+        self.one_per = one_per
+        self.screen = screen
+        self.max_nodata = max_nodata
+        self.max_cloud = max_cloud
+        self.cloud_value = cloud_value
+        self.render_procs = render_procs
+        self.palette = palette
+        self.scenes = scenes
+        self.selection = None
+        # Frames cached by the version 1 cli, only for point AOIs
+        self.legacy_aoi = None
+        if aoi_bounds is None:
+            aoi_bounds = geometry.lonlat_to_bounds(lon, lat, buffer_size)
+            self.legacy_aoi = utils.legacy_aoi(lon, lat, buffer_size, res)
+        self.aoi_bounds = aoi_bounds
+        self.width, self.height = planner.aoi_size(aoi_bounds, res)
+
+    def search_kwargs(self):
+        '''
+        utils.search arguments for the job. Scenes after max_images are
+        never drawn, the search stops once they are found.
+        '''
+        return {
+            'sensor': self.sensor,
+            'mode': 'stac',
+            'lon': self.lon,
+            'lat': self.lat,
+            'level': None if self.level == 'all' else self.level,
+            'start_date': self.start_date,
+            'end_date': self.end_date or time.strftime('%Y-%m-%d'),
+            'stac_endpoint': self.stac_endpoint,
+            'one_per': self.one_per,
+            'max_scenes': self.max_images,
+        }
+
+    def search(self, search_cache=None):
+        '''
+        Scenes covering the job point, oldest first. Results are kept
+        in the job.
+
+        :param search_cache SearchCache: optional results cache
+        :rtype: list
+        '''
+        if self.scenes is None:
+            self.scenes = utils.search(search_cache=search_cache,
+                                       **self.search_kwargs())
+            print('{} scenes found'.format(len(self.scenes)))
+        return self.scenes
+
+    def selected(self, search_cache=None, frame_cache=None, executor=None,
+                 block_cache=None):
+        '''
+        (scene_no, scene) for the scenes that will be drawn. With
+        screen set, scenes with too much nodata or cloud in a decimated
+        read of the last band are dropped. The selection is kept in the
+        job.
+
+        :param search_cache SearchCache: optional results cache
+        :param frame_cache FrameCache: cache for the screening reads
+        :param executor: optional executor for the screening reads
+        :param block_cache BlockCache: optional native block cache
+        :rtype: list
+        '''
+        if self.selection is None:
+            selection = utils.select_scenes(self.search(search_cache),
+                                            self.taboo_index,
+                                            self.max_images)
+            if self.screen:
+                selection = screen.screen_scenes(
+                    selection, self.bands[-1], self.aoi_bounds,
+                    self.max_nodata, self.max_cloud,
+                    cloud_value=self.cloud_value, cache=frame_cache,
+                    block_cache=block_cache, executor=executor,
+                    workers=self.workers)
+            self.selection = selection
+        return self.selection
+
+    def label(self, scene_no, scene):
+        '''
+        Text drawn on a frame
+        '''
+        return '%d, %s' % (scene_no, scene['acquisition_date'])
+
+    def stretch_each(self, frames_drawn):
+        '''
+        True if the stretch is computed from the next frame
+        '''
+        return self.enhancement and not self.globalenhancement and \
+            (not frames_drawn or not self.singleenhancement)
+
+    def independent_frames(self):
+        '''
+        True if each frame only depends on its own scene, that is, its
+        stretch is not computed from other scenes
+        '''
+        return not self.enhancement or self.stretch_each(1)
+
+    def frame_meta(self, scene_no, scene, stretch=None, block_cache=None):
+        '''
+        Key of a finished frame in the rendered frame cache
+
+        :param scene_no int: scene index, part of the label
+        :param scene dict: scene data as returned from CBERS search
+        :param stretch: stretch used for the frame, only needed if the
+                        frames are not independent
+        :param block_cache BlockCache: block cache of the reads, frames
+                                       warped from blocks are kept apart
+                                       as in the frame cache
+        :rtype: dict
+        '''
+        if not self.enhancement:
+            stretch_key = None
+        elif self.independent_frames():
+            stretch_key = {'percents': self.percents}
+        else:
+            stretch_key = [[float(value) for value in values]
+                           for values in stretch]
+        return {
+            'version': RENDER_VERSION,
+            's3_key': utils.scene_s3_key(scene),
+            'scene_id': scene['scene_id'],
+            'bands': self.bands,
+            'aoi_bounds': [float(value) for value in self.aoi_bounds],
+            'width': self.width,
+            'height': self.height,
+            'overviews': self.overviews,
+            'path': 'direct' if block_cache is None else 'blocks',
+            'stretch': stretch_key,
+            'contrast_factor': self.contrast_factor,
+            'brightness_factor': self.brightness_factor,
+            'label': self.label(scene_no, scene),
+        }
+
+def draw_frame(stack, stretch, contrast_factor, brightness_factor, # pylint: disable=too-many-arguments
+               text_value, intermediary=None):
+    '''
+    Annotated RGB frame from a band stack
+
+    :param stack: (3, H, W) array
+    :param stretch: (p_min_value, p_max_value) or None for a plain cast
+    :param contrast_factor float: contrast enhancement factor
+    :param brightness_factor float: brightness enhancement factor
+    :param text_value str: frame label
+    :param intermediary str: if set the frame is also saved to this
+                             file before PIL enhancement and label
+    :return: PIL Image
+    '''
+    # Bands are written directly into the interleaved RGB buffer
+    rgb_out = np.empty(stack.shape[1:] + (3,), dtype=np.uint8)
+    out = np.moveaxis(rgb_out, 2, 0)
+    if stretch is None:
+        enhance.to_uint8(stack, out=out)
+    else:
+        enhance.stretch_stack(stack, stretch[0], stretch[1], out=out)
+    img = Image.fromarray(rgb_out)
+    if intermediary:
+        img.save(intermediary)
+    img = enhance.pil_enhance(img, contrast_factor, brightness_factor)
+    utils.annotate_frame(img, text_value)
+    return img
+
+def cached_frame(render_cache, meta):
+    '''
+    Finished frame from the rendered frame cache
+
+    :param render_cache RenderedCache: rendered frame cache
+    :param meta dict: see GifJob.frame_meta
+    :return: PIL Image, None on cache miss
+    '''
+    rgb = render_cache.get(meta)
+    if rgb is None:
+        return None
+    profiling.count('rendered_cache_hits')
+    return Image.fromarray(np.array(rgb))
+
+def cached_frames(job, selected, render_cache, block_cache=None):
+    '''
+    Finished frames of a job found in the rendered frame cache. Frames
+    are only looked up before reading for independent frames, see
+    GifJob.independent_frames.
+
+    :param job GifJob: job parameters
+    :param selected list: (scene_no, scene) tuples
+    :param render_cache RenderedCache: rendered frame cache or None
+    :param block_cache BlockCache: block cache of the reads
+    :return: dict, PIL Image for each cached scene_no
+    '''
+    if render_cache is None or job.saveintermediary or \
+       not job.independent_frames():
+        return dict()
+    result = dict()
+    for scene_no, scene in selected:
+        image = cached_frame(render_cache,
+                             job.frame_meta(scene_no, scene,
+                                            block_cache=block_cache))
+        if image is not None:
+            print('Rendered frame cache hit for scene {}'.format(scene_no))
+            result[scene_no] = image
+    return result
+
+def draw_cached(job, scene_no, scene, stack, stretch, render_cache=None, # pylint: disable=too-many-arguments
+                block_cache=None):
+    '''
+    draw_frame for a scene of a job. With a rendered frame cache,
+    frames that depend on other scenes are looked up once the stretch
+    is known and new frames are stored.
+
+    :param job GifJob: job parameters
+    :param stack: (3, H, W) array
+    :param stretch: stretch of the frame, None without enhancement
+    :param render_cache RenderedCache: optional rendered frame cache
+    :param block_cache BlockCache: block cache of the reads
+    :return: PIL Image
+    '''
+    meta = None
+    if render_cache is not None and not job.saveintermediary:
+        meta = job.frame_meta(scene_no, scene, stretch, block_cache)
+        if not job.independent_frames():
+            image = cached_frame(render_cache, meta)
+            if image is not None:
+                return image
+    image = draw_frame(
+        stack, stretch if job.enhancement else None, job.contrast_factor,
+        job.brightness_factor, job.label(scene_no, scene),
+        '{}.bmp'.format(scene_no) if job.saveintermediary else None)
+    if meta is not None:
+        render_cache.put(meta, np.asarray(image))
+    return image
+
+def global_stretch(job, frames):
+    '''
+    Stretch from the histograms of all frames
+
+    :param job GifJob: job parameters
+    :param frames: iterable of (scene_no, scene, stack, error)
+    :return: (p_min_value, p_max_value), None if no frame was read
+    '''
+    histograms = None
+    for _, _, stack, error in frames:
+        if error is None:
+            histograms = enhance.accumulate_histograms(stack, histograms)
+    if histograms is None:
+        return None
+    stretch = enhance.histogram_stretch(histograms, job.percents)
+    print('{}-{}, {}-{}'.format(job.percents[0], job.percents[1], *stretch))
+    return stretch
+
+def make_render_pool(processes):
+    '''
+    Process pool for render_frames. Workers are started from a clean
+    server process, forking the caller could copy locks held by its
+    read threads.
+
+    :param processes int: number of processes
+    :rtype: ProcessPoolExecutor
+    '''
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context(
+        'forkserver' if 'forkserver' in methods else 'spawn')
+    return ProcessPoolExecutor(max_workers=processes, mp_context=context)
+
+def _shared_file():
+    '''
+    New empty file for an array shared with render processes, in
+    memory backed /dev/shm when available
+    '''
+    directory = '/dev/shm' if os.access('/dev/shm', os.W_OK) else None
+    handle, filename = tempfile.mkstemp(prefix='cbersgif', suffix='.dat',
+                                        dir=directory)
+    os.close(handle)
+    return filename
+
+def draw_shared(stack_file, shape, dtype, out_file, stretch, percents, # pylint: disable=too-many-arguments
+                contrast_factor, brightness_factor, text_value,
+                intermediary=None):
+    '''
+    draw_frame for render processes, the stack is read from and the RGB
+    frame written to memory mapped files so arrays are not pickled
+
+    :param stack_file str: file with the (3, H, W) stack
+    :param shape tuple: stack shape
+    :param dtype str: stack dtype
+    :param out_file str: file receiving the (H, W, 3) uint8 frame
+    :param stretch: (p_min_value, p_max_value), None for a plain cast or
+                    'frame' to compute it from the stack
+    :param percents list: percentiles for the 'frame' stretch
+    :return: stretch used
+    '''
+    stack = np.memmap(stack_file, dtype=dtype, mode='r', shape=shape)
+    if stretch == 'frame':
+        stretch = enhance.compute_stretch(stack, percents)
+    img = draw_frame(stack, stretch, contrast_factor, brightness_factor,
+                     text_value, intermediary)
+    out = np.memmap(out_file, dtype=np.uint8, mode='w+',
+                    shape=shape[1:] + (3,))
+    out[...] = np.asarray(img.convert('RGB'))
+    out.flush()
+    return stretch
+
+def _pool_frames(job, frames, stretch, pool, render_cache=None, # pylint: disable=too-many-locals,too-many-branches,too-many-arguments
+                 block_cache=None):
+    '''
+    Frames drawn by a process pool, see render_frames. At most twice the
+    number of processes frames are in flight.
+    '''
+    own_pool = pool is None
+    if own_pool:
+        pool = make_render_pool(job.render_procs)
+    in_flight = 2 * max(1, job.render_procs or 1)
+    pending = deque()
+
+    def collect():
+        scene_no, scene, future, error, files, shape, meta = pending.popleft()
+        if error is not None:
+            return scene_no, scene, None, error
+        if future is None:
+            # Rendered frame cache hit, the image is kept in place of meta
+            return scene_no, scene, meta, None
+        try:
+            used = future.result()
+            if job.stretch_each(0) and not job.singleenhancement:
+                print('{}-{}, {}-{}'.format(job.percents[0],
+                                            job.percents[1], *used))
+            image = Image.fromarray(np.array(np.memmap(
+                files[1], dtype=np.uint8, mode='r', shape=shape[1:] + (3,))))
+        finally:
+            for filename in files:
+                os.remove(filename)
+        if meta is not None:
+            render_cache.put(meta, np.asarray(image))
+        return scene_no, scene, image, None
+
+    try:
+        for scene_no, scene, stack, error in frames:
+            print(scene)
+            if error is not None:
+                print('Failed to read scene {}: {}'.format(scene_no, error))
+                pending.append((scene_no, scene, None, error, (), None,
+                                None))
+            else:
+                if not job.enhancement:
+                    frame_stretch = None
+                elif job.globalenhancement:
+                    frame_stretch = stretch
+                elif job.singleenhancement:
+                    if stretch is None:
+                        stretch = enhance.compute_stretch(stack, job.percents)
+                        print('{}-{}, {}-{}'.format(job.percents[0],
+                                                    job.percents[1],
+                                                    *stretch))
+                    frame_stretch = stretch
+                else:
+                    # Computed by the worker
+                    frame_stretch = 'frame'
+                meta = None
+                if render_cache is not None and not job.saveintermediary:
+                    meta = job.frame_meta(scene_no, scene, frame_stretch,
+                                          block_cache)
+                    image = None if job.independent_frames() else \
+                        cached_frame(render_cache, meta)
+                    if image is not None:
+                        pending.append((scene_no, scene, None, None, (),
+                                        None, image))
+                        continue
+                files = (_shared_file(), _shared_file())
+                shared = np.memmap(files[0], dtype=stack.dtype, mode='w+',
+                                   shape=stack.shape)
+                shared[...] = stack
+                shared.flush()
+                del shared
+                pending.append((scene_no, scene, pool.submit(
+                    draw_shared, files[0], stack.shape, stack.dtype.str,
+                    files[1], frame_stretch, job.percents,
+                    job.contrast_factor, job.brightness_factor,
+                    job.label(scene_no, scene),
+                    '{}.bmp'.format(scene_no) if job.saveintermediary
+                    else None), None, files, stack.shape, meta))
+            while len(pending) >= in_flight:
+                yield collect()
+        while pending:
+            yield collect()
+    finally:
+        for _, _, future, _, files, _, _ in pending:
+            if future is not None:
+                future.cancel()
+                try:
+                    future.result()
+                except Exception: # pylint: disable=broad-except
+                    pass
+            for filename in files:
+                os.remove(filename)
+        if own_pool:
+            pool.shutdown()
+
+def render_frames(job, frame_cache=None, search_cache=None, # pylint: disable=too-many-arguments
+                  block_cache=None, executor=None, render_pool=None,
+                  render_cache=None):
+    '''
+    Frames of a job, in scene order. Scenes are read concurrently,
+    frames are produced one at a time or, with job.render_procs, drawn
+    concurrently by a process pool. Frames found in the rendered frame
+    cache are not read nor drawn again.
+
+    :param job GifJob: job parameters
+    :param frame_cache FrameCache: frame cache, None disables caching
+    :param search_cache SearchCache: search cache, None disables it
+    :param block_cache BlockCache: native block cache, None disables it
+    :param executor: optional executor for reads, shared between jobs
+    :param render_pool: optional ProcessPoolExecutor drawing frames,
+                        shared between jobs
+    :param render_cache RenderedCache: rendered frame cache, None
+                                       disables it
+    :return: generator of (scene_no, scene, image, error), image is a
+             PIL Image, None if the scene could not be read
+    '''
+
+    selected = job.selected(search_cache, frame_cache, executor,
+                            block_cache)
+    cached = cached_frames(job, selected, render_cache, block_cache)
+    drawn = _draw_frames(job, [(scene_no, scene)
+                               for scene_no, scene in selected
+                               if scene_no not in cached],
+                         frame_cache, block_cache, executor, render_pool,
+                         render_cache)
+    try:
+        for scene_no, scene in selected:
+            if scene_no in cached:
+                yield scene_no, scene, cached[scene_no], None
+            else:
+                yield next(drawn)
+    finally:
+        drawn.close()
+
+def _draw_frames(job, selected, frame_cache, block_cache, executor, # pylint: disable=too-many-arguments
+                 render_pool, render_cache):
+    '''
+    Read and draw selected scenes, see render_frames
+    '''
+
+    def fetch():
+        return utils.fetch_frames(selected, job.bands, job.aoi_bounds,
+                                  job.width, job.height,
+                                  workers=job.workers, cache=frame_cache,
+                                  overviews=job.overviews, executor=executor,
+                                  block_cache=block_cache,
+                                  legacy_aoi=job.legacy_aoi)
+    frames = fetch()
+
+    stretch = None
+    if job.enhancement and job.globalenhancement:
+        # Histograms of all scenes are accumulated before the first
+        # frame is drawn. Scenes are read again from the cache or, if
+        # caching is disabled, kept in memory.
+        kept = list(frames) if frame_cache is None else None
+        stretch = global_stretch(job, kept if kept is not None else frames)
+        frames = kept if kept is not None else fetch()
+
+    if job.render_procs or render_pool is not None:
+        yield from _pool_frames(job, frames, stretch, render_pool,
+                                render_cache, block_cache)
+        return
+
+    drawn = 0
+    for scene_no, scene, stack, error in frames:
+
+        print(scene)
+        if error is not None:
+            print('Failed to read scene {}: {}'.format(scene_no, error))
+            yield scene_no, scene, None, error
+            continue
+
+        if job.stretch_each(drawn):
+            # Histogram stretch parameters, with singleenhancement only
+            # the first image is used
+            stretch = enhance.compute_stretch(stack, job.percents)
+            print('{}-{}, {}-{}'.format(job.percents[0], job.percents[1],
+                                        *stretch))
+
+        yield scene_no, scene, draw_cached(job, scene_no, scene, stack,
+                                           stretch, render_cache,
+                                           block_cache), None
+        drawn += 1
+
+def render_gif(job, sink, **kwargs):
+    '''
+    Render a job into an animated GIF, WebP or video
+
+    :param job GifJob: job parameters
+    :param sink: output filename, the format is chosen by its extension
+                 (see sinks.get_writer), or an object with append(image)
+                 and close() methods, such as utils.AnimatedGifWriter
+    :param kwargs: caches and executor, see render_frames
+    :return: summary with output, scenes_found, frames and failed keys
+    :rtype: dict
+    '''
+    writer = sinks.get_writer(sink, job.duration, job.palette) \
+        if isinstance(sink, str) else sink
+    frames = 0
+    failed = 0
+    try:
+        for _, _, image, error in render_frames(job, **kwargs):
+            if error is not None:
+                failed += 1
+                profiling.count('failed_scenes')
+                continue
+            writer.append(image)
+            frames += 1
+            profiling.count('frames')
+    finally:
+        writer.close()
+
+    return {
+        'output': getattr(writer, 'filename', None),
+        'scenes_found': len(job.scenes),
+        'frames': frames,
+        'failed': failed,
+    }
@@ -0,0 +1,131 @@
+"""
+cbersgif screen module, skip empty or cloudy scenes before full reads
+"""
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from cbersgif import profiling, utils
+
+# Screening reads are about DEFAULT_SIZE pixels wide
+DEFAULT_SIZE = 32
+
+# Digital numbers at or above this value are counted as cloud, CBERS
+# products are 8 bit
+DEFAULT_CLOUD_VALUE = 200
+
+DEFAULT_MAX_NODATA = 0.5
+DEFAULT_MAX_CLOUD = 0.5
+
+def band_scores(matrix, cloud_value=DEFAULT_CLOUD_VALUE):
+    '''
+    Nodata and cloud fractions of a band
+
+    :param matrix: band array, 0 is nodata
+    :param cloud_value int: bright pixel threshold
+    :return: dict with 'nodata', fraction of pixels without data, and
+             'cloud', fraction of the valid pixels >= cloud_value
+    '''
+    valid = np.count_nonzero(matrix)
+    return {
+        'nodata': 1.0 - valid / float(matrix.size) if matrix.size else 1.0,
+        'cloud': np.count_nonzero(matrix >= cloud_value) / float(valid)
+                 if valid else 0.0,
+    }
+
+def screen_size(aoi_bounds, size=DEFAULT_SIZE):
+    '''
+    Screening grid size, size pixels along the larger AOI side
+
+    :return: (width, height)
+    '''
+    width = aoi_bounds[2] - aoi_bounds[0]
+    height = aoi_bounds[3] - aoi_bounds[1]
+    scale = size / float(max(width, height))
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+def scene_scores(scene, band, aoi_bounds, size=DEFAULT_SIZE, # pylint: disable=too-many-arguments
+                 cloud_value=DEFAULT_CLOUD_VALUE, cache=True,
+                 block_cache=None):
+    '''
+    Scores of a scene from a decimated read of a single band. The read
+    uses the coarsest overview available and is cached as any frame.
+
+    :param scene dict: scene data as returned from CBERS search
+    :param band str: band number
+    :param aoi_bounds list: (minx, miny, maxx, maxy)
+    :param size int: pixels along the larger AOI side
+    :param cloud_value int: bright pixel threshold
+    :param cache: True for the default cache, False to disable it or
+                  a FrameCache instance
+    :param block_cache BlockCache: optional native block cache
+    :return: see band_scores
+    '''
+    width, height = screen_size(aoi_bounds, size)
+    matrix = utils.get_scene_stack(scene, [band], aoi_bounds, width, height,
+                                   cache=cache, overviews=True,
+                                   block_cache=block_cache)[0]
+    return band_scores(matrix, cloud_value)
+
+@profiling.timed('screen')
+def screen_scenes(selected, band, aoi_bounds, # pylint: disable=too-many-arguments,too-many-locals
+                  max_nodata=DEFAULT_MAX_NODATA, max_cloud=DEFAULT_MAX_CLOUD,
+                  size=DEFAULT_SIZE, cloud_value=DEFAULT_CLOUD_VALUE,
+                  cache=True, block_cache=None, executor=None, workers=4):
+    '''
+    Scenes passing the nodata and cloud thresholds. Scene numbers are
+    kept, so taboo indices remain valid. Scenes that fail to be
+    screened are kept, the error is reported by the full read.
+
+    :param selected list: (scene_no, scene) tuples
+    :param band str: band used for screening
+    :param aoi_bounds list: (minx, miny, maxx, maxy)
+    :param max_nodata float: maximum nodata fraction
+    :param max_cloud float: maximum cloud fraction of valid pixels
+    :param executor: optional executor, by default a pool with workers
+                     threads is created
+    :return: list of (scene_no, scene)
+    '''
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        futures = [executor.submit(scene_scores, scene, band, aoi_bounds,
+                                   size, cloud_value, cache, block_cache)
+                   for _, scene in selected]
+        scores = list()
+        for future in futures:
+            try:
+                scores.append(future.result())
+            except Exception as err: # pylint: disable=broad-except
+                scores.append(err)
+        return keep_scenes(selected, scores, max_nodata, max_cloud)
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False)
+
+def keep_scenes(selected, scores, max_nodata=DEFAULT_MAX_NODATA,
+                max_cloud=DEFAULT_MAX_CLOUD):
+    '''
+    Scenes passing the nodata and cloud thresholds, see screen_scenes
+
+    :param selected list: (scene_no, scene) tuples
+    :param scores list: scene_scores of each scene, or the exception
+                        raised by its read
+    :return: list of (scene_no, scene)
+    '''
+    result = list()
+    for (scene_no, scene), score in zip(selected, scores):
+        if isinstance(score, Exception):
+            print('Screening failed for scene {}: {}'.format(scene_no,
+                                                             score))
+            result.append((scene_no, scene))
+            continue
+        if score['nodata'] > max_nodata or score['cloud'] > max_cloud:
+            print('Skipping scene {}, {:.0%} nodata, {:.0%} cloud'.format(
+                scene_no, score['nodata'], score['cloud']))
+            continue
+        result.append((scene_no, scene))
+    return result
@@ -3,21 +3,69 @@
 import json
 import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from shapely.geometry import mapping
 
+from cbersgif import profiling
+
+_SESSION = None
+
+def make_session(retries=3, backoff_factor=0.5):
+    """
+    Build a pooled session retrying on connection errors and
+    on 429/5xx responses with exponential backoff
+    """
+    retry = Retry(total=retries, backoff_factor=backoff_factor,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(['GET', 'POST']),
+                  raise_on_status=False)
+    session = requests.Session()
+    adapter = HTTPAdapter(max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def get_session():
+    """Session shared by all searches in the process"""
+    global _SESSION # pylint: disable=global-statement
+    if _SESSION is None:
+        _SESSION = make_session()
+    return _SESSION
+
+class SearchError(RuntimeError):
+    """Error response of a search service"""
+
+    def __init__(self, status_code, text):
+        """
+        Constructor
+
+        :param status_code int: HTTP status code
+        :param text str: response body
+        """
+        super().__init__("Service returned %d code, msg: %s" %
+                         (status_code, text))
+        self.status_code = status_code
+
 class Search: # pylint: disable=too-few-public-methods
     """General search engine"""
 
-    def __init__(self, search_url):
-        """Constructor"""
+    def __init__(self, search_url, session=None):
+        """
+        Constructor
+
+        :param search_url str: search endpoint
+        :param session: requests session, defaults to the shared session
+        """
 
         self.search_url = search_url
+        self.session = session if session is not None else get_session()
 
     def is_online(self):
         """True if search service is online"""
         try:
-            req = requests.get(self.search_url)
+            req = self.session.get(self.search_url)
         except: # pylint: disable=W0702
             return False
         return req.ok
@@ -25,13 +73,38 @@ class Search: # pylint: disable=too-few-public-methods
 class StacSearch(Search):
     """Stac search utilities"""
 
-    def search(self, instrument: str,
-               start_date: str, end_date: str,
-               bbox: list,
-               level: str = None,
-               limit: int = 10):
+    def _request(self, method, url, body):
+        """
+        Issue a search request and return the decoded response
         """
-        Search AWS CBERS archive through STAC
+        if method == 'POST':
+            req = self.session.post(url, json=body,
+                                    headers={'Content-Type':
+                                             'application/json'})
+        else:
+            req = self.session.get(url)
+
+        if req.status_code != requests.codes.ok: # pylint: disable=no-member
+            raise SearchError(req.status_code, req.text)
+        return req.json()
+
+    def iter_search(self, instrument: str, # pylint: disable=too-many-arguments
+                    start_date: str, end_date: str,
+                    bbox: list,
+                    level: str = None,
+                    limit: int = 100,
+                    sortby: str = None):
+        """
+        Search AWS CBERS archive through STAC, yielding items as
+        each page arrives. Pages are followed through the STAC 'next'
+        link or, for services without links, through the 'page'
+        parameter and the number of matches in 'context' or 'meta'.
+        Pages are only requested as items are consumed.
+
+        :param limit int: page size
+        :param sortby str: property for ascending sort, requires the
+                           STAC sort extension, services without it
+                           usually answer with a 4xx SearchError
         """
 
         assert instrument in ("MUX", "AWFI", "PAN5M", "PAN10M"), \
@@ -51,28 +124,65 @@ class StacSearch(Search):
             "collections": [f"CBERS4-{instrument}"]
         }
 
+        if sortby:
+            params["sortby"] = [{"field": sortby, "direction": "asc"}]
+
         if level:
             params["query"] = dict()
             params['query']['cbers:data_type'] = {"eq":level}
         # params['query'].update({} if level is None \
         #                        else {"cbers:data_type":level})
 
-        req = requests.post(self.search_url,
-                            json=params,
-                            headers={'Content-Type': 'application/json'})
-
-        if req.status_code is not requests.codes.ok: # pylint: disable=no-member
-            raise RuntimeError("Service returned %d code, msg: %s" %
-                               (req.status_code, req.text))
-
-        #import pdb; pdb.set_trace()
-
-        res = []
-        #import pdb; pdb.set_trace()
-        for item in req.json()['features']:
-            res.append(item)
+        method, url, body = 'POST', self.search_url, params
+        page = 1
+        while True:
+            result = self._request(method, url, body)
+            profiling.count('stac_requests')
+            features = result.get('features', [])
+            for item in features:
+                yield item
+            if not features:
+                break
+
+            next_links = [link for link in result.get('links', [])
+                          if link.get('rel') == 'next']
+            if next_links:
+                link = next_links[0]
+                url = link['href']
+                method = link.get('method', 'GET').upper()
+                if method == 'POST':
+                    if link.get('merge'):
+                        body = dict(body, **link.get('body', {}))
+                    else:
+                        body = link.get('body', body)
+                continue
+
+            context = result.get('context') or result.get('meta') or {}
+            found = context.get('matched', context.get('found'))
+            if found is not None and page * limit < found:
+                page += 1
+                method, url, body = 'POST', self.search_url, \
+                                    dict(params, page=page)
+                continue
+
+            break
+
+    def search(self, instrument: str, # pylint: disable=too-many-arguments
+               start_date: str, end_date: str,
+               bbox: list,
+               level: str = None,
+               limit: int = 10):
+        """
+        Search AWS CBERS archive through STAC, all pages are
+        requested
 
-        assert len(res) < limit, \
-            "Possible truncation on the number of returned scenes"
+        :param limit int: page size
+        :rtype: list
+        """
 
-        return res
+        return list(self.iter_search(instrument=instrument,
+                                     start_date=start_date,
+                                     end_date=end_date,
+                                     bbox=bbox,
+                                     level=level,
+                                     limit=limit))
@@ -0,0 +1,230 @@
+"""
+cbersgif sinks module, animation outputs selected by file extension
+"""
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+import numpy as np
+
+from PIL import Image
+
+from cbersgif import profiling, utils
+
+# ffmpeg video codec and quality options for each video extension
+VIDEO_CODECS = {
+    '.mp4': ['-c:v', 'libx264', '-preset', 'medium', '-crf', '23',
+             '-movflags', '+faststart'],
+    '.webm': ['-c:v', 'libvpx-vp9', '-b:v', '0', '-crf', '33',
+              '-row-mt', '1'],
+}
+
+EXTENSIONS = ('.gif', '.webp') + tuple(sorted(VIDEO_CODECS))
+
+def ffmpeg_exe():
+    '''
+    ffmpeg executable, the one bundled with imageio-ffmpeg if installed,
+    otherwise the first ffmpeg in the PATH
+
+    :return: path, None if ffmpeg is not available
+    '''
+    try:
+        import imageio_ffmpeg # pylint: disable=import-outside-toplevel
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        return shutil.which('ffmpeg')
+
+def get_writer(filename, duration, palette='global'):
+    '''
+    Incremental writer for filename, chosen by its extension: .gif,
+    .webp, .mp4 or .webm. Writers take frames with append(image) and
+    finish the output with close().
+
+    :param filename str: output filename
+    :param duration float: duration for each frame in seconds
+    :param palette str: GIF palette, see utils.AnimatedGifWriter
+    '''
+    extension = os.path.splitext(filename)[1].lower()
+    assert extension in EXTENSIONS, \
+        'Unknown output format {}, use one of {}'.format(
+            extension, ', '.join(EXTENSIONS))
+    if extension == '.webp':
+        return WebPWriter(filename, duration)
+    if extension in VIDEO_CODECS:
+        return VideoWriter(filename, duration)
+    return utils.AnimatedGifWriter(filename, duration, palette)
+
+class _SpooledFrames(Image.Image):
+    """
+    Multi-frame image over RGB frames spooled to a file, frames are
+    loaded on seek so Pillow's multi-frame savers hold a single frame
+    in memory
+    """
+
+    def __init__(self, spool, size, count):
+        super().__init__()
+        self._spool = spool
+        self._frame_size = size
+        self.n_frames = count
+        self._frame = None
+        self.seek(0)
+
+    def seek(self, frame):
+        self._spool.seek(frame * self._frame_size[0] *
+                         self._frame_size[1] * 3)
+        image = Image.frombytes('RGB', self._frame_size, self._spool.read(
+            self._frame_size[0] * self._frame_size[1] * 3))
+        # Internals differ between Pillow versions, the loaded frame
+        # state is copied as a whole
+        info = getattr(self, 'info', {})
+        self.__dict__.update(image.__dict__)
+        self.info = info
+        self._frame = frame
+
+    def tell(self):
+        return self._frame
+
+class WebPWriter:
+    """
+    Incremental animated WebP writer
+
+    Pillow encodes animated WebP files in a single call, appended
+    frames are spooled to a temporary file and encoded on close, only
+    one frame is kept in memory.
+    """
+
+    def __init__(self, filename, duration, quality=80, lossless=False):
+        '''
+        Constructor
+
+        :param filename str: output filename
+        :param duration float: duration for each frame in seconds
+        :param quality int: 0 to 100, lossy compression quality
+        :param lossless bool: lossless compression
+        '''
+        self.filename = filename
+        self.duration = duration
+        self.quality = quality
+        self.lossless = lossless
+        self.frames = 0
+        self._size = None
+        self._spool = None
+
+    def append(self, pil_image):
+        '''
+        Append a frame
+
+        :param pil_image: PIL Image
+        '''
+        with profiling.timer('encode'):
+            rgb = np.asarray(pil_image.convert('RGB'))
+            if self._spool is None:
+                self._size = pil_image.size
+                self._spool = tempfile.TemporaryFile()
+            assert pil_image.size == self._size, \
+                'Frame size {} differs from {}'.format(pil_image.size,
+                                                       self._size)
+            self._spool.write(rgb.tobytes())
+        self.frames += 1
+
+    def close(self):
+        '''
+        Encode the spooled frames into the output file
+        '''
+        if self._spool is None:
+            return
+        try:
+            with profiling.timer('encode'):
+                frames = _SpooledFrames(self._spool, self._size, self.frames)
+                frames.save(self.filename, format='WEBP', save_all=True,
+                            duration=int(round(self.duration * 1000)),
+                            loop=0, quality=self.quality,
+                            lossless=self.lossless)
+        finally:
+            self._spool.close()
+            self._spool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class VideoWriter:
+    """
+    Incremental MP4 or WebM writer, frames are piped to ffmpeg as they
+    are appended. Requires ffmpeg, see ffmpeg_exe.
+    """
+
+    def __init__(self, filename, duration):
+        '''
+        Constructor
+
+        :param filename str: output filename, .mp4 or .webm
+        :param duration float: duration for each frame in seconds
+        '''
+        extension = os.path.splitext(filename)[1].lower()
+        assert extension in VIDEO_CODECS, \
+            'Unknown video format {}'.format(extension)
+        self.exe = ffmpeg_exe()
+        if self.exe is None:
+            raise RuntimeError('{} output requires ffmpeg, install '
+                               'imageio-ffmpeg or add ffmpeg to the '
+                               'PATH'.format(extension[1:].upper()))
+        self.filename = filename
+        self.duration = duration
+        self.codec = VIDEO_CODECS[extension]
+        self.frames = 0
+        self._size = None
+        self._process = None
+
+    def _start(self, size):
+        # yuv420p requires even dimensions, odd sizes are padded
+        self._process = subprocess.Popen(
+            [self.exe, '-y', '-loglevel', 'error',
+             '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+             '-s', '{}x{}'.format(*size),
+             '-framerate', '{:.6g}'.format(1.0 / self.duration),
+             '-i', '-', '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+             '-pix_fmt', 'yuv420p'] + self.codec + [self.filename],
+            stdin=subprocess.PIPE)
+        self._size = size
+
+    def append(self, pil_image):
+        '''
+        Append a frame
+
+        :param pil_image: PIL Image
+        '''
+        with profiling.timer('encode'):
+            if self._process is None:
+                self._start(pil_image.size)
+            assert pil_image.size == self._size, \
+                'Frame size {} differs from {}'.format(pil_image.size,
+                                                       self._size)
+            self._process.stdin.write(
+                np.asarray(pil_image.convert('RGB')).tobytes())
+        self.frames += 1
+
+    def close(self):
+        '''
+        Wait for ffmpeg to finish the output file
+        '''
+        if self._process is None:
+            return
+        process = self._process
+        self._process = None
+        with profiling.timer('encode'):
+            process.stdin.close()
+            if process.wait() != 0:
+                raise RuntimeError('ffmpeg failed writing {}'.format(
+                    self.filename))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -3,32 +3,67 @@ cbersgif utils module
 """
 # -*- coding: utf-8 -*-
 
-from functools import partial
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import datetime
 import json
-import tempfile
-import hashlib
-import pickle
+import math
 import os
+import threading
 import re
 
 from aws_sat_api.search import cbers
 
-import pyproj
-
 from shapely.ops import transform
 from shapely.geometry import mapping, shape, Point
 
 import numpy as np
 
+from PIL import ImageDraw, ImageFont
+
 import imageio
 
 import rasterio as rio
 from rasterio.enums import Resampling
+from rasterio.transform import Affine, array_bounds, from_bounds
 from rasterio.vrt import WarpedVRT
+from rasterio.warp import reproject, transform_bounds
+from rasterio.windows import Window, from_bounds as window_from_bounds
+
+from cbersgif import blocks, gif, keys, profiling
+from cbersgif.cache import FrameCache, store_max_bytes
+from cbersgif.geometry import get_transformer
+from cbersgif.search import SearchError, StacSearch
+
+# Root of the CBERS archive, scene keys are relative to it
+DATA_URL = os.environ.get('CBERSGIF_DATA_URL', 's3://cbers-pds')
+
+# Raster reads accounting: band reads, reads from overviews and
+# estimated bytes, uncompressed size of the blocks intersecting
+# each read window. Reads through a BlockCache also count block hits.
+IO_STATS = Counter()
+_IO_STATS_LOCK = threading.Lock()
+
+FONT = ImageFont.load_default()
+
+# GIF palettes, see AnimatedGifWriter
+PALETTES = ('global', 'frame')
+
+STAC_ID = re.compile(r'CBERS_(?P<sat>\d)_(?P<cam>\w+)_(?P<date>\d+)_'
+                     r'(?P<path>\d{3})_(?P<row>\d{3})_L(?P<level>\d{1})')
 
-from cbersgif.search import StacSearch
+# STAC search page size
+STAC_PAGE_SIZE = 300
 
-CACHE_DIR = '/tmp/cbersgifcache/'
+# Keys grouping acquisition dates (YYYYMMDD) for temporal subsampling
+PERIODS = {
+    'day': lambda date: date,
+    'week': lambda date: '{}-{:02d}'.format(*datetime.date(
+        int(date[:4]), int(date[4:6]), int(date[6:8])).isocalendar()[:2]),
+    'month': lambda date: date[:6],
+    'year': lambda date: date[:4],
+}
 
 def stac_to_aws_sat_api(stac_id: str):
     """
@@ -41,9 +76,7 @@ def stac_to_aws_sat_api(stac_id: str):
 
     """
 
-    match = re.match(r'CBERS_(?P<sat>\d)_(?P<cam>\w+)_(?P<date>\d+)_'
-                     r'(?P<path>\d{3})_(?P<row>\d{3})_L(?P<level>\d{1})',
-                     stac_id)
+    match = STAC_ID.match(stac_id)
     assert match, "Can't match {}".format(stac_id)
     scene = dict()
     scene['key'] = 'CBERS{sat}/{sensor}/{path}/{row}/CBERS_{sat}_{sensor}_'\
@@ -58,19 +91,53 @@ def stac_to_aws_sat_api(stac_id: str):
     scene['scene_id'] = stac_id
     return scene
 
-def search(**kwargs):
+def first_per_period(scenes, one_per=None, max_scenes=None):
+    '''
+    First scene of each period, in the input order
+
+    :param scenes: iterable of scenes, ordered by acquisition date
+    :param one_per str: period in PERIODS, defaults to 'day'
+    :param max_scenes int: maximum number of scenes returned
+    :rtype: list
+    '''
+    period = PERIODS[one_per or 'day']
+    seen = set()
+    result = list()
+    for scene in scenes:
+        if max_scenes is not None and len(result) >= max_scenes:
+            break
+        key = period(scene['acquisition_date'])
+        if key not in seen:
+            seen.add(key)
+            result.append(scene)
+    return result
+
+@profiling.timed('search')
+def search(**kwargs): # pylint: disable=too-many-locals
     '''
     Returns available images for:
        sensor, level, start_date, end_date for both modes.
        path, row for 'aws_sat_api' mode.
        lat, lon for 'stac' mode. stac_endpoint is mandatory for this mode
+
+    Only the first scene of each day, or of each one_per period, is
+    returned. With max_scenes the 'stac' mode asks the service for
+    results sorted by date and stops requesting pages once max_scenes
+    periods are complete, services without the sort extension are read
+    in full and sorted here. Results that stopped early are cached up
+    to the day before the last scene read, later searches are served
+    from them while they hold max_scenes periods.
+
     :param mode str: 'aws_sat_api' or 'stac'
+    :param search_cache SearchCache: optional results cache, 'stac' mode
     :param sensor str: Sensor ID, in ('MUX','AWFI','PAN5M','PAN10M')
     :param path int: Path number
     :param row int: Row number
     :param level str: Levels to be used, for instance, 'L2' or 'L4'.
     :param start_date str: Start date in YYYY-MM-DD format
     :param end_date str: End date in YYYY-MM-DD format
+    :param one_per str: keep one scene per 'week', 'month' or 'year'
+    :param max_scenes int: maximum number of scenes returned
     :return: Scenes
     :rtype: list
     '''
@@ -85,6 +152,9 @@ def search(**kwargs):
     end_date = '9999-12-31' if not kwargs.get('end_date') \
                else kwargs['end_date']
     level = kwargs.get('level')
+    one_per = kwargs.get('one_per')
+    max_scenes = kwargs.get('max_scenes')
+    period = PERIODS[one_per or 'day']
 
     if mode == 'aws_sat_api':
 
@@ -105,24 +175,105 @@ def search(**kwargs):
         ss1 = StacSearch(kwargs['stac_endpoint'])
         bbox = [kwargs['lon'], kwargs['lat'],
                 kwargs['lon'], kwargs['lat']]
-        ids = ss1.search(instrument=kwargs['sensor'],
-                         start_date=start_date,
-                         end_date=end_date,
-                         level=level,
-                         bbox=bbox,
-                         limit=300)
-        matches = list()
-        for sid in ids:
-            matches.append(stac_to_aws_sat_api(stac_id=sid['id']))
+
+        def query(q_start_date, q_end_date, sortby='datetime'):
+            '''
+            Scenes in a date range and the last date they are complete
+            for. Sorted results are read until max_scenes periods are
+            complete, scenes of the last date read are then dropped.
+            '''
+            items = ss1.iter_search(instrument=kwargs['sensor'],
+                                    start_date=q_start_date,
+                                    end_date=q_end_date,
+                                    level=level,
+                                    bbox=bbox,
+                                    limit=STAC_PAGE_SIZE,
+                                    sortby=sortby if max_scenes else None)
+            scenes = list()
+            periods = set()
+            ordered = sortby is not None
+            try:
+                for item in items:
+                    scene = stac_to_aws_sat_api(stac_id=item['id'])
+                    if scenes and scene['acquisition_date'] < \
+                       scenes[-1]['acquisition_date']:
+                        # Sorting is ignored by the service
+                        ordered = False
+                    scenes.append(scene)
+                    periods.add(period(scene['acquisition_date']))
+                    if max_scenes and ordered and len(periods) > max_scenes:
+                        # First max_scenes periods are complete, the
+                        # last date may not be
+                        items.close()
+                        last = scene['acquisition_date']
+                        last_date = datetime.date(
+                            int(last[:4]), int(last[4:6]), int(last[6:8])) - \
+                            datetime.timedelta(days=1)
+                        return [found for found in scenes
+                                if found['acquisition_date'] < last], \
+                            last_date.isoformat()
+            except SearchError as err:
+                if scenes or not (max_scenes and sortby) or \
+                   not 400 <= err.status_code < 500:
+                    raise
+                # No sort extension, all pages are read and sorted here
+                return query(q_start_date, q_end_date, sortby=None)
+            return scenes, q_end_date
+
+        search_cache = kwargs.get('search_cache')
+        key = {'endpoint': kwargs['stac_endpoint'],
+               'sensor': kwargs['sensor'],
+               'level': level,
+               'bbox': bbox}
+        if search_cache:
+            queried = list()
+
+            def cached_query(q_start_date, q_end_date):
+                queried.append(q_start_date)
+                return query(q_start_date, q_end_date)
+
+            def complete(scenes):
+                return len(set(period(scene['acquisition_date'])
+                               for scene in scenes)) >= max_scenes
+
+            matches = search_cache.search(
+                key=key, start_date=start_date, end_date=end_date,
+                query=cached_query, complete=complete if max_scenes else None)
+            profiling.count('search_cache_misses' if queried
+                            else 'search_cache_hits')
+        else:
+            matches = query(start_date, end_date)[0]
         matches = sorted(matches, key=lambda k: k['acquisition_date'])
 
-    # Remove duplicate acquisition dates
-    seen = set()
-    seen_add = seen.add
-    filtered_matches = [x for x in matches if not (x['acquisition_date'] in seen \
-                                                   or seen_add(x['acquisition_date']))]
+    # Remove duplicate acquisition dates, or periods
+    return first_per_period(matches, one_per, max_scenes)
+
+def select_scenes(scenes, taboo_index=None, max_images=100):
+    '''
+    Scenes that will be drawn, before any read
+
+    :param scenes list: scenes as returned by search
+    :param taboo_index str: comma separated indices to skip
+    :param max_images int: scenes with larger indices are dropped
+    :return: list of (scene_no, scene)
+    '''
+    taboo_list = list()
+    if taboo_index:
+        for item in taboo_index.split(','):
+            taboo_list.append(int(item))
+
+    selected = list()
+    for scene_no, scene in enumerate(scenes):
 
-    return filtered_matches
+        if scene_no in taboo_list:
+            print('Skipping scene {}'.format(scene_no))
+            continue
+
+        if scene_no >= max_images:
+            break
+
+        selected.append((scene_no, scene))
+    return selected
 
 def lonlat_to_geojson(lon, lat, buff_size=None):
     '''
@@ -138,15 +289,8 @@ def lonlat_to_geojson(lon, lat, buff_size=None):
     geom = Point(lon, lat)
 
     if buff_size:
-        to_web_mercator = partial(
-            pyproj.transform,
-            pyproj.Proj(init='epsg:4326'),
-            pyproj.Proj(init='epsg:3857'))
-
-        to_wgs84 = partial(
-            pyproj.transform,
-            pyproj.Proj(init='epsg:3857'),
-            pyproj.Proj(init='epsg:4326'))
+        to_web_mercator = get_transformer('epsg:4326', 'epsg:3857').transform
+        to_wgs84 = get_transformer('epsg:3857', 'epsg:4326').transform
 
         point_wm = transform(to_web_mercator, geom)
         geom = point_wm.buffer(buff_size, cap_style=3)
@@ -164,15 +308,22 @@ def feat_to_bounds(geom, crs='epsg:3857'):
     '''
     geom = shape(json.loads(geom))
 
-    project = partial(
-        pyproj.transform,
-        pyproj.Proj(init='epsg:4326'),
-        pyproj.Proj(init=crs))
-
-    geom = transform(project, geom)
+    geom = transform(get_transformer('epsg:4326', crs).transform, geom)
 
     return geom.bounds
 
+def legacy_aoi(lon, lat, buffer_size, res):
+    '''
+    AOI bounds and size as computed by the version 1 cli, from the
+    buffer geometry and without rounding, see cache_lookup
+
+    :return: (aoi_bounds, width, height)
+    '''
+    aoi_bounds = feat_to_bounds(lonlat_to_geojson(lon, lat, buffer_size))
+    return (aoi_bounds,
+            int((aoi_bounds[2] - aoi_bounds[0]) / float(res)),
+            int((aoi_bounds[3] - aoi_bounds[1]) / float(res)))
+
 def linear_rescale(image, in_range, out_range):
     '''
     Linear rescaling
@@ -191,46 +342,332 @@ def linear_rescale(image, in_range, out_range):
 
 def frame_hash(input_dict):
     '''
-    Builds a hash for given dictionary
+    Builds a hash for given dictionary, see keys.digest
 
     :param input_dict dict: Input for hash function, all items are considered
     :return: computed hash
     '''
 
-    serial = pickle.dumps(sorted(input_dict.items()))
-    return hashlib.md5(serial).hexdigest()
+    return keys.digest(input_dict)
+
+@profiling.timed('annotate')
+def annotate_frame(img, text_value):
+    '''
+    Draw text_value in a white box on the top left corner of img
 
-def save_animated_gif(filename, pil_images, duration):
+    :param img: PIL Image, modified in place
+    :param text_value str: text, usually scene index and date
+    :return: img
+    '''
+    draw = ImageDraw.Draw(img)
+    if hasattr(draw, 'textbbox'):
+        left, top, right, bottom = draw.textbbox((0, 0), text_value,
+                                                 font=FONT)
+        xst, yst = right - left, bottom - top
+    else:
+        xst, yst = draw.textsize(text_value, font=FONT)
+    draw.rectangle([(5, 5), (xst+15, yst+15)],
+                   fill=(255, 255, 255))
+    draw.text((10, 10), text_value,
+              (0, 0, 0), font=FONT)
+    return img
+
+class AnimatedGifWriter:
+    """
+    Incremental animated GIF writer
+
+    Frames are appended to the output as they are produced, the file is
+    only created when the first frame is written. With the global
+    palette all frames share a palette and only the pixels changed
+    between frames are stored, see gif.GifEncoder. The frame palette
+    uses imageio, which quantizes each frame on its own.
+    """
+
+    def __init__(self, filename, duration, palette='global'):
+        '''
+        Constructor
+
+        :param filename str: output filename
+        :param duration float: duration for each frame in seconds
+        :param palette str: 'global' or 'frame'
+        '''
+        assert palette in PALETTES, 'Unknown palette {}'.format(palette)
+        self.filename = filename
+        self.duration = duration
+        self.palette = palette
+        self.frames = 0
+        self._writer = None
+
+    def append(self, pil_image):
+        '''
+        Append a frame
+
+        :param pil_image: PIL Image
+        '''
+        if self._writer is None:
+            if self.palette == 'global':
+                self._writer = gif.GifEncoder(self.filename, self.duration)
+            else:
+                self._writer = imageio.get_writer(self.filename, mode='I',
+                                                  duration=self.duration)
+        with profiling.timer('encode'):
+            if self.palette == 'global':
+                self._writer.append(pil_image)
+            else:
+                self._writer.append_data(
+                    np.asarray(pil_image.convert('RGB')))
+        self.frames += 1
+
+    def close(self):
+        '''
+        Finish the output file
+        '''
+        if self._writer is not None:
+            with profiling.timer('encode'):
+                self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def save_animated_gif(filename, pil_images, duration, palette='global'):
     '''
     Save PIL images passed in pil_images as an animated
     GIF to filename
 
     :param filename str: output filename
-    :param pil_images list: PIL Images
+    :param pil_images list: PIL Images, any iterable is accepted
     :param duration float: duration for each frame in seconds
+    :param palette str: see AnimatedGifWriter
     '''
 
-    # Currently requires saving each image as a temporary
-    # file. Check better way to convert from PIL to imageio
-    # format.
-    # It is also possible to use PIL to write the animated GIF
-    # directly, but the result was not good (dithering)? Check
-    # if this may be solved by a configuration parameter. This
-    # would remove the imageio dependency:
-    #    pil_images[0].save('test/pil_out.gif', save_all=True,
-    #                       append_images=pil_images[1:],
-    #                       duration=1000,
-    #                       loop=0, version='GIF89a',
-    #                       dither=None)
-
-    imageio_images = list()
-    for image in pil_images:
-        with tempfile.NamedTemporaryFile() as bmp_file:
-            image.save(bmp_file, "BMP")
-            #bmp_file.seek(0)
-            imageio_images.append(imageio.imread(bmp_file.name))
-    kargs = {'duration':duration}
-    imageio.mimsave(filename, imageio_images, **kargs)
+    with AnimatedGifWriter(filename, duration, palette) as writer:
+        for image in pil_images:
+            writer.append(image)
+
+def scene_s3_key(scene):
+    '''
+    S3 prefix for a scene, up to directory
+
+    :param scene dict: scene data as returned from CBERS search
+    :rtype: str
+    '''
+    return '{root}/{dir}'.format(root=DATA_URL, dir=scene['key'])
+
+def band_address(s3_key, scene, band):
+    '''
+    Address of a single band file
+
+    :param s3_key str: S3 prefix for scene, up to directory
+    :param scene dict: scene data as returned from CBERS search
+    :param band str: band number
+    :rtype: str
+    '''
+    # Reference
+    # https://s3.amazonaws.com/cbers-pds-migration/CBERS4/MUX/
+    # 063/095/CBERS_4_MUX_20180911_063_095_L2/
+    # CBERS_4_MUX_20180911_063_095_L2_BAND5.tif
+    return '{s3_key}/{scene}_BAND{band}.tif'.format(s3_key=s3_key,
+                                                    scene=scene['scene_id'],
+                                                    band=band)
+
+def warp_plan(aoi_bounds, width, height, crs='EPSG:3857'):
+    '''
+    Output grid shared by all bands read for an AOI. Passing the
+    grid explicitly to WarpedVRT avoids computing the default warp
+    output for the whole scene and the window math on each read.
+
+    :param aoi_bounds list: (minx, miny, maxx, maxy) in crs
+    :param width int: image output width in pixels
+    :param height int: image output height in pixels
+    :param crs str: output CRS
+    :return: WarpedVRT keyword arguments
+    :rtype: dict
+    '''
+    return {
+        'crs': crs,
+        'transform': from_bounds(*aoi_bounds, width, height),
+        'width': width,
+        'height': height,
+        'resampling': Resampling.bilinear,
+    }
+
+def _src_bounds(src, plan):
+    '''
+    Bounds of the plan output grid in the source CRS
+    '''
+    return transform_bounds(plan['crs'], src.crs,
+                            *array_bounds(plan['height'], plan['width'],
+                                          plan['transform']))
+
+def overview_level(src, plan):
+    '''
+    Coarsest internal overview with resolution still finer than the
+    plan output grid
+
+    :param src: rasterio dataset
+    :param plan dict: as returned by warp_plan
+    :return: GDAL overview level (0 is the first overview), None if
+             full resolution is required
+    '''
+    left, bottom, right, top = _src_bounds(src, plan)
+    factor = min((right - left) / src.res[0] / plan['width'],
+                 (top - bottom) / src.res[1] / plan['height'])
+    level = None
+    for index, overview in enumerate(src.overviews(1)):
+        if overview <= factor:
+            level = index
+    return level
+
+def _estimated_bytes(src, plan):
+    '''
+    Uncompressed size of the source blocks intersecting the plan grid
+    '''
+    window = window_from_bounds(*_src_bounds(src, plan), src.transform)
+    block_h, block_w = src.block_shapes[0]
+    col_off = max(int(window.col_off), 0)
+    row_off = max(int(window.row_off), 0)
+    col_end = min(int(window.col_off + window.width), src.width - 1)
+    row_end = min(int(window.row_off + window.height), src.height - 1)
+    if col_end < col_off or row_end < row_off:
+        return 0
+    n_blocks = (col_end // block_w - col_off // block_w + 1) * \
+               (row_end // block_h - row_off // block_h + 1)
+    return n_blocks * block_h * block_w * np.dtype(src.dtypes[0]).itemsize
+
+def _read_band(address, plan, overviews=True, block_cache=None):
+    '''
+    Warp a band file into the grid defined by plan
+
+    :param address str: band file address
+    :param plan dict: as returned by warp_plan
+    :param overviews bool: if True the source is read from the
+                           coarsest overview matching the output grid
+    :param block_cache BlockCache: if set the band is assembled from
+                                   cached blocks
+    :return: band matrix
+    '''
+    if block_cache is not None:
+        return blocks.read_band(address, plan, block_cache, overviews,
+                                _block_stats(address))
+    # @todo need to define
+    # export AWS_REQUEST_PAYER=requester
+    # reference: https://github.com/mapbox/rio-tiler/issues/52
+    with rio.open(address) as src:
+        level = overview_level(src, plan) if overviews else None
+        if level is None:
+            return _warp(src, plan, address)
+        # Same dataset, decimated reads are served from the overview
+        return _warp_overview(src, plan, address, level)
+
+def _block_stats(address):
+    '''
+    IO_STATS callback for blocks.read_band
+    '''
+    def update(level, fetched, cached, read_bytes):
+        with _IO_STATS_LOCK:
+            IO_STATS['reads'] += fetched > 0
+            IO_STATS['overview_reads'] += fetched > 0 and level is not None
+            IO_STATS['bytes'] += read_bytes
+            IO_STATS['block_hits'] += cached
+        profiling.count('band_reads', fetched > 0)
+        profiling.count('overview_reads', fetched > 0 and level is not None)
+        profiling.count('bytes_read', read_bytes)
+        profiling.count('blocks_read', fetched)
+        profiling.count('block_hits', cached)
+        print('Reading {}, {}, {} blocks, {} cached, {} bytes'.format(
+            address, 'full resolution' if level is None else
+            'overview level {}'.format(level), fetched, cached, read_bytes))
+    return update
+
+def _count_read(address, level, read_bytes):
+    '''
+    Update IO_STATS and the profiler counters for a band read
+    '''
+    with _IO_STATS_LOCK:
+        IO_STATS['reads'] += 1
+        IO_STATS['overview_reads'] += level is not None
+        IO_STATS['bytes'] += read_bytes
+    profiling.count('band_reads')
+    profiling.count('overview_reads', level is not None)
+    profiling.count('bytes_read', read_bytes)
+    print('Reading {}, {}, ~{} bytes'.format(
+        address, 'full resolution' if level is None else
+        'overview level {}'.format(level), read_bytes))
+
+def _warp(src, plan, address):
+    '''
+    Warp src into plan grid, updating IO_STATS
+    '''
+    _count_read(address, None, _estimated_bytes(src, plan))
+    with WarpedVRT(src, **plan) as vrt:
+        return vrt.read(indexes=1)
+
+def _warp_overview(src, plan, address, level):
+    '''
+    Warp the overview level of src into plan grid, updating IO_STATS.
+    The source window is read from src at the overview resolution,
+    GDAL serves it from the overview without opening the band file
+    again.
+    '''
+    factor = src.overviews(1)[level]
+    window = window_from_bounds(*_src_bounds(src, plan), src.transform)
+    # Whole overview pixels, with a one pixel margin for the kernel
+    col_off = max((int(math.floor(window.col_off)) // factor - 1) * factor,
+                  0)
+    row_off = max((int(math.floor(window.row_off)) // factor - 1) * factor,
+                  0)
+    col_end = min((int(math.ceil(window.col_off + window.width)) // factor +
+                   2) * factor, src.width)
+    row_end = min((int(math.ceil(window.row_off + window.height)) // factor +
+                   2) * factor, src.height)
+    out = np.zeros((plan['height'], plan['width']), dtype=src.dtypes[0])
+    if col_end <= col_off or row_end <= row_off:
+        return out
+    read_window = Window(col_off, row_off, col_end - col_off,
+                         row_end - row_off)
+    out_shape = (-(-(row_end - row_off) // factor),
+                 -(-(col_end - col_off) // factor))
+
+    block_h, block_w = src.block_shapes[0]
+    blocks_read = \
+        ((row_off // factor + out_shape[0] - 1) // block_h -
+         row_off // factor // block_h + 1) * \
+        ((col_off // factor + out_shape[1] - 1) // block_w -
+         col_off // factor // block_w + 1)
+    _count_read(address, level,
+                blocks_read * block_h * block_w * out.itemsize)
+
+    source = src.read(1, window=read_window, out_shape=out_shape)
+    read_transform = src.window_transform(read_window) * \
+        Affine.scale((col_end - col_off) / float(out_shape[1]),
+                     (row_end - row_off) / float(out_shape[0]))
+    with profiling.timer('warp'):
+        reproject(source, out, src_transform=read_transform, src_crs=src.crs,
+                  src_nodata=src.nodata, dst_transform=plan['transform'],
+                  dst_crs=plan['crs'], dst_nodata=0,
+                  resampling=plan['resampling'])
+    return out
+
+_DEFAULT_CACHE = None
+
+def get_cache(cache=True):
+    '''
+    Resolve the cache argument accepted by the frame readers
+
+    :param cache: True for the default FrameCache, False or None to
+                  disable caching, or a FrameCache instance
+    :return: FrameCache or None
+    '''
+    global _DEFAULT_CACHE # pylint: disable=global-statement
+    if cache is True:
+        if _DEFAULT_CACHE is None:
+            _DEFAULT_CACHE = FrameCache(max_bytes=store_max_bytes('frames'))
+        return _DEFAULT_CACHE
+    return cache or None
 
 def get_frame_matrix(s3_key, band, scene, aoi_bounds, width, height,
                      cache=True):
@@ -243,49 +680,240 @@ def get_frame_matrix(s3_key, band, scene, aoi_bounds, width, height,
     :param aoi_bounds list: (minx, miny, maxx, maxy)
     :param width int: image output width in pixels
     :param height int: image output height in pixels
-    :param cache bool: if True the image cache is used
+    :param cache: True for the default cache, False to disable it or
+                  a FrameCache instance
     '''
 
-    hash_dict = {
-        's3_key':s3_key,
-        'band':band,
-        'scene':scene,
-        'aoi_bounds':aoi_bounds,
-        'width':width,
-        'height':height,
-    }
-    hash_hex = frame_hash(hash_dict)
-    hash_file = CACHE_DIR + hash_hex + '.npy'
+    return get_scene_stack(scene, [band], aoi_bounds, width, height,
+                           cache=cache, s3_key=s3_key)[0]
 
-    if cache:
-        if os.path.isfile(hash_file):
-            print('Cache hit for {}, band {}'.format(scene['scene_id'], band))
-            return np.load(hash_file)
+def get_scene_stack(scene, bands, aoi_bounds, width, height, # pylint: disable=too-many-arguments
+                    cache=True, s3_key=None, overviews=True,
+                    block_cache=None, legacy_aoi=None):
+    '''
+    Build a multi-band image frame. The warp plan is computed once
+    and shared by all bands, which are read inside a single GDAL
+    environment.
 
-    # Reference
-    # https://s3.amazonaws.com/cbers-pds-migration/CBERS4/MUX/
-    # 063/095/CBERS_4_MUX_20180911_063_095_L2/
-    # CBERS_4_MUX_20180911_063_095_L2_BAND5.tif
-    band_address = '{s3_key}/{scene}_BAND{band}.tif'.\
-                   format(s3_key=s3_key,
-                          scene=scene['scene_id'],
-                          band=band)
-    with rio.open(band_address) as src:
-        with WarpedVRT(src,
-                       crs='EPSG:3857',
-                       resampling=Resampling.bilinear) as vrt:
-
-            window = vrt.window(*aoi_bounds)
-            # @todo need to define
-            # export AWS_REQUEST_PAYER=requester
-            # reference: https://github.com/mapbox/rio-tiler/issues/52
-            matrix = vrt.read(window=window,
-                              out_shape=(height, width), indexes=1,
-                              resampling=Resampling.bilinear)
-
-    if cache:
-        if not os.path.exists(CACHE_DIR):
-            os.makedirs(CACHE_DIR)
-        np.save(hash_file, matrix)
-
-    return matrix
+    :param scene dict: scene data as returned from CBERS search
+    :param bands list: band numbers, in output order
+    :param aoi_bounds list: (minx, miny, maxx, maxy)
+    :param width int: image output width in pixels
+    :param height int: image output height in pixels
+    :param cache: True for the default cache, False to disable it or
+                  a FrameCache instance
+    :param s3_key str: S3 prefix for scene, defaults to scene_s3_key
+    :param overviews bool: if True bands are read from the coarsest
+                           internal overview matching the output size
+    :param block_cache BlockCache: if set bands are assembled from
+                                   cached native blocks
+    :param legacy_aoi tuple: AOI as computed by the version 1 cli, see
+                             legacy_aoi and cache_lookup
+    :return: (len(bands), height, width) array
+    '''
+
+    if s3_key is None:
+        s3_key = scene_s3_key(scene)
+    cache = get_cache(cache)
+
+    matrices = cache_lookup(cache, s3_key, scene, bands, aoi_bounds,
+                            width, height, overviews, block_cache,
+                            legacy_aoi)
+    missing = [band_no for band_no, matrix in enumerate(matrices)
+               if matrix is None]
+    if missing:
+        plan = warp_plan(aoi_bounds, width, height)
+        # Sibling files are not needed, avoid listing the S3 prefix
+        # on each open
+        with rio.Env(GDAL_DISABLE_READDIR_ON_OPEN='EMPTY_DIR'):
+            for band_no in missing:
+                with profiling.timer('read'):
+                    matrices[band_no] = _read_band(
+                        band_address(s3_key, scene, bands[band_no]), plan,
+                        overviews, block_cache)
+                if cache:
+                    cache_store(cache, s3_key, scene, [bands[band_no]],
+                                aoi_bounds, width, height,
+                                matrices[band_no][np.newaxis], overviews,
+                                block_cache)
+
+    return np.stack(matrices)
+
+def cache_lookup(cache, s3_key, scene, bands, aoi_bounds, width, height, # pylint: disable=too-many-arguments
+                 overviews=True, block_cache=None, legacy_aoi=None):
+    '''
+    Cached frame matrices of a scene
+
+    :param cache FrameCache: frame cache, None for no lookup
+    :param overviews bool: frames read from internal overviews
+    :param block_cache BlockCache: frames read from cached blocks, the
+                                   warp differs slightly from direct
+                                   reads so frames are kept apart
+    :param legacy_aoi tuple: (aoi_bounds, width, height) as computed
+                             by the version 1 cli, frames it cached are
+                             used when they match the AOI and size
+    :return: list with a matrix for each band, None for misses
+    '''
+    matrices = [None] * len(bands)
+    if not cache:
+        return matrices
+    # Version 1 entries did not record the read options, they were
+    # written by direct reads with the overviews default
+    legacy = legacy_aoi is not None and overviews and block_cache is None \
+        and tuple(legacy_aoi[1:]) == (width, height) and \
+        keys.quantize_bounds(legacy_aoi[0]) == keys.quantize_bounds(aoi_bounds)
+    for band_no, band in enumerate(bands):
+        meta = keys.frame_meta(s3_key, band, scene, aoi_bounds, width,
+                               height, overviews,
+                               'direct' if block_cache is None else 'blocks')
+        aliases = (keys.legacy_frame_key(s3_key, band, scene,
+                                         *legacy_aoi),) if legacy else ()
+        with profiling.timer('cache_lookup'):
+            matrices[band_no] = cache.get(frame_hash(meta), meta, aliases)
+        profiling.count('frame_cache_misses' if matrices[band_no] is None
+                        else 'frame_cache_hits')
+        if matrices[band_no] is not None:
+            print('Cache hit for {}, band {}'.format(scene['scene_id'],
+                                                     band))
+    return matrices
+
+def cache_store(cache, s3_key, scene, bands, aoi_bounds, width, height, # pylint: disable=too-many-arguments
+                stack, overviews=True, block_cache=None):
+    '''
+    Store frame matrices of a scene, one entry per band
+
+    :param cache FrameCache: frame cache
+    :param stack: (len(bands), height, width) array
+    :param overviews bool: frames read from internal overviews
+    :param block_cache BlockCache: frames read from cached blocks
+    '''
+    for band_no, band in enumerate(bands):
+        meta = keys.frame_meta(s3_key, band, scene, aoi_bounds, width,
+                               height, overviews,
+                               'direct' if block_cache is None else 'blocks')
+        with profiling.timer('cache_store'):
+            cache.put(frame_hash(meta), stack[band_no], meta)
+
+def fetch_frames(scenes, bands, aoi_bounds, width, height, # pylint: disable=too-many-arguments
+                 workers=4, cache=True, overviews=True, executor=None,
+                 block_cache=None, legacy_aoi=None):
+    '''
+    Read the band stacks for a sequence of scenes using a bounded
+    thread pool
+
+    Scenes are read concurrently, at most workers scenes are in flight
+    at any time. Results are yielded in the same order as scenes.
+    Errors are isolated per scene: if the read fails the exception is
+    yielded for that scene and the remaining scenes are still
+    processed.
+
+    :param scenes list: (scene_no, scene) tuples, in output order
+    :param bands list: band numbers
+    :param aoi_bounds list: (minx, miny, maxx, maxy)
+    :param width int: image output width in pixels
+    :param height int: image output height in pixels
+    :param workers int: maximum number of concurrent reads
+    :param cache: True for the default cache, False to disable it or
+                  a FrameCache instance
+    :param overviews bool: if True bands are read from overviews when
+                           possible, see get_scene_stack
+    :param executor: optional executor shared with other calls, by
+                     default a pool with workers threads is created
+    :param block_cache BlockCache: optional native block cache
+    :param legacy_aoi tuple: see get_scene_stack
+    :return: generator of (scene_no, scene, stack, error) tuples,
+             stack is a (len(bands), height, width) array, None if error
+             is set
+    '''
+
+    workers = max(1, workers)
+    scenes = iter(scenes)
+    pending = deque()
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=workers)
+
+    def submit_next():
+        for scene_no, scene in scenes:
+            pending.append((scene_no, scene,
+                            executor.submit(get_scene_stack, scene, bands,
+                                            aoi_bounds, width, height,
+                                            cache, overviews=overviews,
+                                            block_cache=block_cache,
+                                            legacy_aoi=legacy_aoi)))
+            return True
+        return False
+
+    try:
+        while len(pending) < workers and submit_next():
+            pass
+        while pending:
+            scene_no, scene, future = pending.popleft()
+            submit_next()
+            try:
+                stack = future.result()
+            except Exception as err: # pylint: disable=broad-except
+                yield scene_no, scene, None, err
+                continue
+            yield scene_no, scene, stack, None
+    finally:
+        # Consumer may stop early, do not start reads that won't be used
+        for _, _, future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=True)
+
+POINT_FIELDS = {
+    'start_date': str,
+    'end_date': str,
+    'buffer_size': int,
+    'max_images': int,
+    'taboo_index': str,
+    'output': str,
+}
+
+def read_points(filename):
+    '''
+    Read batch jobs from a CSV file with lat and lon columns or from a
+    GeoJSON FeatureCollection of Points. Optional id column / property
+    and per job overrides for the fields in POINT_FIELDS.
+
+    :param filename str: .csv, .json or .geojson file
+    :return: jobs, dicts with id, lat, lon and overrides
+    :rtype: list
+    '''
+
+    rows = list()
+    if filename.lower().endswith('.csv'):
+        with open(filename, newline='') as csv_file:
+            for row in csv.DictReader(csv_file):
+                rows.append({key.strip().lower(): value.strip()
+                             for key, value in row.items()
+                             if key and value is not None and value.strip()})
+    else:
+        with open(filename) as json_file:
+            collection = json.load(json_file)
+        for feature in collection['features']:
+            assert feature['geometry']['type'] == 'Point', \
+                "Only Point features are supported"
+            row = dict(feature.get('properties') or {})
+            row['lon'], row['lat'] = feature['geometry']['coordinates'][:2]
+            if 'id' in feature and 'id' not in row:
+                row['id'] = feature['id']
+            rows.append(row)
+
+    jobs = list()
+    for index, row in enumerate(rows):
+        assert 'lat' in row and 'lon' in row, \
+            "Point {} has no lat/lon".format(index)
+        job = {
+            'id': str(row.get('id', index)),
+            'lat': float(row['lat']),
+            'lon': float(row['lon']),
+        }
+        for key, converter in POINT_FIELDS.items():
+            if row.get(key) not in (None, ''):
+                job[key] = converter(row[key])
+        jobs.append(job)
+    return jobs
@@ -22,6 +22,8 @@ extra_reqs = {
     "test": [
         "pytest"
     ],
+    # MP4 and WebM outputs, ffmpeg in the PATH works as well
+    "video": ["imageio-ffmpeg"],
     #"deploy": [],
 }
 
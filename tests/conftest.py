@@ -0,0 +1,168 @@
+"""conftest.py"""
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import threading
+
+import numpy as np
+
+import pytest
+
+import rasterio as rio
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+
+SCENE_ID = 'CBERS_4_MUX_20180911_151_126_L4'
+
+# Copacabana, 1000m buffer, EPSG:3857 bounds
+AOI_BOUNDS = (-4808038.883049279, -2629478.3425390865,
+              -4806038.883049279, -2627478.3425390865)
+
+def write_band(filename, value, size=512, res=20.0, overviews=()):
+    '''
+    Write a synthetic band covering AOI_BOUNDS in UTM 23S
+
+    :param filename str: output filename
+    :param value int: band offset, distinguishes bands
+    :param size int: width and height in pixels
+    :param res float: pixel size in meters
+    :param overviews tuple: overview factors to build
+    '''
+    rows, cols = np.mgrid[0:size, 0:size]
+    data = ((rows + cols) // 8 + value).astype(np.uint8)
+    # Top left corner a few km west/north of Copacabana
+    transform = from_origin(682000.0, 7463000.0, res, res)
+    with rio.open(filename, 'w', driver='GTiff', width=size, height=size,
+                  count=1, dtype='uint8', crs='EPSG:32723',
+                  transform=transform, tiled=True,
+                  blockxsize=128, blockysize=128) as dst:
+        dst.write(data, 1)
+        if overviews:
+            dst.build_overviews(list(overviews), Resampling.average)
+
+@pytest.fixture
+def synthetic_scene(tmp_path):
+    '''
+    Local scene with bands 5, 6 and 7, returns (s3_key, scene)
+    '''
+    for band in (5, 6, 7):
+        write_band(str(tmp_path / '{}_BAND{}.tif'.format(SCENE_ID, band)),
+                   band * 10, overviews=(2, 4))
+    scene = {
+        'key': 'CBERS4/MUX/151/126/' + SCENE_ID,
+        'acquisition_date': '20180911',
+        'scene_id': SCENE_ID,
+    }
+    return str(tmp_path), scene
+
+def stac_item(stac_id):
+    '''
+    Minimal STAC item for a CBERS scene id
+    '''
+    date = stac_id.split('_')[3]
+    return {
+        'type': 'Feature',
+        'id': stac_id,
+        'properties': {'datetime': '{}-{}-{}T13:00:00Z'.format(date[:4],
+                                                               date[4:6],
+                                                               date[6:])},
+    }
+
+class FakeStac:
+    """
+    Local STAC /search endpoint, items are paginated through 'next'
+    links with a merged 'page' body. Requests are recorded. Without
+    sortable, requests with sortby are answered with a 400 error.
+    """
+
+    def __init__(self, ids, sortable=True):
+        self.items = [stac_item(stac_id) for stac_id in ids]
+        self.requests = []
+        self.sortable = sortable
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Request handler"""
+            def do_GET(self): # pylint: disable=invalid-name
+                """Online check"""
+                self.send_response(200)
+                self.end_headers()
+
+            def do_POST(self): # pylint: disable=invalid-name
+                """Search"""
+                length = int(self.headers['Content-Length'])
+                body = json.loads(self.rfile.read(length))
+                fake.requests.append(body)
+                if 'sortby' in body and not fake.sortable:
+                    self.send_error(400, 'sortby is not supported')
+                    return
+                data = json.dumps(fake.page(body)).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/geo+json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args): # pylint: disable=arguments-differ
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/search'.format(self.server.server_port)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def page(self, body):
+        '''
+        Search response for request body
+        '''
+        start, end = body['datetime'].split('/')
+        matches = [item for item in self.items
+                   if start[:10] <= item['properties']['datetime'][:10] <=
+                   end[:10]]
+        if 'sortby' in body:
+            matches.sort(key=lambda item: item['properties']['datetime'])
+        limit = body.get('limit', 10)
+        page = body.get('page', 1)
+        result = {
+            'type': 'FeatureCollection',
+            'features': matches[(page - 1) * limit:page * limit],
+            'links': [],
+        }
+        if page * limit < len(matches):
+            result['links'].append({'rel': 'next', 'href': self.url,
+                                    'method': 'POST', 'merge': True,
+                                    'body': {'page': page + 1}})
+        return result
+
+@pytest.fixture
+def fake_stac():
+    '''
+    Fake STAC endpoint with 25 MUX scenes, newest first
+    '''
+    ids = ['CBERS_4_MUX_2018{:02d}{:02d}_151_126_L4'.format(1 + index // 3,
+                                                           1 + index % 3)
+           for index in range(25)]
+    stac = FakeStac(reversed(ids))
+    yield stac
+    stac.server.shutdown()
+
+@pytest.fixture
+def local_archive(tmp_path, monkeypatch):
+    '''
+    Local CBERS archive with 4 MUX scenes served by a fake STAC
+    endpoint, utils.DATA_URL points to the archive. Returns the
+    FakeStac instance.
+    '''
+    import cbersgif.utils # pylint: disable=import-outside-toplevel
+    archive = tmp_path / 'archive'
+    ids = ['CBERS_4_MUX_201801{:02d}_151_126_L4'.format(day)
+           for day in (5, 15, 25, 30)]
+    for index, stac_id in enumerate(ids):
+        directory = archive / 'CBERS4' / 'MUX' / '151' / '126' / stac_id
+        directory.mkdir(parents=True)
+        for band in (5, 6, 7):
+            write_band(str(directory / '{}_BAND{}.tif'.format(stac_id, band)),
+                       band * 10 + index, overviews=(2, 4))
+    monkeypatch.setattr(cbersgif.utils, 'DATA_URL', str(archive))
+    stac = FakeStac(ids)
+    yield stac
+    stac.server.shutdown()
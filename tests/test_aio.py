@@ -0,0 +1,145 @@
+"""aio_test.py"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+
+import pytest
+
+from PIL import Image
+
+import cbersgif.utils
+from cbersgif.aio import AsyncEngine
+from cbersgif.cache import RenderedCache
+from cbersgif.render import GifJob, render_gif
+
+# Copacabana
+LON = -43.182365
+LAT = -22.970722
+
+def test_render_gif(local_archive, tmp_path):
+    """render_gif_test"""
+
+    engine = AsyncEngine(frame_cache=False)
+
+    async def render():
+        return await asyncio.gather(*[
+            engine.render_gif(GifJob(LAT, LON, start_date='2018-01-01',
+                                     end_date='2018-01-31', buffer_size=1000,
+                                     res=40, enhancement=True,
+                                     taboo_index=str(index),
+                                     stac_endpoint=local_archive.url),
+                              str(tmp_path / '{}.gif'.format(index)))
+            for index in range(3)])
+
+    results = asyncio.run(render())
+    assert [result['frames'] for result in results] == [3, 3, 3]
+    with Image.open(str(tmp_path / '0.gif')) as gif:
+        assert gif.n_frames == 3
+        assert gif.size == (50, 50)
+
+def test_read_limit_and_cancel(local_archive, tmp_path, monkeypatch):
+    """read_limit_and_cancel_test"""
+
+    state = {'running': 0, 'max_running': 0}
+    lock = threading.Lock()
+    get_scene_stack = cbersgif.utils.get_scene_stack
+
+    def slow_get_scene_stack(*args, **kwargs):
+        with lock:
+            state['running'] += 1
+            state['max_running'] = max(state['max_running'],
+                                       state['running'])
+        time.sleep(0.2)
+        with lock:
+            state['running'] -= 1
+        return get_scene_stack(*args, **kwargs)
+
+    monkeypatch.setattr(cbersgif.utils, 'get_scene_stack',
+                        slow_get_scene_stack)
+    engine = AsyncEngine(max_reads=2, frame_cache=False)
+    output = str(tmp_path / 'cancelled.gif')
+
+    async def render():
+        task = asyncio.ensure_future(engine.render_gif(
+            GifJob(LAT, LON, start_date='2018-01-01', end_date='2018-01-31',
+                   buffer_size=1000, res=40,
+                   stac_endpoint=local_archive.url), output))
+        await asyncio.sleep(0.3)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    assert asyncio.run(render())
+    assert state['max_running'] <= 2
+    assert not os.path.exists(output)
+
+def test_render_gif_rendered_cache(local_archive, tmp_path):
+    """render_gif_rendered_cache_test"""
+
+    engine = AsyncEngine(frame_cache=False,
+                         render_cache=RenderedCache(str(tmp_path / 'cache')))
+
+    def job(taboo_index=None):
+        return GifJob(LAT, LON, start_date='2018-01-01', end_date='2018-01-31',
+                      buffer_size=1000, res=40, enhancement=True,
+                      taboo_index=taboo_index,
+                      stac_endpoint=local_archive.url)
+
+    asyncio.run(engine.render_gif(job(), str(tmp_path / 'first.gif')))
+    cbersgif.utils.IO_STATS.clear()
+    result = asyncio.run(engine.render_gif(job('0,2'),
+                                           str(tmp_path / 'second.gif')))
+    assert result['frames'] == 2
+    assert cbersgif.utils.IO_STATS['reads'] == 0
+
+def test_render_gif_failure(local_archive, tmp_path):
+    """render_gif_failure_test"""
+
+    class FailingWriter:
+        """Writer failing on the first frame and on close"""
+        filename = str(tmp_path / 'partial.mp4')
+
+        def append(self, image): # pylint: disable=unused-argument,no-self-use
+            """append"""
+            with open(self.filename, 'wb') as partial:
+                partial.write(b'partial')
+            raise ValueError('append failed')
+
+        def close(self): # pylint: disable=no-self-use
+            """close"""
+            raise RuntimeError('ffmpeg failed')
+
+    engine = AsyncEngine(frame_cache=False)
+    job = GifJob(LAT, LON, start_date='2018-01-01', end_date='2018-01-31',
+                 buffer_size=1000, res=40, stac_endpoint=local_archive.url)
+    # The append error is raised, not the close one
+    with pytest.raises(ValueError):
+        asyncio.run(engine.render_gif(job, FailingWriter()))
+    assert not os.path.exists(FailingWriter.filename)
+
+def test_screen_single_worker(local_archive, tmp_path):
+    """screen_single_worker_test"""
+
+    def job():
+        return GifJob(LAT, LON, start_date='2018-01-01',
+                      end_date='2018-01-31', buffer_size=1000, res=40,
+                      screen=True, stac_endpoint=local_archive.url)
+
+    expected = render_gif(job(), str(tmp_path / 'sync.gif'))
+    with ThreadPoolExecutor(1) as executor:
+        engine = AsyncEngine(executor=executor, frame_cache=False)
+
+        async def render():
+            return await asyncio.wait_for(asyncio.gather(*[
+                engine.render_gif(job(), str(tmp_path / '{}.gif'.format(index)))
+                for index in range(2)]), 30)
+
+        results = asyncio.run(render())
+    assert [result['frames'] for result in results] == \
+        [expected['frames']] * 2
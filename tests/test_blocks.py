@@ -0,0 +1,68 @@
+"""blocks_test.py"""
+
+import os
+
+import numpy as np
+
+from cbersgif.blocks import BlockCache
+from cbersgif.cache import FrameCache
+from cbersgif.utils import IO_STATS, get_scene_stack
+
+from conftest import AOI_BOUNDS
+
+def test_block_cache(synthetic_scene, tmp_path):
+    """block_cache_test"""
+
+    s3_key, scene = synthetic_scene
+    block_cache = BlockCache(str(tmp_path / 'cache'))
+    center_x = (AOI_BOUNDS[0] + AOI_BOUNDS[2]) / 2
+    center_y = (AOI_BOUNDS[1] + AOI_BOUNDS[3]) / 2
+    aoi_bounds = (center_x - 2000, center_y - 2000,
+                  center_x + 2000, center_y + 2000)
+
+    IO_STATS.clear()
+    stack = get_scene_stack(scene, ['7', '6', '5'], aoi_bounds, 200, 200,
+                            cache=False, s3_key=s3_key,
+                            block_cache=block_cache)
+    assert IO_STATS['reads'] == 3
+    assert IO_STATS['block_hits'] == 0
+    reference = get_scene_stack(scene, ['7', '6', '5'], aoi_bounds, 200, 200,
+                                cache=False, s3_key=s3_key)
+    assert np.mean(np.abs(stack.astype(int) - reference.astype(int))) < 0.5
+
+    # Band files are not needed for other framings of the same area
+    for band in ('7', '6', '5'):
+        os.remove('{}/{}_BAND{}.tif'.format(s3_key, scene['scene_id'], band))
+    IO_STATS.clear()
+    inner = (center_x - 1000, center_y - 1500, center_x + 1500, center_y)
+    for width, height in ((125, 75), (100, 60)):
+        stack = get_scene_stack(scene, ['7'], inner, width, height,
+                                cache=False, s3_key=s3_key,
+                                block_cache=block_cache)
+        assert stack.shape == (1, height, width)
+        assert stack.min() > 0
+    assert IO_STATS['reads'] == 0
+    assert IO_STATS['block_hits'] > 0
+
+    block_cache.clear()
+    assert block_cache.stats()['entries'] == 0
+
+def test_frame_cache_paths(synthetic_scene, tmp_path):
+    """frame_cache_paths_test"""
+
+    s3_key, scene = synthetic_scene
+    cache = FrameCache(str(tmp_path / 'cache'))
+    block_cache = BlockCache(str(tmp_path / 'cache'))
+    from_blocks = get_scene_stack(scene, ['7'], AOI_BOUNDS, 60, 60,
+                                  cache=cache, s3_key=s3_key,
+                                  block_cache=block_cache)
+    # Frames warped from blocks are not returned for direct reads
+    direct = get_scene_stack(scene, ['7'], AOI_BOUNDS, 60, 60, cache=cache,
+                             s3_key=s3_key)
+    assert cache.hits == 0
+    assert np.array_equal(direct, get_scene_stack(
+        scene, ['7'], AOI_BOUNDS, 60, 60, cache=False, s3_key=s3_key))
+    assert np.array_equal(from_blocks, get_scene_stack(
+        scene, ['7'], AOI_BOUNDS, 60, 60, cache=cache, s3_key=s3_key,
+        block_cache=block_cache))
+    assert cache.hits == 1
@@ -0,0 +1,155 @@
+"""cache_test.py"""
+
+import glob
+import os
+
+import numpy as np
+
+from cbersgif.cache import FrameCache, SearchCache, parse_size
+
+def test_parse_size():
+    """parse_size_test"""
+
+    assert parse_size('1024') == 1024
+    assert parse_size('2K') == 2048
+    assert parse_size('1.5M') == 1572864
+    assert parse_size('2GB') == 2 * 1024 ** 3
+
+def test_put_get(tmp_path):
+    """put_get_test"""
+
+    cache = FrameCache(str(tmp_path), max_bytes=10 ** 6)
+    array = np.arange(100, dtype=np.uint16).reshape(10, 10)
+    assert cache.get('a') is None
+    cache.put('a', array, {'band': '5'})
+    assert np.array_equal(cache.get('a'), array)
+    # No temporary files left behind
+    assert not glob.glob(str(tmp_path / '*.tmp'))
+
+    stats = cache.stats()
+    assert stats['entries'] == 1
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert cache.hits == 1 and cache.misses == 1
+
+def test_lru_eviction(tmp_path):
+    """lru_eviction_test"""
+
+    array = np.zeros((100, 100), dtype=np.uint8)
+    cache = FrameCache(str(tmp_path), max_bytes=3 * 10200)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, array)
+    # 'a' becomes the most recently used entry
+    assert cache.get('a') is not None
+    cache.put('d', array)
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.stats()['evictions'] == 1
+    assert not os.path.exists(str(tmp_path / 'b.npy'))
+
+    assert cache.prune(0) == 3
+    assert cache.stats()['entries'] == 0
+
+def test_clear_and_adopt(tmp_path):
+    """clear_and_adopt_test"""
+
+    # Files written before the index existed are adopted
+    np.save(str(tmp_path / 'legacy.npy'), np.ones(4))
+    cache = FrameCache(str(tmp_path), max_bytes=10 ** 6)
+    assert np.array_equal(cache.get('legacy'), np.ones(4))
+
+    cache.clear()
+    stats = cache.stats()
+    assert stats['entries'] == 0
+    assert stats['hits'] == 0
+    assert not glob.glob(str(tmp_path / '*.npy'))
+
+def test_formats(tmp_path):
+    """formats_test"""
+
+    array = np.tile(np.arange(200, dtype=np.uint16), (200, 1))
+
+    cache = FrameCache(str(tmp_path), max_bytes=10 ** 7)
+    cache.put('a', array)
+    result = cache.get('a')
+    assert isinstance(result, np.memmap)
+    assert np.array_equal(result, array)
+    npy_size = cache.stats()['bytes']
+
+    # Same key rewritten compressed, npy file is replaced
+    cache = FrameCache(str(tmp_path), max_bytes=10 ** 7, fmt='npz')
+    cache.put('a', array)
+    assert not os.path.exists(str(tmp_path / 'a.npy'))
+    assert np.array_equal(cache.get('a'), array)
+    assert cache.stats()['bytes'] < npy_size / 4
+
+    cache = FrameCache(str(tmp_path), max_bytes=10 ** 7, mmap=False)
+    cache.put('b', array)
+    assert not isinstance(cache.get('b'), np.memmap)
+
+def test_search_cache(tmp_path):
+    """search_cache_test"""
+
+    scenes = [{'scene_id': str(index), 'acquisition_date': date}
+              for index, date in enumerate(['20180105', '20180210',
+                                            '20180320', '20180425'])]
+    queries = []
+
+    def query(start_date, end_date):
+        queries.append((start_date, end_date))
+        s_date = start_date.replace('-', '')
+        e_date = end_date.replace('-', '')
+        return [scene for scene in scenes
+                if s_date <= scene['acquisition_date'] <= e_date]
+
+    cache = SearchCache(str(tmp_path), ttl=100)
+    key = {'sensor': 'MUX', 'bbox': [1, 2, 1, 2]}
+    result = cache.search(key, '2018-01-01', '2018-02-28', query)
+    assert [scene['scene_id'] for scene in result] == ['0', '1']
+
+    # Cached range
+    result = cache.search(key, '2018-02-01', '2018-02-28', query)
+    assert [scene['scene_id'] for scene in result] == ['1']
+    assert len(queries) == 1
+
+    # Extended range only queries new dates
+    result = cache.search(key, '2018-01-01', '2018-03-31', query)
+    assert [scene['scene_id'] for scene in result] == ['0', '1', '2']
+    assert queries[-1] == ('2018-02-28', '2018-03-31')
+
+    # Other keys and expired entries are queried again
+    cache.search({'sensor': 'AWFI'}, '2018-01-01', '2018-02-28', query)
+    assert len(queries) == 3
+    cache = SearchCache(str(tmp_path), ttl=-1)
+    cache.search(key, '2018-01-01', '2018-02-28', query)
+    assert queries[-1] == ('2018-01-01', '2018-02-28')
+
+    # Queries that stopped early are cached up to their last date
+    def partial(start_date, end_date):
+        return query(start_date, end_date)[:1], '2018-01-31'
+
+    cache = SearchCache(str(tmp_path), ttl=100)
+    key = {'sensor': 'PAN5M'}
+    result = cache.search(key, '2018-01-01', '2018-12-31', partial)
+    assert [scene['scene_id'] for scene in result] == ['0']
+    cache.search(key, '2018-01-01', '2018-12-31', partial,
+                 complete=lambda scenes: len(scenes) >= 1)
+    assert len(queries) == 5
+    result = cache.search(key, '2018-01-01', '2018-12-31', query,
+                          complete=lambda scenes: len(scenes) >= 2)
+    assert [scene['scene_id'] for scene in result] == ['0', '1', '2', '3']
+    assert queries[-1] == ('2018-01-31', '2018-12-31')
+
+    # Ranges starting after a partial entry are queried from their start
+    def first(start_date, end_date):
+        scenes = query(start_date, end_date)[:1]
+        date = scenes[0]['acquisition_date']
+        return scenes, '{}-{}-{}'.format(date[:4], date[4:6], date[6:])
+
+    key = {'sensor': 'PAN10M'}
+    cache.search(key, '2018-01-01', '2018-12-31', first)
+    result = cache.search(key, '2018-03-01', '2018-12-31', first,
+                          complete=lambda scenes: len(scenes) >= 1)
+    assert [scene['scene_id'] for scene in result] == ['2']
+    assert queries[-1] == ('2018-03-01', '2018-12-31')
@@ -0,0 +1,165 @@
+"""cli_test.py"""
+
+import json
+
+from click.testing import CliRunner
+
+from PIL import Image
+
+from cbersgif import profiling
+from cbersgif.cli.cbersgif import main
+from cbersgif.utils import IO_STATS
+
+# Copacabana
+LON = -43.182365
+LAT = -22.970722
+
+def test_gif(local_archive, tmp_path):
+    """gif_test"""
+
+    output = str(tmp_path / 'out.gif')
+    runner = CliRunner()
+    result = runner.invoke(main, ['--lat', str(LAT), '--lon', str(LON),
+                                  '--start_date', '2018-01-01',
+                                  '--end_date', '2018-01-31',
+                                  '--buffer_size', '1000', '--res', '40',
+                                  '--enhancement', '--taboo_index', '1',
+                                  '--stac_endpoint', local_archive.url,
+                                  '--cache_dir', str(tmp_path / 'cache'),
+                                  '--output', output])
+    assert result.exit_code == 0, result.output
+    assert '4 scenes found' in result.output
+    with Image.open(output) as gif:
+        assert gif.n_frames == 3
+        assert gif.size == (50, 50)
+
+def test_batch(local_archive, tmp_path):
+    """batch_test"""
+
+    points = tmp_path / 'points.csv'
+    points.write_text('id,lat,lon,buffer_size\n'
+                      'a,{lat},{lon},\n'
+                      'b,{lat},{lon},500\n'.format(lat=LAT, lon=LON))
+    IO_STATS.clear()
+    runner = CliRunner()
+    result = runner.invoke(main, ['batch', str(points),
+                                  '--start_date', '2018-01-01',
+                                  '--end_date', '2018-01-31',
+                                  '--buffer_size', '1000', '--res', '40',
+                                  '--stac_endpoint', local_archive.url,
+                                  '--cache_dir', str(tmp_path / 'cache'),
+                                  '--output_dir', str(tmp_path / 'gifs'),
+                                  '--summary', str(tmp_path / 'summary.json')])
+    assert result.exit_code == 0, result.output
+    # Both AOIs are read together, once per scene and band
+    assert IO_STATS['reads'] == 4 * 3
+    with open(str(tmp_path / 'summary.json')) as summary_file:
+        summary = json.load(summary_file)
+    assert [job['status'] for job in summary] == ['ok', 'ok']
+    assert [job['frames'] for job in summary] == [4, 4]
+    with Image.open(str(tmp_path / 'gifs' / 'b.gif')) as gif:
+        assert gif.size == (25, 25)
+
+def test_profile(local_archive, tmp_path):
+    """profile_test"""
+
+    report = str(tmp_path / 'profile.json')
+    runner = CliRunner()
+    result = runner.invoke(main, ['--lat', str(LAT), '--lon', str(LON),
+                                  '--start_date', '2018-01-01',
+                                  '--end_date', '2018-01-31',
+                                  '--buffer_size', '1000', '--res', '40',
+                                  '--enhancement',
+                                  '--stac_endpoint', local_archive.url,
+                                  '--cache_dir', str(tmp_path / 'cache'),
+                                  '--output', str(tmp_path / 'out.gif'),
+                                  '--profile', report])
+    assert result.exit_code == 0, result.output
+    with open(report) as report_file:
+        profile = json.load(report_file)
+    for stage in ('search', 'read', 'stretch', 'rescale', 'enhance',
+                  'annotate', 'encode'):
+        assert profile['timers'][stage]['calls'] > 0, stage
+    assert profile['timers']['read']['calls'] == 4 * 3
+    assert profile['counters']['band_reads'] == 4 * 3
+    assert profile['counters']['bytes_read'] > 0
+    assert profile['counters']['frame_cache_misses'] == 4 * 3
+    assert profile['counters']['stac_requests'] >= 1
+    assert profile['counters']['frames'] == 4
+    assert not profiling.PROFILER.enabled
+
+    # The report is written when the render fails
+    report = str(tmp_path / 'failed.json')
+    result = runner.invoke(main, ['--lat', str(LAT), '--lon', str(LON),
+                                  '--start_date', '2018-01-01',
+                                  '--end_date', '2018-01-31',
+                                  '--buffer_size', '1000', '--res', '40',
+                                  '--stac_endpoint', local_archive.url,
+                                  '--cache_dir', str(tmp_path / 'cache'),
+                                  '--output', str(tmp_path / 'out.bmp'),
+                                  '--profile', report])
+    assert result.exit_code != 0
+    with open(report) as report_file:
+        assert 'timers' in json.load(report_file)
+    assert not profiling.PROFILER.enabled
+    assert not profiling.PROFILER.counters
+
+def test_output_format(local_archive, tmp_path):
+    """output_format_test"""
+
+    points = tmp_path / 'points.csv'
+    points.write_text('id,lat,lon,output\n'
+                      'a,{lat},{lon},\n'
+                      'b,{lat},{lon},b.gif\n'.format(lat=LAT, lon=LON))
+    runner = CliRunner()
+    result = runner.invoke(main, ['batch', str(points),
+                                  '--start_date', '2018-01-01',
+                                  '--end_date', '2018-01-31',
+                                  '--buffer_size', '1000', '--res', '40',
+                                  '--stac_endpoint', local_archive.url,
+                                  '--cache_dir', str(tmp_path / 'cache'),
+                                  '--output_dir', str(tmp_path / 'out'),
+                                  '--output_format', 'webp'])
+    assert result.exit_code == 0, result.output
+    with Image.open(str(tmp_path / 'out' / 'a.webp')) as webp:
+        assert webp.format == 'WEBP'
+        assert webp.n_frames == 4
+        assert webp.size == (50, 50)
+    # Output column extensions select the format
+    with Image.open(str(tmp_path / 'out' / 'b.gif')) as gif:
+        assert gif.format == 'GIF'
+
+def test_cache_commands(local_archive, tmp_path):
+    """cache_commands_test"""
+
+    cache_dir = str(tmp_path / 'cache')
+    runner = CliRunner()
+    result = runner.invoke(main, ['--lat', str(LAT), '--lon', str(LON),
+                                  '--start_date', '2018-01-01',
+                                  '--end_date', '2018-01-31',
+                                  '--buffer_size', '1000', '--res', '40',
+                                  '--stac_endpoint', local_archive.url,
+                                  '--cache_dir', cache_dir,
+                                  '--output', str(tmp_path / 'out.gif')])
+    assert result.exit_code == 0, result.output
+
+    result = runner.invoke(main, ['cache', '--cache_dir', cache_dir,
+                                  '--cache_max_bytes', '1M', 'stats'])
+    assert result.exit_code == 0, result.output
+    stats = dict(line.split(': ') for line in result.output.splitlines())
+    # Stores share the cache size limit
+    assert int(stats['max_bytes']) == 2 ** 19
+    assert int(stats['block_max_bytes']) == 2 ** 18
+    assert int(stats['rendered_max_bytes']) == 2 ** 18
+    assert int(stats['total_max_bytes']) == 2 ** 20
+    assert int(stats['entries']) == 4 * 3
+    assert int(stats['rendered_entries']) == 4
+    assert int(stats['total_bytes']) == (int(stats['bytes']) +
+                                         int(stats['block_bytes']) +
+                                         int(stats['rendered_bytes']))
+
+    # Rendered frames are pruned as well
+    result = runner.invoke(main, ['cache', '--cache_dir', cache_dir,
+                                  'prune', '--max_bytes', '0'])
+    assert result.exit_code == 0, result.output
+    assert '{} entries evicted'.format(4 * 3 + 4) in result.output
@@ -0,0 +1,95 @@
+"""enhance_test.py"""
+
+import numpy as np
+
+from cbersgif.enhance import masked_percentiles, compute_stretch, \
+    stretch_stack, to_uint8, band_histogram, histogram_percentiles, \
+    accumulate_histograms, histogram_stretch
+from cbersgif.utils import linear_rescale
+
+def reference_stretch(matrix, p_min_value, p_max_value):
+    """
+    Stretch as originally done in the cli, band by band
+    """
+    out = np.zeros(matrix.shape, dtype=np.uint8)
+    out[...] = 1.0 * np.where(matrix > 0,
+                              linear_rescale(matrix,
+                                             in_range=[int(p_min_value),
+                                                       int(p_max_value)],
+                                             out_range=[1, 255]),
+                              0)
+    return out
+
+def random_stack(dtype, max_value):
+    """
+    Random stack with some nodata pixels
+    """
+    rng = np.random.RandomState(1)
+    stack = rng.randint(0, max_value, (3, 64, 80)).astype(dtype)
+    stack[:, :10, :10] = 0
+    return stack
+
+def test_masked_percentiles():
+    """masked_percentiles_test"""
+
+    stack = random_stack(np.uint16, 1024)
+    for band in stack:
+        assert np.allclose(masked_percentiles(band, (2, 98)),
+                           np.percentile(band[band > 0], (2, 98)))
+    assert masked_percentiles(np.zeros((4, 4)), (2, 98)) == [0.0, 0.0]
+
+def test_histogram_percentiles():
+    """histogram_percentiles_test"""
+
+    for percents in ((2, 98), (0, 100), (50, 50), (33.3, 66.6)):
+        for dtype, max_value in ((np.uint8, 256), (np.uint16, 4096)):
+            band = random_stack(dtype, max_value)[0]
+            assert np.allclose(
+                histogram_percentiles(band_histogram(band), percents),
+                np.percentile(band[band > 0], percents))
+
+def test_global_stretch():
+    """global_stretch_test"""
+
+    # Bands that can not be counted are mixed with histograms
+    for stacks in ([random_stack(np.uint8, 128),
+                    random_stack(np.uint16, 1024)],
+                   [random_stack(np.uint16, 1024),
+                    random_stack(np.float32, 1000) / 7,
+                    random_stack(np.int16, 2000) - 100]):
+        histograms = None
+        for stack in stacks:
+            histograms = accumulate_histograms(stack, histograms)
+        p_min_value, p_max_value = histogram_stretch(histograms, (2, 98))
+        for band_no in range(3):
+            values = np.concatenate([stack[band_no][stack[band_no] > 0]
+                                     for stack in stacks])
+            assert np.allclose([p_min_value[band_no], p_max_value[band_no]],
+                               np.percentile(values, (2, 98)))
+
+def test_stretch_stack():
+    """stretch_stack_test"""
+
+    for dtype, max_value in ((np.uint8, 256), (np.uint16, 1024),
+                             (np.float32, 1024)):
+        stack = random_stack(dtype, max_value)
+        p_min_value, p_max_value = compute_stretch(stack, (2, 98))
+        result = stretch_stack(stack, p_min_value, p_max_value)
+        assert result.dtype == np.uint8
+        for band_no, band in enumerate(stack):
+            reference = reference_stretch(band, p_min_value[band_no],
+                                          p_max_value[band_no])
+            assert np.abs(result[band_no].astype(int) -
+                          reference.astype(int)).max() <= \
+                          (0 if dtype != np.float32 else 1)
+
+def test_interleaved_output():
+    """interleaved_output_test"""
+
+    stack = random_stack(np.uint8, 256)
+    rgb = np.empty((64, 80, 3), dtype=np.uint8)
+    stretch_stack(stack, [10] * 3, [200] * 3, out=np.moveaxis(rgb, 2, 0))
+    assert np.array_equal(rgb, np.dstack(stretch_stack(stack, [10] * 3,
+                                                       [200] * 3)))
+    to_uint8(stack, out=np.moveaxis(rgb, 2, 0))
+    assert np.array_equal(rgb, np.dstack(stack))
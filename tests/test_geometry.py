@@ -0,0 +1,38 @@
+"""geometry_test.py"""
+
+import numpy as np
+
+from cbersgif.geometry import get_transformer, lonlat_to_bounds, \
+    lonlat_to_bounds_batch
+from cbersgif.utils import lonlat_to_geojson, feat_to_bounds
+
+def test_get_transformer():
+    """get_transformer_test"""
+
+    assert get_transformer('epsg:4326', 'epsg:3857') is \
+        get_transformer('epsg:4326', 'epsg:3857')
+
+def test_lonlat_to_bounds():
+    """lonlat_to_bounds_test"""
+
+    for crs in ('epsg:3857', 'epsg:32723', 'epsg:4326'):
+        bounds = lonlat_to_bounds(-43.182365, -22.970722, 10000, crs)
+        reference = feat_to_bounds(lonlat_to_geojson(-43.182365,
+                                                     -22.970722, 10000),
+                                   crs)
+        assert np.allclose(bounds, reference, rtol=0, atol=1e-6)
+
+    assert lonlat_to_bounds(-43.182365, -22.970722) == \
+        feat_to_bounds(lonlat_to_geojson(-43.182365, -22.970722))
+
+def test_lonlat_to_bounds_batch():
+    """lonlat_to_bounds_batch_test"""
+
+    lons = np.array([-43.182365, -56.01551, -45.038277])
+    lats = np.array([-22.970722, -12.8379, -7.425944])
+    for crs in ('epsg:3857', 'epsg:32723'):
+        bounds = lonlat_to_bounds_batch(lons, lats, 4000, crs)
+        assert bounds.shape == (3, 4)
+        for index, (lon, lat) in enumerate(zip(lons, lats)):
+            assert np.allclose(bounds[index],
+                               lonlat_to_bounds(lon, lat, 4000, crs))
@@ -0,0 +1,104 @@
+"""gif_test.py"""
+
+import os
+
+import numpy as np
+from PIL import Image
+
+from cbersgif.gif import GifEncoder, build_palette, delta, palette_lut, \
+    quantize, TRANSPARENT
+from cbersgif.utils import AnimatedGifWriter
+
+def test_palette_lut():
+    """palette_lut_test"""
+
+    rng = np.random.RandomState(0)
+    palette = rng.randint(0, 256, (255, 3)).astype(np.uint8)
+    lut = palette_lut(palette)
+    assert lut.shape == (2 ** 15,)
+
+    # Pixels at the cell centers map to the nearest entry
+    rgb = (rng.randint(0, 32, (20, 20, 3)) * 8 + 4).astype(np.uint8)
+    distances = ((rgb[:, :, np.newaxis].astype(int) - palette) ** 2).sum(-1)
+    expected = distances.min(axis=-1)
+    got = distances.reshape(-1, 255)[np.arange(400),
+                                     quantize(rgb, lut).ravel()]
+    assert np.array_equal(got, expected.ravel())
+
+    # Palette colors in distinct cells are kept
+    cells = rng.choice(2 ** 15, 255, replace=False)
+    palette = (np.stack([cells >> 10, (cells >> 5) & 31, cells & 31],
+                        axis=-1) * 8 + 3).astype(np.uint8)
+    quantized = quantize(palette[np.newaxis], palette_lut(palette))[0]
+    assert np.array_equal(quantized, np.arange(255))
+
+def test_build_palette():
+    """build_palette_test"""
+
+    frames = [np.zeros((10, 10, 3), dtype=np.uint8),
+              np.full((10, 10, 3), 200, dtype=np.uint8)]
+    palette = build_palette(frames)
+    assert palette.shape == (255, 3)
+    assert {tuple(color) for color in palette} == {(0, 0, 0),
+                                                   (200, 200, 200)}
+
+def test_delta():
+    """delta_test"""
+
+    previous = np.zeros((6, 8), dtype=np.uint8)
+    indices = previous.copy()
+    offset, data = delta(indices, previous)
+    assert offset == (0, 0)
+    assert data.shape == (1, 1) and data[0, 0] == TRANSPARENT
+
+    indices[2, 3] = 5
+    indices[4, 6] = 7
+    offset, data = delta(indices, previous)
+    assert offset == (3, 2)
+    assert data.shape == (3, 4)
+    assert data[0, 0] == 5 and data[2, 3] == 7
+    assert np.count_nonzero(data == TRANSPARENT) == 10
+
+def test_gif_encoder(tmp_path):
+    """gif_encoder_test"""
+
+    output_filename = str(tmp_path / 'animated.gif')
+    images = [Image.open('tests/{}.bmp'.format(index)) for index in range(4)]
+    # Last frame repeated, nothing changes
+    images.append(images[-1])
+
+    with GifEncoder(output_filename, 0.5, palette_frames=2) as encoder:
+        for image in images:
+            encoder.append(image)
+    assert encoder.frames == 5
+
+    # Decoded frames are the quantized frames
+    lut = palette_lut(encoder.palette)
+    with Image.open(output_filename) as animation:
+        assert animation.n_frames == 5
+        assert animation.info['loop'] == 0
+        for index, image in enumerate(images):
+            animation.seek(index)
+            assert animation.info['duration'] == 500
+            expected = encoder.palette[quantize(
+                np.asarray(image.convert('RGB')), lut)]
+            assert np.array_equal(np.asarray(animation.convert('RGB')),
+                                  expected)
+
+    # Deltas are smaller than full frames
+    full_filename = str(tmp_path / 'full.gif')
+    with GifEncoder(full_filename, 0.5, palette=encoder.palette,
+                    delta=False) as encoder:
+        for image in images:
+            encoder.append(image)
+    assert os.path.getsize(output_filename) < os.path.getsize(full_filename)
+
+def test_frame_palette(tmp_path):
+    """frame_palette_test"""
+
+    output_filename = str(tmp_path / 'animated.gif')
+    with AnimatedGifWriter(output_filename, 0.5, 'frame') as writer:
+        for index in range(2):
+            writer.append(Image.open('tests/{}.bmp'.format(index)))
+    with Image.open(output_filename) as animation:
+        assert animation.n_frames == 2
@@ -0,0 +1,120 @@
+"""keys_test.py"""
+
+import hashlib
+import pickle
+
+import numpy as np
+
+from cbersgif import keys
+from cbersgif.blocks import BlockCache
+from cbersgif.cache import FrameCache
+from cbersgif.render import GifJob
+from cbersgif.utils import cache_lookup, stac_to_aws_sat_api
+
+SCENE = {'scene_id': 'CBERS_4_MUX_20180911_167_114_L4'}
+S3_KEY = 'CBERS4/MUX/167/114/CBERS_4_MUX_20180911_167_114_L4'
+
+def test_digest():
+    """digest_test"""
+
+    assert keys.digest({'a': 1, 'b': [1, 2]}) == \
+        keys.digest({'b': (1, 2), 'a': 1})
+    assert keys.digest({'a': 1}) != keys.digest({'a': 2})
+    assert len(keys.digest({})) == 32
+    # Keys of the frame files written before the cache index
+    assert keys.legacy_digest({'s3_key': S3_KEY, 'bands': '7,6,5'}) == \
+        'bbee5d39ea2defeb39a2075e9c3875a4'
+
+def test_frame_meta():
+    """frame_meta_test"""
+
+    meta = keys.frame_meta(S3_KEY + '/', 5, {'scene_id': ' cbers_4_mux_'
+                                             '20180911_167_114_l4'},
+                           (1.00001, -0.0, 3, 4), 10.0, 20)
+    # Equivalent inputs share the key
+    assert meta == keys.frame_meta(S3_KEY, '5', SCENE,
+                                   [1.0, 0.0, 3.0, 4.0], 10, 20)
+    assert meta['scene_id'] == SCENE['scene_id']
+    assert meta['bounds'] == [1.0, 0.0, 3.0, 4.0]
+    assert meta['shape'] == [20, 10]
+    assert meta['version'] == keys.KEY_VERSION
+
+def test_migrate(tmp_path):
+    """migrate_test"""
+
+    # Frame entry written by the pickle+md5 scheme
+    old_meta = {'s3_key': S3_KEY, 'band': '5', 'scene': SCENE,
+                'aoi_bounds': [1.0, 2.0, 3.0, 4.0], 'width': 2, 'height': 2}
+    old_key = hashlib.md5(pickle.dumps(sorted(old_meta.items()))).hexdigest()
+    cache = FrameCache(str(tmp_path), max_bytes=10 ** 6)
+    cache.put(old_key, np.ones((2, 2)), old_meta)
+    cache.put('nometa', np.ones(1))
+    assert cache_lookup(cache, S3_KEY, SCENE, ['5'], [1.0, 2.0, 3.0, 4.0],
+                        2, 2) == [None]
+
+    assert cache.rekey(keys.migrate_frame) == \
+        {'migrated': 1, 'current': 0, 'legacy': 1, 'orphaned': 0,
+         'dropped': 0}
+    matrix = cache_lookup(cache, S3_KEY, SCENE, ['5'], [1.0, 2.0, 3.0, 4.0],
+                          2, 2)[0]
+    assert np.array_equal(matrix, np.ones((2, 2)))
+    assert not (tmp_path / '{}.npy'.format(old_key)).exists()
+
+    # Entries without metadata are kept for lookups
+    assert cache.rekey(keys.migrate_frame, drop=True) == \
+        {'migrated': 0, 'current': 1, 'legacy': 1, 'orphaned': 0,
+         'dropped': 0}
+    assert cache.stats()['entries'] == 2
+
+    # Block entries are re-keyed, old headers are dropped
+    block_cache = BlockCache(str(tmp_path))
+    block_cache.store.put('oldblock', np.ones((2, 2)),
+                          {'address': 'band.tif', 'level': 0, 'row': 1,
+                           'col': 2})
+    block_cache.store.put('oldheader', np.zeros(0), {'crs': 'EPSG:32723'})
+    assert block_cache.migrate(drop=True) == \
+        {'migrated': 1, 'current': 0, 'legacy': 0, 'orphaned': 0,
+         'dropped': 1}
+    assert np.array_equal(block_cache.block('band.tif', 0, 1, 2),
+                          np.ones((2, 2)))
+
+def test_legacy_lookup(tmp_path):
+    """legacy_lookup_test"""
+
+    # Frame file written by the version 1 cli for
+    # cbersgif --lat -22.970722 --lon -43.182365 --buffer_size 1000 --res 40
+    scene = stac_to_aws_sat_api(SCENE['scene_id'])
+    s3_key = 's3://cbers-pds/' + scene['key']
+    bounds = (-4808038.8830492785, -2629478.3425390846,
+              -4806038.8830492785, -2627478.3425390846)
+    legacy_key = keys.legacy_frame_key(s3_key, '5', scene, bounds, 50, 50)
+    np.save(str(tmp_path / '{}.npy'.format(legacy_key)), np.ones((50, 50)))
+    cache = FrameCache(str(tmp_path), max_bytes=10 ** 6)
+    assert cache.rekey(keys.migrate_frame, drop=True)['legacy'] == 1
+
+    job = GifJob(-22.970722, -43.182365, buffer_size=1000, res=40)
+    assert job.legacy_aoi == (bounds, 50, 50)
+
+    # Frames read without overviews are not taken from legacy entries
+    assert cache_lookup(cache, s3_key, scene, ['5'], job.aoi_bounds,
+                        job.width, job.height, overviews=False,
+                        legacy_aoi=job.legacy_aoi) == [None]
+    matrix = cache_lookup(cache, s3_key, scene, ['5'], job.aoi_bounds,
+                          job.width, job.height,
+                          legacy_aoi=job.legacy_aoi)[0]
+    assert np.array_equal(matrix, np.ones((50, 50)))
+    assert not (tmp_path / '{}.npy'.format(legacy_key)).exists()
+    assert cache.hits == 1
+    assert cache.rekey(keys.migrate_frame)['current'] == 1
+
+    # Version 1 sizes were truncated, other grids are never reused
+    job = GifJob(-8.3, -55.1, buffer_size=5000, res=20)
+    assert job.legacy_aoi[1:] == (499, 499)
+    assert (job.width, job.height) == (500, 500)
+    legacy_key = keys.legacy_frame_key(s3_key, '5', scene,
+                                       *job.legacy_aoi)
+    np.save(str(tmp_path / '{}.npy'.format(legacy_key)), np.ones((499, 499)))
+    cache = FrameCache(str(tmp_path / 'other'), max_bytes=10 ** 7)
+    assert cache_lookup(cache, s3_key, scene, ['5'], job.aoi_bounds,
+                        job.width, job.height,
+                        legacy_aoi=job.legacy_aoi) == [None]
@@ -0,0 +1,65 @@
+"""planner_test.py"""
+
+import numpy as np
+
+from cbersgif.cache import FrameCache
+from cbersgif.planner import aoi_size, snap_bounds, group_aois, \
+    read_scene_aois
+from cbersgif.utils import IO_STATS, get_scene_stack
+
+from conftest import AOI_BOUNDS
+
+def shifted(bounds, dx, dy):
+    """
+    Bounds moved by dx, dy
+    """
+    return (bounds[0] + dx, bounds[1] + dy, bounds[2] + dx, bounds[3] + dy)
+
+def test_snap_bounds():
+    """snap_bounds_test"""
+
+    bounds = snap_bounds(AOI_BOUNDS, 40)
+    assert aoi_size(bounds, 40) == aoi_size(AOI_BOUNDS, 40) == (50, 50)
+    assert bounds[0] <= AOI_BOUNDS[0] < bounds[0] + 40
+    assert bounds[3] - 40 < AOI_BOUNDS[3] <= bounds[3]
+    assert bounds[0] % 40 == 0 and bounds[3] % 40 == 0
+    assert snap_bounds(bounds, 40) == bounds
+
+def test_group_aois():
+    """group_aois_test"""
+
+    near = [AOI_BOUNDS, shifted(AOI_BOUNDS, 500, 300),
+            shifted(AOI_BOUNDS, -400, 0)]
+    far = shifted(AOI_BOUNDS, 50000, 0)
+    assert group_aois(near) == [[0, 1, 2]]
+    assert sorted(group_aois(near + [far])) == [[0, 1, 2], [3]]
+    assert sorted(group_aois(near, max_ratio=0.5)) == [[0], [1], [2]]
+
+def test_read_scene_aois(synthetic_scene, tmp_path):
+    """read_scene_aois_test"""
+
+    s3_key, scene = synthetic_scene
+    bounds_list = [snap_bounds(bounds, 20) for bounds in
+                   (AOI_BOUNDS, shifted(AOI_BOUNDS, 510, 290),
+                    shifted(AOI_BOUNDS, -390, -110))]
+    cache = FrameCache(str(tmp_path / 'cache'))
+
+    IO_STATS.clear()
+    stacks = read_scene_aois(scene, ['7', '6', '5'], bounds_list, 20,
+                             cache=cache, s3_key=s3_key)
+    # One read per band for the three AOIs
+    assert IO_STATS['reads'] == 3
+
+    for bounds, stack in zip(bounds_list, stacks):
+        assert stack.shape == (3, 100, 100)
+        direct = get_scene_stack(scene, ['7', '6', '5'], bounds, 100, 100,
+                                 cache=False, s3_key=s3_key)
+        assert np.mean(np.abs(direct.astype(int) - stack.astype(int))) < 0.5
+
+    # Slices are cached under the AOI keys
+    IO_STATS.clear()
+    for bounds, stack in zip(bounds_list, stacks):
+        assert np.array_equal(
+            get_scene_stack(scene, ['7', '6', '5'], bounds, 100, 100,
+                            cache=cache, s3_key=s3_key), stack)
+    assert IO_STATS['reads'] == 0
@@ -0,0 +1,59 @@
+"""profiling_test.py"""
+
+import csv
+import json
+
+from cbersgif import profiling
+from cbersgif.profiling import Profiler
+
+def test_profiler(tmp_path):
+    """profiler_test"""
+
+    profiler = Profiler()
+    # Disabled profilers collect nothing
+    with profiler.timer('read'):
+        profiler.count('bytes_read', 10)
+    assert profiler.report()['timers'] == {}
+    assert profiler.report()['counters'] == {}
+
+    profiler.enabled = True
+    for _ in range(2):
+        with profiler.timer('read'):
+            profiler.count('bytes_read', 10)
+    report = profiler.report()
+    assert report['timers']['read']['calls'] == 2
+    assert report['timers']['read']['seconds'] >= \
+        report['timers']['read']['max_seconds'] > 0
+    assert report['counters'] == {'bytes_read': 20}
+
+    profiler.write(str(tmp_path / 'report.json'))
+    with open(str(tmp_path / 'report.json')) as report_file:
+        assert json.load(report_file)['counters'] == {'bytes_read': 20}
+
+    profiler.write(str(tmp_path / 'report.csv'))
+    with open(str(tmp_path / 'report.csv')) as report_file:
+        rows = list(csv.DictReader(report_file))
+    assert [(row['kind'], row['name']) for row in rows] == \
+        [('run', 'wall'), ('timer', 'read'), ('counter', 'bytes_read')]
+    assert rows[2]['value'] == '20'
+
+    profiler.reset()
+    assert profiler.report()['timers'] == {}
+
+def test_timed():
+    """timed_test"""
+
+    @profiling.timed('stage')
+    def stage(value):
+        return value + 1
+
+    profiling.disable()
+    assert stage(1) == 2
+    assert 'stage' not in profiling.report()['timers']
+    profiling.enable()
+    try:
+        assert stage(1) == 2
+        assert profiling.report()['timers']['stage']['calls'] == 1
+    finally:
+        profiling.disable()
+        profiling.PROFILER.reset()
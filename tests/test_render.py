@@ -0,0 +1,122 @@
+"""render_test.py"""
+
+from PIL import Image
+
+from cbersgif.blocks import BlockCache
+from cbersgif.cache import FrameCache, RenderedCache
+from cbersgif.render import GifJob, render_frames, render_gif
+from cbersgif.utils import IO_STATS
+
+# Copacabana
+LON = -43.182365
+LAT = -22.970722
+
+class ListSink:
+    """
+    Sink keeping the frames in memory
+    """
+    def __init__(self):
+        self.images = []
+        self.closed = False
+
+    def append(self, image):
+        """Keep frame"""
+        self.images.append(image)
+
+    def close(self):
+        """Close sink"""
+        self.closed = True
+
+def make_job(local_archive, **kwargs):
+    """
+    Job over the local archive
+    """
+    return GifJob(LAT, LON, start_date='2018-01-01', end_date='2018-01-31',
+                  buffer_size=1000, res=40, stac_endpoint=local_archive.url,
+                  **kwargs)
+
+def test_render_frames(local_archive):
+    """render_frames_test"""
+
+    job = make_job(local_archive, taboo_index='0', enhancement=True)
+    frames = list(render_frames(job))
+    assert [frame[0] for frame in frames] == [1, 2, 3]
+    for _, _, image, error in frames:
+        assert error is None
+        assert image.size == (50, 50)
+    assert len(job.scenes) == 4
+
+def test_render_gif(local_archive, tmp_path):
+    """render_gif_test"""
+
+    # Global enhancement, stacks read again from the cache
+    cache = FrameCache(str(tmp_path / 'cache'))
+    sink = ListSink()
+    result = render_gif(make_job(local_archive, enhancement=True,
+                                 globalenhancement=True), sink,
+                        frame_cache=cache)
+    assert result['frames'] == 4 and result['failed'] == 0
+    assert sink.closed and len(sink.images) == 4
+    assert cache.hits == 12
+
+    output = str(tmp_path / 'out.gif')
+    result = render_gif(make_job(local_archive, max_images=2), output)
+    assert result['output'] == output
+    with Image.open(output) as gif:
+        assert gif.n_frames == 2
+
+def test_render_procs(local_archive):
+    """render_procs_test"""
+
+    for options in ({}, {'enhancement': True},
+                    {'enhancement': True, 'singleenhancement': True}):
+        reference = list(render_frames(make_job(local_archive, **options)))
+        frames = list(render_frames(make_job(local_archive, render_procs=2,
+                                             **options)))
+        assert [frame[0] for frame in frames] == [0, 1, 2, 3]
+        for (_, _, image, _), (_, _, expected, _) in zip(frames, reference):
+            assert image.tobytes() == expected.convert('RGB').tobytes()
+
+def test_rendered_cache(local_archive, tmp_path):
+    """rendered_cache_test"""
+
+    render_cache = RenderedCache(str(tmp_path / 'cache'))
+    reference = list(render_frames(make_job(local_archive, enhancement=True),
+                                   render_cache=render_cache))
+    assert render_cache.stats()['entries'] == 4
+
+    # Second pass with a taboo index is not read nor drawn again
+    IO_STATS.clear()
+    frames = list(render_frames(make_job(local_archive, enhancement=True,
+                                         taboo_index='1'),
+                                render_cache=render_cache))
+    assert IO_STATS['reads'] == 0
+    assert [frame[0] for frame in frames] == [0, 2, 3]
+    for (_, _, image, _), (_, _, expected, _) in zip(
+            frames, [reference[0]] + reference[2:]):
+        assert image.tobytes() == expected.tobytes()
+
+    # Other enhancement parameters are new frames
+    list(render_frames(make_job(local_archive, enhancement=True,
+                                contrast_factor=1.5),
+                       render_cache=render_cache))
+    assert render_cache.stats()['entries'] == 8
+
+    # Global stretch frames are found once the stretch is known, also
+    # by a render pool
+    cache = FrameCache(str(tmp_path / 'frames'))
+    for render_procs in (0, 2, 0):
+        frames = list(render_frames(make_job(local_archive, enhancement=True,
+                                             globalenhancement=True,
+                                             render_procs=render_procs),
+                                    frame_cache=cache,
+                                    render_cache=render_cache))
+        assert [frame[0] for frame in frames] == [0, 1, 2, 3]
+    assert render_cache.stats()['entries'] == 12
+    assert render_cache.stats()['hits'] == 3 + 4 + 4
+
+    # Frames warped from cached blocks are not taken from direct reads
+    list(render_frames(make_job(local_archive, enhancement=True),
+                       block_cache=BlockCache(str(tmp_path / 'blocks')),
+                       render_cache=render_cache))
+    assert render_cache.stats()['entries'] == 16
@@ -0,0 +1,65 @@
+"""screen_test.py"""
+
+import numpy as np
+
+from cbersgif.render import GifJob
+from cbersgif.screen import band_scores, screen_size, screen_scenes
+from cbersgif.utils import IO_STATS, stac_to_aws_sat_api
+
+from conftest import AOI_BOUNDS
+
+def archive_scenes(local_archive):
+    """
+    (scene_no, scene) for the local archive scenes
+    """
+    return [(index, stac_to_aws_sat_api(item['id']))
+            for index, item in enumerate(local_archive.items)]
+
+def test_band_scores():
+    """band_scores_test"""
+
+    matrix = np.full((10, 10), 100, dtype=np.uint8)
+    matrix[:5] = 0
+    matrix[5, :5] = 250
+    scores = band_scores(matrix, 200)
+    assert scores['nodata'] == 0.5
+    assert scores['cloud'] == 0.1
+    assert band_scores(np.zeros((4, 4)))['cloud'] == 0.0
+    assert screen_size((0, 0, 4000, 2000)) == (32, 16)
+
+def test_screen_scenes(local_archive):
+    """screen_scenes_test"""
+
+    selected = archive_scenes(local_archive)[1:]
+
+    IO_STATS.clear()
+    assert screen_scenes(selected, '5', AOI_BOUNDS, cache=False) == selected
+    assert IO_STATS['reads'] == 3
+    # Decimated reads come from overviews
+    assert IO_STATS['overview_reads'] == 3
+
+    # All valid pixels are bright
+    assert screen_scenes(selected, '5', AOI_BOUNDS, cloud_value=1,
+                         cache=False) == []
+
+    # AOI half outside the west edge of the band files
+    outside = (AOI_BOUNDS[0] - 4765, AOI_BOUNDS[1],
+               AOI_BOUNDS[2] - 4765, AOI_BOUNDS[3])
+    assert screen_scenes(selected, '5', outside, max_nodata=0.3,
+                         cache=False) == []
+    assert screen_scenes(selected, '5', outside, max_nodata=0.7,
+                         cache=False) == selected
+
+def test_screen_job(local_archive):
+    """screen_job_test"""
+
+    job = GifJob(-22.970722, -43.182365, start_date='2018-01-01',
+                 end_date='2018-01-31', buffer_size=1000, res=40,
+                 stac_endpoint=local_archive.url, taboo_index='1',
+                 screen=True, cloud_value=1)
+    assert job.selected() == []
+    job = GifJob(-22.970722, -43.182365, start_date='2018-01-01',
+                 end_date='2018-01-31', buffer_size=1000, res=40,
+                 stac_endpoint=local_archive.url, taboo_index='1',
+                 screen=True)
+    assert [scene_no for scene_no, _ in job.selected()] == [0, 2, 3]
@@ -28,3 +28,28 @@ def test_search():
                      limit=300)
     #print(ids)
     assert len(ids) == 12
+
+def test_search_pagination(fake_stac):
+    """search_pagination_test"""
+
+    ss1 = StacSearch(fake_stac.url)
+    assert ss1.is_online()
+
+    ids = ss1.search(instrument='MUX',
+                     start_date='2018-01-01',
+                     end_date='2018-12-31',
+                     bbox=[0, 0, 0, 0],
+                     limit=10)
+    assert len(ids) == 25
+    assert len(set(item['id'] for item in ids)) == 25
+    assert len(fake_stac.requests) == 3
+    assert fake_stac.requests[2]['page'] == 3
+
+    # Items are available as soon as the first page arrives
+    items = ss1.iter_search(instrument='MUX',
+                            start_date='2018-01-01',
+                            end_date='2018-12-31',
+                            bbox=[0, 0, 0, 0],
+                            limit=10)
+    next(items)
+    assert len(fake_stac.requests) == 4
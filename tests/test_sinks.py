@@ -0,0 +1,59 @@
+"""sinks_test.py"""
+
+import numpy as np
+
+import pytest
+
+from PIL import Image
+
+from cbersgif import sinks
+from cbersgif.utils import AnimatedGifWriter
+
+def frames(count=4, size=(40, 30)):
+    """Random RGB frames"""
+    rng = np.random.RandomState(0)
+    return [Image.fromarray(rng.randint(0, 255, (size[1], size[0], 3)).
+                            astype(np.uint8)) for _ in range(count)]
+
+def test_get_writer(tmp_path, monkeypatch):
+    """get_writer_test"""
+
+    assert isinstance(sinks.get_writer(str(tmp_path / 'a.GIF'), 0.5),
+                      AnimatedGifWriter)
+    assert isinstance(sinks.get_writer(str(tmp_path / 'a.webp'), 0.5),
+                      sinks.WebPWriter)
+    with pytest.raises(AssertionError):
+        sinks.get_writer(str(tmp_path / 'a.avi'), 0.5)
+    monkeypatch.setattr(sinks, 'ffmpeg_exe', lambda: None)
+    with pytest.raises(RuntimeError):
+        sinks.get_writer(str(tmp_path / 'a.mp4'), 0.5)
+
+def test_webp_writer(tmp_path):
+    """webp_writer_test"""
+
+    images = frames()
+    output = str(tmp_path / 'out.webp')
+    with sinks.WebPWriter(output, 0.25, lossless=True) as writer:
+        for image in images:
+            writer.append(image)
+    with Image.open(output) as webp:
+        assert webp.n_frames == 4
+        assert webp.size == (40, 30)
+        for index, image in enumerate(images):
+            webp.seek(index)
+            webp.load()
+            assert webp.info['duration'] == 250
+            assert np.array_equal(np.asarray(webp.convert('RGB')),
+                                  np.asarray(image))
+
+@pytest.mark.skipif(sinks.ffmpeg_exe() is None, reason='ffmpeg not found')
+@pytest.mark.parametrize('extension', ['.mp4', '.webm'])
+def test_video_writer(tmp_path, extension):
+    """video_writer_test"""
+
+    output = tmp_path / ('out' + extension)
+    with sinks.get_writer(str(output), 0.5) as writer:
+        for image in frames(size=(41, 31)):
+            writer.append(image)
+    assert writer.frames == 4
+    assert output.stat().st_size > 0
@@ -1,16 +1,30 @@
 """utils_test.py"""
 
 import math
+import time
 
 import difflib
 import contextlib
+import json
 import os
 
+import numpy as np
+
 from PIL import Image
 
+import rasterio as rio
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+
+import cbersgif.utils
 from cbersgif.utils import search, lonlat_to_geojson, \
     feat_to_bounds, save_animated_gif, frame_hash, \
-    stac_to_aws_sat_api
+    stac_to_aws_sat_api, fetch_frames, get_scene_stack, \
+    AnimatedGifWriter, IO_STATS, read_points
+
+from cbersgif.cache import FrameCache, SearchCache
+
+from conftest import AOI_BOUNDS
 
 STAC_ENDPOINT = 'https://stac.amskepler.com/v100/search'
 
@@ -74,6 +88,87 @@ def test_search_stac_mode():
                      'CBERS4/MUX/151/126/CBERS_4_MUX_20150215_151_126_L2'
     assert result[0]['acquisition_date'] == '20150215'
 
+def test_search_stac_cache(fake_stac, tmp_path):
+    """search_stac_cache_test"""
+
+    search_cache = SearchCache(str(tmp_path))
+    kwargs = {'sensor': 'MUX', 'lon': -43.1729, 'lat': -22.9068,
+              'mode': 'stac', 'stac_endpoint': fake_stac.url,
+              'start_date': '2018-01-01', 'search_cache': search_cache}
+    result = search(end_date='2018-05-31', **kwargs)
+    assert len(result) == 15
+    assert result[0]['acquisition_date'] == '20180101'
+    requests = len(fake_stac.requests)
+
+    assert search(end_date='2018-05-31', **kwargs) == result
+    assert len(fake_stac.requests) == requests
+
+    result = search(end_date='2018-12-31', **kwargs)
+    assert len(result) == 25
+    assert fake_stac.requests[-1]['datetime'].startswith('2018-05-31')
+
+def test_search_early_stop(fake_stac, tmp_path, monkeypatch):
+    """search_early_stop_test"""
+
+    monkeypatch.setattr(cbersgif.utils, 'STAC_PAGE_SIZE', 4)
+    search_cache = SearchCache(str(tmp_path))
+    kwargs = {'sensor': 'MUX', 'lon': -43.1729, 'lat': -22.9068,
+              'mode': 'stac', 'stac_endpoint': fake_stac.url,
+              'start_date': '2018-01-01', 'end_date': '2018-12-31',
+              'search_cache': search_cache}
+
+    # Sorted pages, the second page completes the first 5 dates
+    result = search(max_scenes=5, **kwargs)
+    assert [scene['acquisition_date'] for scene in result] == \
+        ['20180101', '20180102', '20180103', '20180201', '20180202']
+    assert len(fake_stac.requests) == 2
+    assert fake_stac.requests[0]['sortby'][0]['field'] == 'datetime'
+    # Partial results are cached up to the day before the last scene
+    # read, they are enough for the same search
+    assert search(max_scenes=5, **kwargs) == result
+    assert len(fake_stac.requests) == 2
+    # and extended for more scenes
+    result = search(max_scenes=8, **kwargs)
+    assert [scene['acquisition_date'] for scene in result][5:] == \
+        ['20180203', '20180301', '20180302']
+    assert fake_stac.requests[-1]['datetime'].startswith('2018-02-02')
+    assert len(fake_stac.requests) == 5
+
+    result = search(one_per='month', max_scenes=100, **kwargs)
+    assert [scene['acquisition_date'] for scene in result] == \
+        ['2018{:02d}01'.format(month) for month in range(1, 10)]
+    requests = len(fake_stac.requests)
+    assert search(one_per='year', max_scenes=100, **kwargs) == result[:1]
+    assert len(fake_stac.requests) == requests
+
+def test_search_cache_later_start(fake_stac, tmp_path):
+    """search_cache_later_start_test"""
+
+    kwargs = {'sensor': 'MUX', 'lon': -43.1729, 'lat': -22.9068,
+              'mode': 'stac', 'stac_endpoint': fake_stac.url,
+              'end_date': '2018-12-31', 'max_scenes': 5}
+    search_cache = SearchCache(str(tmp_path))
+    search(start_date='2018-01-01', search_cache=search_cache, **kwargs)
+    # Starts after the dates of the partial cached result
+    result = search(start_date='2018-04-01', search_cache=search_cache,
+                    **kwargs)
+    assert result == search(start_date='2018-04-01', **kwargs)
+    assert [scene['acquisition_date'] for scene in result] == \
+        ['20180401', '20180402', '20180403', '20180501', '20180502']
+
+def test_search_unsorted(fake_stac):
+    """search_unsorted_test"""
+
+    # Services without the sort extension reject sortby
+    fake_stac.sortable = False
+    result = search(sensor='MUX', lon=-43.1729, lat=-22.9068, mode='stac',
+                    stac_endpoint=fake_stac.url, start_date='2018-01-01',
+                    end_date='2018-12-31', max_scenes=5)
+    assert [scene['acquisition_date'] for scene in result] == \
+        ['20180101', '20180102', '20180103', '20180201', '20180202']
+    assert 'sortby' in fake_stac.requests[0]
+    assert all('sortby' not in body for body in fake_stac.requests[1:])
+
 def test_search_date():
     """search_date_test"""
 
@@ -149,6 +244,23 @@ def test_save_animated_gif():
     # diff would work on distinct machines/lib versions
     assert os.path.exists(output_filename)
 
+def test_animated_gif_writer(tmp_path):
+    """animated_gif_writer_test"""
+
+    output_filename = str(tmp_path / 'animated.gif')
+
+    # Nothing is written without frames
+    with AnimatedGifWriter(output_filename, 0.5):
+        pass
+    assert not os.path.exists(output_filename)
+
+    with AnimatedGifWriter(output_filename, 0.5) as writer:
+        for index in range(4):
+            writer.append(Image.open('tests/{}.bmp'.format(index)))
+    assert writer.frames == 4
+    with Image.open(output_filename) as gif:
+        assert gif.n_frames == 4
+
 def test_frame_hash():
     """frame_hash_test"""
 
@@ -172,4 +284,138 @@ def test_frame_hash():
     # Distinct hashes for distinct contents
     assert hash_result_1 != hash_result_3
     # Absolute hash value should always be the same
-    assert hash_result_1 == 'bbee5d39ea2defeb39a2075e9c3875a4'
+    assert hash_result_1 == '8cb093927502645e0ee592ff474165cf'
+
+def test_fetch_frames(monkeypatch):
+    """fetch_frames_test"""
+
+    def fake_get_scene_stack(scene, bands, aoi_bounds, # pylint: disable=too-many-arguments,unused-argument
+                             width, height, cache, overviews, block_cache=None,
+                             legacy_aoi=None):
+        # Earlier scenes are slower, output order must not change
+        time.sleep(0.01 * (5 - scene['index']))
+        if scene['index'] == 2:
+            raise RuntimeError('bad scene')
+        return ['{}-{}'.format(scene['index'], band) for band in bands]
+
+    monkeypatch.setattr(cbersgif.utils, 'get_scene_stack',
+                        fake_get_scene_stack)
+
+    scenes = [(index, {'key': 'k{}'.format(index), 'index': index})
+              for index in range(5)]
+    result = list(fetch_frames(scenes, ['7', '6', '5'], None, 1, 1,
+                               workers=3))
+    assert [item[0] for item in result] == [0, 1, 2, 3, 4]
+    assert result[0][2] == ['0-7', '0-6', '0-5']
+    assert result[2][2] is None
+    assert isinstance(result[2][3], RuntimeError)
+    assert result[4][2] == ['4-7', '4-6', '4-5']
+
+def test_get_scene_stack(synthetic_scene):
+    """get_scene_stack_test"""
+
+    s3_key, scene = synthetic_scene
+    stack = get_scene_stack(scene, ['7', '6', '5'], AOI_BOUNDS, 100, 100,
+                            cache=False, s3_key=s3_key, overviews=False)
+    assert stack.shape == (3, 100, 100)
+
+    # Same result as the per band window read over the default warp grid
+    for band_no, band in enumerate(['7', '6', '5']):
+        with rio.open('{}/{}_BAND{}.tif'.format(s3_key, scene['scene_id'],
+                                                band)) as src:
+            with WarpedVRT(src, crs='EPSG:3857',
+                           resampling=Resampling.bilinear) as vrt:
+                reference = vrt.read(window=vrt.window(*AOI_BOUNDS),
+                                     out_shape=(100, 100), indexes=1,
+                                     resampling=Resampling.bilinear)
+        diff = np.abs(stack[band_no].astype(int) - reference.astype(int))
+        assert np.mean(diff) < 1.0
+
+def test_get_scene_stack_cache(synthetic_scene, tmp_path):
+    """get_scene_stack_cache_test"""
+
+    s3_key, scene = synthetic_scene
+    cache = FrameCache(str(tmp_path / 'cache'))
+    first = get_scene_stack(scene, ['7', '6', '5'], AOI_BOUNDS, 50, 50,
+                            cache=cache, s3_key=s3_key)
+    second = get_scene_stack(scene, ['7', '6', '5'], AOI_BOUNDS, 50, 50,
+                             cache=cache, s3_key=s3_key)
+    assert np.array_equal(first, second)
+    assert cache.misses == 3
+    assert cache.hits == 3
+
+def test_get_scene_stack_overviews(synthetic_scene):
+    """get_scene_stack_overviews_test"""
+
+    s3_key, scene = synthetic_scene
+    center_x = (AOI_BOUNDS[0] + AOI_BOUNDS[2]) / 2
+    center_y = (AOI_BOUNDS[1] + AOI_BOUNDS[3]) / 2
+    aoi_bounds = (center_x - 4000, center_y - 4000,
+                  center_x + 4000, center_y + 4000)
+
+    # About 300m output pixels, 20m source pixels with 2x and 4x overviews
+    IO_STATS.clear()
+    full = get_scene_stack(scene, ['7'], aoi_bounds, 25, 25, cache=False,
+                           s3_key=s3_key, overviews=False)
+    full_bytes = IO_STATS['bytes']
+    assert IO_STATS['overview_reads'] == 0
+
+    IO_STATS.clear()
+    coarse = get_scene_stack(scene, ['7'], aoi_bounds, 25, 25, cache=False,
+                             s3_key=s3_key)
+    assert IO_STATS['overview_reads'] == 1
+    assert IO_STATS['bytes'] * 4 < full_bytes
+    assert np.mean(np.abs(full.astype(int) - coarse.astype(int))) < 2.0
+
+    # Fine output still uses full resolution
+    IO_STATS.clear()
+    get_scene_stack(scene, ['7'], AOI_BOUNDS, 100, 100, cache=False,
+                    s3_key=s3_key)
+    assert IO_STATS['overview_reads'] == 0
+
+def test_get_scene_stack_overviews_cache(synthetic_scene, tmp_path):
+    """get_scene_stack_overviews_cache_test"""
+
+    s3_key, scene = synthetic_scene
+    center_x = (AOI_BOUNDS[0] + AOI_BOUNDS[2]) / 2
+    center_y = (AOI_BOUNDS[1] + AOI_BOUNDS[3]) / 2
+    aoi_bounds = (center_x - 4000, center_y - 4000,
+                  center_x + 4000, center_y + 4000)
+    cache = FrameCache(str(tmp_path / 'cache'))
+
+    coarse = get_scene_stack(scene, ['7'], aoi_bounds, 25, 25, cache=cache,
+                             s3_key=s3_key)
+    # Frames read from overviews are not returned for full resolution
+    IO_STATS.clear()
+    full = get_scene_stack(scene, ['7'], aoi_bounds, 25, 25, cache=cache,
+                           s3_key=s3_key, overviews=False)
+    assert IO_STATS['reads'] == 1
+    assert IO_STATS['overview_reads'] == 0
+    assert np.array_equal(full, get_scene_stack(
+        scene, ['7'], aoi_bounds, 25, 25, cache=False, s3_key=s3_key,
+        overviews=False))
+    assert np.array_equal(coarse, get_scene_stack(
+        scene, ['7'], aoi_bounds, 25, 25, cache=cache, s3_key=s3_key))
+    assert cache.hits == 1
+
+def test_read_points(tmp_path):
+    """read_points_test"""
+
+    csv_file = tmp_path / 'points.csv'
+    csv_file.write_text('ID,Lat,Lon,start_date,buffer_size\n'
+                        'alert1,-7.42,-45.03,2017-01-01,4000\n'
+                        ',-12.8,-56.0,,\n')
+    jobs = read_points(str(csv_file))
+    assert jobs == [{'id': 'alert1', 'lat': -7.42, 'lon': -45.03,
+                     'start_date': '2017-01-01', 'buffer_size': 4000},
+                    {'id': '1', 'lat': -12.8, 'lon': -56.0}]
+
+    geojson_file = tmp_path / 'points.geojson'
+    geojson_file.write_text(json.dumps({
+        'type': 'FeatureCollection',
+        'features': [{'type': 'Feature', 'id': 7,
+                      'geometry': {'type': 'Point',
+                                   'coordinates': [-45.03, -7.42]},
+                      'properties': {'taboo_index': '1,2'}}]}))
+    assert read_points(str(geojson_file)) == \
+        [{'id': '7', 'lat': -7.42, 'lon': -45.03, 'taboo_index': '1,2'}]